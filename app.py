@@ -1,11 +1,21 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
-from db_manager import TIManager, Faction, GameParticipant
+from flask import Flask, Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response, send_from_directory, abort, stream_with_context
+from draft_events import draft_events, sse_stream
+from fragment_cache import history_card_cache
+from history_io import detect_format, iter_records, export_lines, FORMATS
+from markupsafe import Markup
+from db_manager import (TIManager, GameParticipant, HistoryFilter, VersionConflict, get_faction_catalog, init_engine,
+                        DEFAULT_DRAFT_ENGINE)
+from metrics import request_metrics
+from logging_setup import setup_logging
+from maintenance import JOB_NAMES, run_maintenance, start_maintenance
+import click
+import csv
+import io
 import logging
-import sys
-import json
-import re
 import os
-from datetime import datetime
+import json
+import time
+from datetime import datetime, timedelta
 
 # --- 1. ÚTVONALAK BEÁLLÍTÁSA (Hogy a szerver megtalálja a fájlokat) ---
 # Megkeressük, hol van EZ a fájl (app.py) a szerveren:
@@ -13,53 +23,84 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # Összerakjuk a Log fájl teljes útvonalát:
 # Ez így pl: /home/schdani/mysite/ti_manager.log lesz
-LOG_PATH = os.path.join(BASE_DIR, 'ti_manager.log')
-
-# --- 2. LOGOLÁS BEÁLLÍTÁSA ---
-# Először törlünk minden korábbi log beállítást (hogy ne akadjon össze a rendszerrel)
-root = logging.getLogger()
-if root.handlers:
-    for handler in root.handlers:
-        root.removeHandler(handler)
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s | %(message)s',
-    handlers=[
-        # Itt használjuk a TELJES útvonalat:
-        logging.FileHandler(LOG_PATH, encoding='utf-8'),
+LOG_PATH = os.environ.get('TI_LOG_PATH') or os.path.join(BASE_DIR, 'ti_manager.log')
 
-        # A konzolra írást (sys.stderr) meghagyjuk a hibakereséshez:
-        logging.StreamHandler(sys.stderr)
-    ]
-)
+# A draft események (JSON sorok) külön fájlba kerülnek:
+AUDIT_LOG_PATH = os.environ.get('TI_AUDIT_LOG_PATH') or os.path.join(BASE_DIR, 'ti_audit.log')
 
-app = Flask(__name__)
-app.secret_key = 'szupertitkos_kulcs_ti4'
+# Az útvonalak egy blueprintben vannak, az alkalmazást a create_app() rakja össze.
+# cli_group=None: a parancsok maradnak "flask rebuild-stats" (nem "flask main rebuild-stats")
+bp = Blueprint('main', __name__, cli_group=None)
 
+# A példányosítás nem nyúl az adatbázishoz, a kapcsolat az első kérésnél nyílik meg
+db = TIManager()
 
-# ... (innen lefelé minden maradhat a régiben)
 
-# Adatbázis indítása
-logging.info("--- APP INDULÁSA... ---")
-db = TIManager()
+# --- 2. ALKALMAZÁS GYÁR ---
 
-@app.route('/set_winner/<int:game_id>/<int:player_id>')
+def create_app(init_db=None):
+    """
+    Az alkalmazás összerakása. Importáláskor semmi sem fut, így a workerek gyorsan indulnak.
+    init_db: fusson-e az egyszeri indítási munka (táblák, fajok, migrációk). Alapból igen,
+    kivéve ha TI_INIT_DB=0 - több workeres szervernél ezt egyszer, a workerek előtt kell
+    elvégezni (flask --app app init-db, vagy a gunicorn.conf.py on_starting hookja).
+    """
+    # A kérések csak egy sorba tesznek, a fájlba írás háttérszálon megy (lásd logging_setup.py)
+    setup_logging(LOG_PATH, AUDIT_LOG_PATH)
+
+    logging.info("--- APP INDULÁSA... ---")
+    app = Flask(__name__)
+    app.secret_key = 'szupertitkos_kulcs_ti4'
+
+    engine = init_engine()
+    if init_db is None:
+        init_db = os.environ.get('TI_INIT_DB', '1') != '0'
+    if init_db:
+        db.prepare_database()
+
+    # Mérés: végpontonkénti válaszidő + SQL lekérdezések (lásd metrics.py, kimenet: /metrics)
+    request_metrics.init_app(app, engine)
+    request_metrics.register_gauge('ti_history_card_cache_entries', "Gyorsítótárazott history kártyák száma.",
+                                   lambda: history_card_cache.stats()["entries"])
+    request_metrics.register_gauge('ti_history_card_cache_hits', "History kártya gyorsítótár találatok (indulás óta).",
+                                   lambda: history_card_cache.stats()["hits"])
+    request_metrics.register_gauge('ti_history_card_cache_misses', "History kártya gyorsítótár tévedések (indulás óta).",
+                                   lambda: history_card_cache.stats()["misses"])
+    request_metrics.register_gauge('ti_sse_subscribers', "Nyitott élő draft (SSE) kapcsolatok.",
+                                   draft_events.subscriber_count)
+
+    app.teardown_appcontext(close_db_session)
+    app.register_blueprint(bp)
+    return app
+
+def close_db_session(exception=None):
+    # Minden kérés végén eldobjuk a kérés session-jét (hiba esetén a félkész tranzakciót is visszagörgeti)
+    db.close_session()
+
+@bp.route('/set_winner/<int:game_id>/<int:player_id>')
 def set_winner(game_id, player_id):
-    db.set_game_winner(game_id, player_id)
-    # Nem kell flash üzenet, mert zavaró lenne minden kattintásnál,
+    # A kártya a látott verzióval küldi: ha közben más módosította a meccset, nem írjuk felül
+    try:
+        db.set_game_winner(game_id, player_id, expected_version=request.args.get('version', type=int))
+    except VersionConflict:
+        history_card_cache.invalidate_game(game_id)
+        flash("Közben valaki más módosította ezt a meccset - nézd meg újra, és kattints még egyszer!", "warning")
+        return redirect(url_for('main.history', _anchor=f'game-{game_id}'))  # egyből az érintett kártyához
+    history_card_cache.invalidate_game(game_id)
+    # Sikernél nem kell flash üzenet, mert zavaró lenne minden kattintásnál,
     # a vizuális visszajelzés (arany trófea) elég lesz.
-    return redirect(url_for('history'))
+    return redirect(url_for('main.history'))
 
-@app.route('/delete_game/<int:game_id>', methods=['POST'])
+@bp.route('/delete_game/<int:game_id>', methods=['POST'])
 def delete_game(game_id):
+    history_card_cache.invalidate_game(game_id)
     if db.delete_game(game_id):
         flash("Meccs sikeresen törölve!", "success")
     else:
         flash("Hiba történt a törléskor.", "error")
-    return redirect(url_for('history'))
+    return redirect(url_for('main.history'))
 
-@app.route('/add_manual_game', methods=['POST'])
+@bp.route('/add_manual_game', methods=['POST'])
 def add_manual_game():
     try:
         # 1. Dátum feldolgozása
@@ -92,26 +133,112 @@ def add_manual_game():
         flash(f"Hiba történt: {e}", "error")
         logging.error(f"Manual Add Error: {e}")
 
-    return redirect(url_for('history'))
+    return redirect(url_for('main.history'))
+
+# --- TÖMEGES IMPORT / EXPORT (CSV / JSONL, lásd history_io.py) ---
+
+def import_summary(result):
+    message = f"Import: {result['imported']} meccs betöltve, {result['skipped']} kihagyva"
+    if result['players_created']:
+        message += f", {result['players_created']} új játékos"
+    return message + "."
+
+@bp.route('/import_history', methods=['POST'])
+def import_history():
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash("Nincs kiválasztva fájl.", "error")
+        return redirect(url_for('main.history'))
+
+    fmt = detect_format(upload.filename, request.form.get('format'))
+    if fmt not in FORMATS:
+        flash(f"Ismeretlen formátum: {fmt}", "error")
+        return redirect(url_for('main.history'))
 
-@app.template_filter('slugify_faction')
+    # A feltöltött fájlt soronként olvassuk, nem töltjük be egyben
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    try:
+        result = db.import_games(iter_records(stream, fmt), create_players=bool(request.form.get('create_players')))
+    except (UnicodeDecodeError, csv.Error) as e:
+        flash(f"A fájl nem olvasható: {e}", "error")
+        return redirect(url_for('main.history'))
+
+    history_card_cache.clear()
+    flash(import_summary(result), "success" if result['imported'] else "warning")
+    for line, message in result['errors'][:10]:
+        flash(f"{line}. sor: {message}", "warning")
+    return redirect(url_for('main.history'))
+
+@bp.route('/export_history')
+def export_history():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        abort(400)
+    catalog = get_faction_catalog()
+    # stream_with_context: a kérés (és a DB session takarítása) a stream végéig él
+    body = stream_with_context(export_lines(db.iter_finished_games(), fmt, catalog.name))
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(body, mimetype=f'{mimetype}; charset=utf-8')
+    response.headers['Content-Disposition'] = f'attachment; filename=ti_history.{fmt}'
+    return response
+
+@bp.app_template_filter('slugify_faction')
 def slugify_faction(name):
     """
     Átalakítja a faj nevét a fájlneved formátumára.
     Pl.: "The Federation of Sol" -> "the_federation_of_sol"
+    (A katalógusban előre kiszámolt érték, nem fut regex minden hívásnál.)
     """
     if not name: return ""
-    s = name.lower()
-    # Kivesz minden speciális karaktert (kötőjel, aposztróf), csak betű és szám marad
-    s = re.sub(r'[^a-z0-9\s]', '', s)
-    # A szóközöket alulvonásra cseréli
-    s = s.replace(' ', '_')
-    return s
-
-@app.route('/')
+    return get_faction_catalog().slug(name)
+
+# --- STATIKUS KÉPEK (build_assets.py által készített, hash-es változatok) ---
+ASSET_BUILD_DIR = os.path.join(BASE_DIR, 'static', 'build')
+ASSET_MANIFEST_PATH = os.path.join(ASSET_BUILD_DIR, 'manifest.json')
+ASSET_MAX_AGE = 365 * 24 * 3600  # a fájlnévben ott a hash, így "örökre" cache-elhető
+
+_asset_manifest = None
+
+def get_asset_manifest():
+    """A manifest egyszer töltődik be; ha nincs (nem futott a build), üres -> eredeti képek."""
+    global _asset_manifest
+    if _asset_manifest is None:
+        try:
+            with open(ASSET_MANIFEST_PATH, encoding='utf-8') as f:
+                _asset_manifest = json.load(f)
+            logging.info(f"Asset manifest betöltve ({len(_asset_manifest)} kép).")
+        except (OSError, ValueError):
+            _asset_manifest = {}
+    return _asset_manifest
+
+@bp.app_template_global()
+def asset_url(path, fmt='jpg'):
+    """
+    Egy static/ alatti kép URL-je: a buildelt (átméretezett, hash-es) változat, ha van.
+    fmt='webp': a WebP változat URL-je, vagy None, ha nincs ilyen.
+    """
+    entry = get_asset_manifest().get(path)
+    if entry and entry.get(fmt):
+        return url_for('main.built_asset', filename=entry[fmt])
+    return None if fmt == 'webp' else url_for('static', filename=path)
+
+@bp.route('/assets/<path:filename>')
+def built_asset(filename):
+    if not get_asset_manifest():
+        abort(404)
+    response = send_from_directory(ASSET_BUILD_DIR, filename, max_age=ASSET_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={ASSET_MAX_AGE}, immutable'
+    return response
+
+@bp.app_context_processor
+def inject_faction_catalog():
+    # Minden sablonban elérhető: faction_catalog.name(id), faction_catalog.all, ...
+    return {"faction_catalog": get_faction_catalog()}
+
+@bp.route('/')
 def index():
-    # 1. Lekérjük a játékokat
-    games = db.get_all_games()
+    # 1. A futó draftok (indexelt lekérdezés, a history méretétől független) + játékosok
+    active_drafts = db.get_active_drafts()
     players = db.get_all_players()
 
     # 2. Megnézzük, hogy a felhasználó kérte-e KÉNYSZERÍTVE a menüt
@@ -119,13 +246,16 @@ def index():
     force_show = request.args.get('force')
 
     # 3. Az Átirányítás Logika
-    # Ha NINCS kényszerítés ÉS VAN aktív játék -> Irány a Draft!
-    if not force_show and games and games[0].is_active:
-        return redirect(url_for('draft_view'))
+    # Ha NINCS kényszerítés ÉS pontosan EGY draft fut -> Irány a Draft!
+    # (Több asztalnál a főoldal listázza őket, onnan lehet választani.)
+    if not force_show and len(active_drafts) == 1:
+        return redirect(url_for('main.draft_view', game_id=active_drafts[0].id))
 
-    # Egyébként (vagy nincs játék, vagy kértük a menüt) -> Főoldal betöltése
-    return render_template('index.html', players=players, games=games)
-@app.route('/add_player', methods=['POST'])
+    # A motorválasztó a beállított (TI_DRAFT_ENGINE) motorral induljon
+    return render_template('index.html', players=players, active_drafts=active_drafts,
+                           default_engine=DEFAULT_DRAFT_ENGINE)
+
+@bp.route('/add_player', methods=['POST'])
 def add_player():
     name = request.form.get('name')
     if name:
@@ -134,134 +264,479 @@ def add_player():
             flash(f"{name} hozzáadva!", "success")
         else:
             flash("Ez a játékos már létezik!", "error")
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/start_draft', methods=['POST'])
+@bp.route('/start_draft', methods=['POST'])
 def start_draft():
     player_ids = request.form.getlist('player_ids')
 
     if len(player_ids) < 3:
         flash("Legalább 3 játékost válassz ki!", "error")
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index', force=1))
 
     player_ids_int = [int(pid) for pid in player_ids]
 
+    # Aki egy másik asztal futó draftjában ül (ahol már választottak, vagy más is ül), nem ülhet le
+    # egy újhoz; csak ugyanennek az asztalnak az érintetlen draftja sorsolható újra
+    seated = db.get_seated_players(player_ids_int)
+    if seated:
+        flash(f"Már egy futó draftban ülnek: {', '.join(seated)}", "error")
+        return redirect(url_for('main.index', force=1))
+
     logging.info(f"Kérés: Új SORSOLÁS indítása {len(player_ids_int)} fővel...")
-    db.start_new_game_draft(player_ids_int)
+    game_id, _ = db.start_new_game_draft(player_ids_int, engine=request.form.get('engine'))
 
     flash("Új sorsolás elindult!", "success")
-    return redirect(url_for('draft_view'))
-
-@app.route('/draft')
-def draft_view():
-    games = db.get_all_games()
-
-    # Ha nincs játék, VAGY a legutolsó játék már le van zárva (nem aktív)
-    # Akkor eldobjuk a felhasználót a főoldalra.
-    if not games or not games[0].is_active:
-        return redirect(url_for('index'))
-
-    current_game = games[0]
-
-    # --- JAVÍTÁS ---
-    # Innen KIVETTÜK azt az ellenőrzést, ami visszadobott a főoldalra,
-    # ha már mindenki választott.
-    # Mostantól a Draft oldal mindig elérhető marad a legutolsó játékra,
-    # amíg nem indítasz egy teljesen újat.
-
-    logging.info(f"    Játék betöltve (ID: {current_game.id})")
+    return redirect(url_for('main.draft_view', game_id=game_id))
 
+def build_draft_participants(game):
+    """A draft kártyák adatai (név szerint rendezve) - a HTML oldal és a JSON API is ezt használja."""
     participants_data = []
-    all_factions = {f.id: f for f in db.session.query(Faction).all()}
-
-    for p in current_game.participants:
-        options = []
-        if p.drafted_factions_json:
-            try:
-                drafted_ids = json.loads(p.drafted_factions_json)
-                for fid in drafted_ids:
-                    f = all_factions.get(fid)
-                    if f: options.append(f)
-            except:
-                pass
+    all_factions = get_faction_catalog().by_id
+
+    for p in game.participants:
+        options = [all_factions[o.faction_id] for o in p.offers if o.faction_id in all_factions]
 
         participants_data.append({
             "id": p.id,
             "player_name": p.player.name,
             "options": options,
             "selected_faction_id": p.selected_faction_id,
-            "selected_faction_name": p.selected_faction.name if p.selected_faction else None
+            "version": p.version,
+            "selected_faction_name": all_factions[p.selected_faction_id].name if p.selected_faction_id in all_factions else None
         })
 
     participants_data.sort(key=lambda x: x["player_name"])
-    return render_template('draft.html', participants=participants_data)
+    return participants_data
 
-@app.route('/select_faction/<int:participant_id>/<int:faction_id>')
+@bp.route('/draft')
+def draft_list():
+    # Régi link / menügomb: egy futó draftnál egyből oda, egyébként a főoldali lista
+    active_drafts = db.get_active_drafts()
+    if len(active_drafts) == 1:
+        return redirect(url_for('main.draft_view', game_id=active_drafts[0].id))
+    return redirect(url_for('main.index', force=1))
+
+@bp.route('/draft/<int:game_id>')
+def draft_view(game_id):
+    head = db.get_draft_head(game_id)
+
+    # Ha nincs ilyen játék, VAGY már le van zárva (nem aktív)
+    # Akkor eldobjuk a felhasználót a főoldalra.
+    if not head or not head.is_active:
+        return redirect(url_for('main.index'))
+
+    # A Draft oldal a lezárásig elérhető marad, akkor is, ha már mindenki választott.
+
+    current_game = db.get_draft_game(head.id)
+
+    participants_data = build_draft_participants(current_game)
+    return render_template('draft.html', participants=participants_data,
+                           game_id=current_game.id, version=current_game.version)
+
+# --- JSON API (telefonos frissítéshez) ---
+# A válasz ETag-je a játék verziószámából jön: ha azóta senki nem választott,
+# a kliens 304-et kap, és a szerver a résztvevőket be sem tölti.
+
+def card_version(game):
+    # Mint a draft_etag-nél: az ID újrahasznosulhat (más workerben a törlés nem üríti a gyorsítótárat)
+    return int(game.date.timestamp() * 1000), game.version
+
+def draft_etag(head):
+    # A létrehozás ideje is benne van: egy törölt draft ID-ját az SQLite újra kioszthatja
+    return f"draft-{head.id}-{int(head.date.timestamp() * 1000)}-{head.version}"
+
+def draft_state_response(head):
+    game = db.get_draft_game(head.id)
+    participants = build_draft_participants(game)
+    for p in participants:
+        p["options"] = [f._asdict() for f in p["options"]]
+
+    response = jsonify({
+        "game_id": game.id,
+        "version": game.version,
+        "is_active": game.is_active,
+        "participants": participants,
+    })
+    response.set_etag(draft_etag(game))
+    response.headers['Cache-Control'] = 'no-cache'  # mindig újraellenőrizze, de ETag-gel
+    return response
+
+@bp.route('/api/drafts')
+def api_active_drafts():
+    """A futó draftok listája (asztalválasztóhoz)."""
+    return jsonify([
+        {"game_id": d.id, "version": d.version, "date": d.date.isoformat(),
+         "player_count": d.player_count, "picked_count": d.picked_count, "players": d.player_names}
+        for d in db.get_active_drafts()
+    ])
+
+@bp.route('/api/draft/<int:game_id>')
+def api_draft_state(game_id):
+    head = db.get_draft_head(game_id)
+    if not head or not head.is_active:
+        return jsonify({"error": "Nincs ilyen aktív draft."}), 404
+
+    if draft_etag(head) in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(draft_etag(head))
+        return response
+
+    return draft_state_response(head)
+
+@bp.route('/api/draft/<int:game_id>/select', methods=['POST'])
+def api_select_faction(game_id):
+    data = request.get_json(silent=True) or request.form
+    try:
+        participant_id = int(data.get('participant_id'))
+        faction_id = int(data.get('faction_id'))
+        # A résztvevő verziója, amit a kliens látott (opcionális): ütközésnél 409, nem írjuk felül
+        version = int(data['version']) if data.get('version') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "participant_id és faction_id kötelező (egész szám)."}), 400
+
+    logging.info(f">>> API KATTINTÁS: Participant[{participant_id}] választotta: FactionID[{faction_id}]")
+    try:
+        saved = db.save_player_choice(participant_id, faction_id, game_id=game_id, expected_version=version)
+    except VersionConflict:
+        # A friss állapotot küldjük vissza, a kliens abból frissít, és a felhasználó dönt újra
+        response = draft_state_response(db.get_draft_head(game_id))
+        response.status_code = 409
+        return response
+    if not saved:
+        return jsonify({"error": "Nincs ilyen résztvevő / felkínált faj ebben az aktív draftban."}), 404
+
+    head = publish_selection(game_id, participant_id, faction_id, saved.version)
+    return draft_state_response(head)
+
+# --- ÉLŐ FRISSÍTÉS (SSE + long-poll tartalék) ---
+LONG_POLL_TIMEOUT = 25      # másodperc, utána 304 és a kliens újra kérdez
+LONG_POLL_RECHECK = 1.0     # ennyi időnként ránézünk a DB-re (más worker választása miatt)
+
+def publish_selection(game_id, participant_id, faction_id, participant_version):
+    """A mentett választás kiküldése minden nyitott draft oldalnak. Visszaadja a draft friss fejlécét."""
+    head = db.get_draft_head(game_id)
+    draft_events.publish("selection", {
+        "game_id": head.id,
+        "version": head.version,
+        "participant_id": participant_id,
+        "participant_version": participant_version,
+        "faction_id": faction_id,
+        "faction_name": get_faction_catalog().name(faction_id),
+    })
+    return head
+
+class DraftVersionWatch:
+    """
+    Az SSE stream mellé: egy draft verziójának figyelése az adatbázisban (mint a long-poll), hogy a
+    más worker folyamatban mentett választás / lezárás is eljusson a klienshez. Ha a verzió
+    elmozdult, "resync" eseményt küld (a kliens a JSON API-ból frissít), ha a draft eltűnt, "finalized"-et.
+    """
+
+    def __init__(self, game_id, version):
+        self.game_id = game_id
+        self.version = version
+        self.done = False
+
+    def seen(self, event_type, data):
+        if data.get("game_id") != self.game_id:
+            return
+        if event_type == "finalized":
+            self.done = True
+        elif "version" in data:
+            self.version = data["version"]
+
+    def check(self):
+        if self.done:
+            return []
+        head = db.get_draft_head(self.game_id)
+        # Várakozás közben a kapcsolat menjen vissza a poolba
+        db.close_session()
+        if not head or not head.is_active:
+            return [("finalized", {"game_id": self.game_id, "deleted": head is None})]
+        if head.version != self.version:
+            return [("resync", {"game_id": self.game_id, "version": head.version})]
+        return []
+
+@bp.route('/api/draft/events')
+def api_draft_events():
+    # Hosszú életű kapcsolat: DB session-t nem tart nyitva, csak a közös eseménysort olvassa
+    # (minden asztal eseménye jön, a kliens a game_id alapján szűr). ?game_id=&version=: az adott
+    # draftot az adatbázisban is figyeli, így több worker mellett sem marad le semmiről.
+    game_id = request.args.get('game_id', type=int)
+    watch = DraftVersionWatch(game_id, request.args.get('version', type=int)) if game_id else None
+    response = Response(sse_stream(draft_events, watch=watch), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx mögött ne pufferelje
+    return response
+
+@bp.route('/api/draft/<int:game_id>/poll')
+def api_draft_poll(game_id):
+    """Long-poll: addig tartja a kérést, amíg a draft verziója el nem tér a klienstől kapottól."""
+    known_version = request.args.get('version', type=int)
+    deadline = time.monotonic() + LONG_POLL_TIMEOUT
+
+    while True:
+        head = db.get_draft_head(game_id)
+        if not head or not head.is_active:
+            return jsonify({"error": "Nincs ilyen aktív draft.", "finalized": True}), 404
+        if head.version != known_version:
+            return draft_state_response(head)
+
+        # Várakozás közben a kapcsolat menjen vissza a poolba
+        db.close_session()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            response = Response(status=304)
+            response.set_etag(draft_etag(head))
+            return response
+        draft_events.wait_for_change(min(remaining, LONG_POLL_RECHECK))
+
+@bp.route('/select_faction/<int:participant_id>/<int:faction_id>')
 def select_faction(participant_id, faction_id):
     # EZT LÁTNI AKARJUK: Ki mit választott
     logging.info(f">>> KATTINTÁS: Participant[{participant_id}] választotta: FactionID[{faction_id}]")
-    db.save_player_choice(participant_id, faction_id)
+    # A link a résztvevő látott verziójával jön (mint a /set_winner): a közbeeső választást nem írjuk felül
+    try:
+        saved = db.save_player_choice(participant_id, faction_id,
+                                      expected_version=request.args.get('version', type=int))
+    except VersionConflict:
+        game_id = db.get_participant_game_id(participant_id)
+        flash("Közben valaki más választott ennél a játékosnál - nézd meg, és kattints újra, ha kell!", "warning")
+        return redirect(url_for('main.draft_view', game_id=game_id))
+    if not saved:
+        flash("Ez a választás nem érvényes (a draft már nem aktív, vagy ezt a fajt nem kapta).", "warning")
+        return redirect(url_for('main.draft_list'))
+    publish_selection(saved.game_id, participant_id, faction_id, saved.version)
     flash("Választás mentve!", "success")
-    return redirect(url_for('draft_view'))
+    return redirect(url_for('main.draft_view', game_id=saved.game_id))
+
+HISTORY_PAGE_SIZE = 20
 
-@app.route('/history')
+def parse_history_cursor(raw):
+    """A '?before=2024-01-31T20:15:00_42' formátumú lapozó kulcsot (date, id) tuple-lé alakítja."""
+    if not raw:
+        return None
+    try:
+        date_str, id_str = raw.rsplit('_', 1)
+        return datetime.fromisoformat(date_str), int(id_str)
+    except ValueError:
+        # Hibás / kézzel átírt link -> egyszerűen az első oldalt mutatjuk
+        return None
+
+def format_history_cursor(cursor):
+    if not cursor:
+        return None
+    c_date, c_id = cursor
+    return f"{c_date.isoformat()}_{c_id}"
+
+HISTORY_FILTER_PARAMS = ('player', 'faction', 'winner', 'from', 'to')
+HISTORY_API_MAX_LIMIT = 100
+
+def parse_history_filter(args):
+    """
+    A history szűrői a query paraméterekből: player, winner (játékos ID), faction (ID vagy név),
+    from / to (YYYY-MM-DD, mindkét nap beleszámít). ValueError: hibás érték.
+    Visszatérés: (HistoryFilter vagy None, a megadott paraméterek - a lapozó linkekhez)
+    """
+    params = {name: args[name].strip() for name in HISTORY_FILTER_PARAMS if (args.get(name) or '').strip()}
+    if not params:
+        return None, {}
+
+    def player(name):
+        try:
+            return int(params[name]) if name in params else None
+        except ValueError:
+            raise ValueError(f"hibás játékos: {params[name]}")
+
+    def day(name):
+        try:
+            return datetime.strptime(params[name], '%Y-%m-%d') if name in params else None
+        except ValueError:
+            raise ValueError(f"hibás dátum: {params[name]} (formátum: ÉÉÉÉ-HH-NN)")
+
+    faction_id = None
+    if 'faction' in params:
+        raw = params['faction']
+        faction_id = int(raw) if raw.isdigit() else get_faction_catalog().resolve(raw)
+        if faction_id is None:
+            raise ValueError(f"ismeretlen faj: {raw}")
+
+    date_to = day('to')
+    filters = HistoryFilter(player_id=player('player'), faction_id=faction_id, winner_id=player('winner'),
+                            date_from=day('from'), date_to=date_to + timedelta(days=1) if date_to else None)
+    return filters, params
+
+@bp.route('/history')
 def history():
-    # Csak a lezárt játékok
-    all_games = db.get_all_games()
-    finished_games = [g for g in all_games if not g.is_active]
+    # Csak a lezárt játékok, oldalanként (a szűrés és a lapozás SQL-ben történik)
+    cursor = parse_history_cursor(request.args.get('before'))
+    try:
+        filters, filter_args = parse_history_filter(request.args)
+    except ValueError as e:
+        flash(f"A szűrő nem érvényes: {e}", "warning")
+        filters, filter_args = None, {}
+    finished_games, next_cursor = db.get_finished_games_page(cursor, HISTORY_PAGE_SIZE, with_participants=False,
+                                                             filters=filters)
+
+    # A kész kártyák a gyorsítótárból jönnek (kulcs: id + verzió), csak a hiányzókat rendereljük
+    cards = {}
+    missing = []
+    for game in finished_games:
+        html = history_card_cache.get(game.id, card_version(game))
+        if html is None:
+            missing.append(game)
+        else:
+            cards[game.id] = html
+
+    db.load_participants(missing)
+    for game in missing:
+        html = Markup(render_template('_game_card.html', game=game))
+        history_card_cache.set(game.id, card_version(game), html)
+        cards[game.id] = html
 
     # --- ÚJ: Lekérjük az adatokat a kézi hozzáadáshoz ---
     players = db.get_all_players()
-    factions = db.session.query(Faction).order_by(Faction.name).all()
-
-    return render_template('history.html', games=finished_games, players=players, factions=factions)
-
-
-@app.route('/finalize_game')
-def finalize_game():
-    logging.info(">>> Játék véglegesítése és tisztítása...")
+    factions = get_faction_catalog().all
 
-    # Lekérjük a legutolsó (éppen zajló) játékot
-    games = db.get_all_games()
-    if not games:
-        return redirect(url_for('index'))
+    return render_template('history.html', games=finished_games, cards=cards, players=players, factions=factions,
+                           next_cursor=format_history_cursor(next_cursor), is_first_page=cursor is None,
+                           filter_args=filter_args)
 
-    current_game = games[0]
-    participants_to_remove = []
-    active_count = 0
-
-    # 1. LÉPÉS: Megnézzük, ki az, aki NEM választott
-    for p in current_game.participants:
-        if p.selected_faction_id is None:
-            logging.info(f"    Törlésre jelölve (nem választott): {p.player.name}")
-            participants_to_remove.append(p)
-        else:
-            active_count += 1
-
-    # 2. LÉPÉS: Töröljük a lusta játékosokat az adatbázisból
-    for p in participants_to_remove:
-        db.session.delete(p)
+@bp.route('/api/history')
+def api_history():
+    """Lezárt meccsek JSON-ben, ugyanazokkal a szűrőkkel és lapozással, mint a /history."""
+    try:
+        filters, _ = parse_history_filter(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    cursor = parse_history_cursor(request.args.get('before'))
+    limit = min(max(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 1), HISTORY_API_MAX_LIMIT)
+
+    games, next_cursor = db.get_finished_games_page(cursor, limit, filters=filters)
+    catalog = get_faction_catalog()
+    return jsonify({
+        "games": [{
+            "id": game.id,
+            "date": game.date.isoformat(),
+            "version": game.version,
+            "winner_id": game.winner_id,
+            "participants": [{"player_id": p.player_id, "player": p.player.name,
+                              "faction_id": p.selected_faction_id, "faction": catalog.name(p.selected_faction_id)}
+                             for p in game.participants],
+        } for game in games],
+        "next_cursor": format_history_cursor(next_cursor),
+    })
+
+
+@bp.route('/draft/<int:game_id>/finalize')
+def finalize_game(game_id):
+    logging.info(f">>> Játék véglegesítése és tisztítása (Game ID: {game_id})...")
+
+    active_count = db.finalize_game(game_id)
+
+    if active_count is None:
+        # Nincs ilyen aktív draft (pl. dupla kattintás a véglegesítésre)
+        return redirect(url_for('main.history'))
+
+    # A többi nyitott draft oldal is tudja meg, hogy vége
+    draft_events.publish("finalized", {"game_id": game_id, "deleted": active_count == 0})
 
-    # 3. LÉPÉS: Ha senki nem maradt, töröljük az egész játékot
     if active_count == 0:
-        logging.info("    Senki nem választott -> A teljes játék törlése.")
-        db.session.delete(current_game)
-        db.session.commit()
         flash("A játék törölve lett, mert senki nem választott fajt.", "warning")
-        return redirect(url_for('index'))
-
-    # --- ÚJ RÉSZ: JÁTÉK LEZÁRÁSA ---
-    # Ez tünteti el a Draft oldalról!
-    current_game.is_active = False
-
-    # 4. LÉPÉS: Mentés
-    db.session.commit()
+        return redirect(url_for('main.index'))
 
     flash(f"Játék rögzítve! ({active_count} játékos választott)", "success")
-    return redirect(url_for('history'))
+    return redirect(url_for('main.history'))
+
+@bp.route('/stats')
+def stats():
+    # Csak az előre összesített táblákat olvassuk, a history hosszától függetlenül gyors
+    player_stats = db.get_player_stats()
+    faction_stats = db.get_faction_stats()
+    return render_template('stats.html', player_stats=player_stats, faction_stats=faction_stats)
+
+@bp.route('/leaderboard')
+def leaderboard():
+    # A tárolt értékszámokat olvassuk, újraszámolás nélkül (lásd rating.py)
+    return render_template('leaderboard.html', ratings=db.get_leaderboard())
+
+@bp.route('/metrics')
+def metrics():
+    return Response(request_metrics.render_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@bp.cli.command('init-db')
+def init_db_command():
+    """Táblák, fajok és migrációk (egyszer, a workerek indítása előtt): TI_INIT_DB=0 flask --app app init-db"""
+    db.prepare_database()
+    print("Adatbázis kész.")
+
+@bp.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Statisztika táblák újraszámolása a teljes history-ból: flask --app app rebuild-stats"""
+    db.rebuild_stats()
+    print("Statisztika újraépítve.")
+
+@bp.cli.command('check-stats')
+def check_stats_command():
+    """Az összesített statisztika összevetése a teljes újraszámolással: flask --app app check-stats"""
+    differences = db.check_stats()
+    for table, key, stored, expected in differences:
+        print(f"  {table} {key}: tárolt {stored}, várt {expected}")
+    if differences:
+        raise SystemExit(f"{len(differences)} eltérés (javítás: flask --app app rebuild-stats).")
+    print("A statisztika egyezik a history-val.")
+
+
+@bp.cli.command('rebuild-ratings')
+def rebuild_ratings_command():
+    """Értékszámok (Elo) újraszámolása a teljes history-ból: flask --app app rebuild-ratings"""
+    started = time.perf_counter()
+    db.rebuild_ratings()
+    print(f"Értékszámok újraépítve ({time.perf_counter() - started:.1f} s).")
+
+@bp.cli.command('import-history')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help="Alapból a fájl kiterjesztéséből.")
+@click.option('--create-players', is_flag=True, help="Az ismeretlen játékosnevek létrehozása.")
+def import_history_command(path, fmt, create_players):
+    """Régi meccsek betöltése CSV / JSONL fájlból: flask --app app import-history regi.csv"""
+    started = time.perf_counter()
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        result = db.import_games(iter_records(f, detect_format(path, fmt)), create_players=create_players)
+    for line, message in result['errors']:
+        print(f"  {line}. sor: {message}")
+    print(f"{import_summary(result)} ({time.perf_counter() - started:.1f} s)")
+
+@bp.cli.command('export-history')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True), required=False)
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help="Alapból a fájl kiterjesztéséből.")
+def export_history_command(path, fmt):
+    """A teljes history kiírása: flask --app app export-history mentes.jsonl (fájl nélkül: a konzolra)"""
+    catalog = get_faction_catalog()
+    fmt = detect_format(path, fmt)
+    chunks = export_lines(db.iter_finished_games(), fmt, catalog.name)
+    if not path:
+        for chunk in chunks:
+            click.echo(chunk, nl=False)
+        return
+    with open(path, 'w', encoding='utf-8', newline='') as out:
+        for chunk in chunks:
+            out.write(chunk)
+    print(f"Export kész: {path}")
+
+@bp.cli.command('maintenance')
+@click.argument('jobs', nargs=-1, type=click.Choice(JOB_NAMES))
+def maintenance_command(jobs):
+    """Karbantartó feladatok egyszeri futtatása (alapból mind): flask --app app maintenance analyze vacuum"""
+    if not run_maintenance(db, jobs):
+        raise SystemExit("Legalább egy feladat hibával állt le (részletek a logban).")
+    print("Karbantartás kész.")
 
 
 if __name__ == '__main__':
     # use_reloader=False FONTOS, hogy ne duplázza a logokat és ne akadjon össze
     print("Szerver indítása... Figyeld a logokat!")
+    app = create_app()
+    start_maintenance(db)
     app.run(debug=True, use_reloader=False, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,305 @@
+"""
+Benchmark: draft motor és a fő oldalak mérése szintetikus history-n.
+
+Egy eldobható SQLite fájlba generál N játékost és M lezárt meccset (sorsolt + választott
+fajokkal, győztessel), majd méri a draft motort és a Flask oldalakat (test client-tel):
+p50 / p95 késleltetés és SQL lekérdezésszám. Az eredmény JSON, amit egy korábbi futással
+(baseline) össze lehet hasonlítani.
+
+Használat:
+    python benchmark.py --players 50 --games 10000 --output bench_10k.json
+    python benchmark.py --games 10000 --baseline bench_10k.json   # regresszió esetén exit code 1
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="TI4 Draft Manager benchmark")
+    parser.add_argument('--players', type=int, default=50, help="játékosok száma")
+    parser.add_argument('--games', type=int, default=10000, help="lezárt meccsek száma a history-ban")
+    parser.add_argument('--seed', type=int, default=42, help="véletlen mag (reprodukálható history)")
+    parser.add_argument('--repeat', type=int, default=30, help="ismétlések száma mérésenként")
+    parser.add_argument('--draft-size', type=int, default=6, help="hány fős a mért draft")
+    parser.add_argument('--db', help="SQLite fájl (alapból ideiglenes); ha már van benne history, újrahasználjuk")
+    parser.add_argument('--output', help="eredmény JSON fájl")
+    parser.add_argument('--baseline', help="korábbi eredmény JSON, ehhez hasonlítunk")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="megengedett p95 romlás a baseline-hoz képest (0.25 = +25%%)")
+    return parser.parse_args()
+
+
+# --- SZINTETIKUS HISTORY ---
+
+def generate_history(engine, faction_ids, n_players, n_games, seed, batch_size=5000):
+    """
+    Játékosok + lezárt meccsek tömeges beszúrása (Core executemany, nagy tranzakciókban).
+    Meccsenként 3-8 játékos, mindenki 3 egyedi felkínált fajt kap, és abból választ egyet.
+    """
+    from db_manager import Player, Game, GameParticipant, DraftOffer
+
+    rng = random.Random(seed)
+    player_ids = list(range(1, n_players + 1))
+    seat_counts = [3, 4, 5, 6, 6, 6, 7, 8]  # a 6 fős asztal a leggyakoribb
+
+    with engine.begin() as conn:
+        conn.execute(Player.__table__.insert(),
+                     [{"id": p_id, "name": f"Bench Player {p_id}", "active": True} for p_id in player_ids])
+
+    date = datetime(2015, 1, 1)
+    participant_id = 0
+    games, participants, offers = [], [], []
+
+    def flush():
+        with engine.begin() as conn:
+            if games:
+                conn.execute(Game.__table__.insert(), games)
+            if participants:
+                conn.execute(GameParticipant.__table__.insert(), participants)
+            if offers:
+                conn.execute(DraftOffer.__table__.insert(), offers)
+        games.clear()
+        participants.clear()
+        offers.clear()
+
+    for game_id in range(1, n_games + 1):
+        date += timedelta(hours=rng.randint(6, 72), seconds=rng.randint(0, 3599))
+        seated = rng.sample(player_ids, rng.choice(seat_counts))
+        drawn = rng.sample(faction_ids, 3 * len(seated))
+
+        game_participants = []
+        for seat, p_id in enumerate(seated):
+            participant_id += 1
+            options = drawn[3 * seat:3 * seat + 3]
+            game_participants.append({
+                "id": participant_id, "game_id": game_id, "game_date": date, "player_id": p_id,
+                "selected_faction_id": rng.choice(options),
+            })
+            offers.extend({"participant_id": participant_id, "slot": slot, "faction_id": f_id}
+                          for slot, f_id in enumerate(options))
+
+        participants.extend(game_participants)
+        games.append({"id": game_id, "date": date, "is_active": False,
+                      "winner_id": rng.choice(game_participants)["player_id"]})
+
+        if len(games) >= batch_size:
+            flush()
+    flush()
+
+    return player_ids
+
+
+# --- MÉRÉS ---
+
+class QueryCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def measure(fn, repeat, counter, warmup=2):
+    for _ in range(warmup):
+        fn()
+
+    times_ms, query_counts = [], []
+    for _ in range(repeat):
+        q_before = counter.count
+        t0 = time.perf_counter()
+        fn()
+        times_ms.append((time.perf_counter() - t0) * 1000)
+        query_counts.append(counter.count - q_before)
+
+    times_ms.sort()
+    return {
+        "p50_ms": round(percentile(times_ms, 50), 3),
+        "p95_ms": round(percentile(times_ms, 95), 3),
+        "mean_ms": round(statistics.mean(times_ms), 3),
+        "max_ms": round(times_ms[-1], 3),
+        "queries": int(statistics.median(query_counts)),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Kiírja a változást a baseline-hoz képest; True, ha valamelyik mérés p95-je túl sokat romlott."""
+    regressed = False
+    print("\nÖsszehasonlítás a baseline-nal (p95):")
+    for name, current in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            print(f"  {name:<32} (nincs a baseline-ban)")
+            continue
+        ratio = current["p95_ms"] / base["p95_ms"] if base["p95_ms"] else 1.0
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  <-- REGRESSZIÓ"
+            regressed = True
+        if current["queries"] > base["queries"]:
+            flag += f"  <-- több lekérdezés ({base['queries']} -> {current['queries']})"
+            regressed = True
+        print(f"  {name:<32} {base['p95_ms']:>9.2f} ms -> {current['p95_ms']:>9.2f} ms  (x{ratio:.2f}){flag}")
+    return regressed
+
+
+def main():
+    args = parse_args()
+
+    # A DB és a log útvonalát az importok ELŐTT kell beállítani
+    work_dir = tempfile.mkdtemp(prefix="ti_bench_")
+    db_file = args.db or os.path.join(work_dir, "bench.db")
+    os.environ['TI_DB_PATH'] = db_file
+    os.environ['TI_LOG_PATH'] = os.path.join(work_dir, "bench.log")
+
+    import app as ti_app
+    from sqlalchemy import text
+    from db_manager import get_engine, Game, get_faction_catalog
+
+    flask_app = ti_app.create_app()
+    engine = get_engine()
+
+    # A mérés alatt a részletes (INFO) logolás csak zaj lenne
+    logging.getLogger().setLevel(logging.WARNING)
+
+    db = ti_app.db
+    client = flask_app.test_client()
+    counter = QueryCounter(engine)
+
+    existing_games = db.session.query(Game).count()
+    if existing_games == 0:
+        print(f"History generálása: {args.players} játékos, {args.games} meccs -> {db_file}")
+        t0 = time.perf_counter()
+        faction_ids = [f.id for f in get_faction_catalog().all]
+        player_ids = generate_history(engine, faction_ids, args.players, args.games, args.seed)
+        db.rebuild_stats()
+        db.rebuild_ratings()
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+        print(f"  kész ({time.perf_counter() - t0:.1f} s)")
+    else:
+        print(f"Meglévő history használata: {existing_games} meccs ({db_file})")
+        player_ids = [p.id for p in db.get_all_players()]
+    db.close_session()
+
+    rng = random.Random(args.seed)
+    # Ugyanaz az asztal sorsol újra: a még érintetlen előző draftja törlődik (mint az appban);
+    # más-más asztaloknál a futó draftok halmozódnának, azt az app el is utasítaná
+    draft_table = rng.sample(player_ids, args.draft_size)
+
+    def run_draft(table=draft_table):
+        db.start_new_game_draft(table)
+        db.close_session()
+
+    def draft_queries(table):
+        # A második hívás már a saját előző draftját cseréli, mint a mért esetben
+        run_draft(table)
+        before = counter.count
+        run_draft(table)
+        return counter.count - before
+
+    def latest_draft_url():
+        # Az utoljára mért sorsolás marad aktív; az URL-t csak az első híváskor keressük ki
+        if not draft_url:
+            draft_url.append(f"/draft/{db.get_active_drafts()[0].id}")
+            db.close_session()
+        return draft_url[0]
+    draft_url = []
+
+    def route(url):
+        def run():
+            response = client.get(url() if callable(url) else url)
+            assert response.status_code in (200, 302), f"{url} -> {response.status_code}"
+        return run
+
+    # Egy régebbi oldal kulcsa (a history közepe), hogy a mély lapozást is mérjük
+    middle = db.session.query(Game).filter(Game.is_active == False)\
+        .order_by(Game.date.desc(), Game.id.desc()).offset(args.games // 2).first()
+    middle_key = (middle.date, middle.id) if middle else None
+    middle_cursor = ti_app.format_history_cursor(middle_key) if middle else None
+    db.close_session()
+
+    def history_page(cursor=None):
+        # A /history keyset lapozása, résztvevőkkel (a HTTP réteg nélkül)
+        def run():
+            db.get_finished_games_page(cursor, ti_app.HISTORY_PAGE_SIZE)
+            db.close_session()
+        return run
+
+    cases = [
+        ("start_new_game_draft", run_draft),
+        ("get_finished_games_page", history_page()),
+        ("get_finished_games_page (mély)", history_page(middle_key)),
+        ("GET /draft/<id>", route(latest_draft_url)),
+        ("GET /", route('/?force=1')),
+        ("GET /history", route('/history')),
+        ("GET /history (mély)", route(f'/history?before={middle_cursor}' if middle_cursor else '/history')),
+        ("GET /stats", route('/stats')),
+        ("GET /leaderboard", route('/leaderboard')),
+    ]
+
+    results = {}
+    print(f"\nMérés ({args.repeat} ismétlés):")
+    for name, fn in cases:
+        results[name] = measure(fn, args.repeat, counter)
+        r = results[name]
+        print(f"  {name:<32} p50 {r['p50_ms']:>9.2f} ms   p95 {r['p95_ms']:>9.2f} ms   {r['queries']:>3} lekérdezés")
+
+    # A draft lekérdezésszáma nem nőhet az asztal méretével (nincs játékosonkénti lekérdezés)
+    small_table = rng.sample([p_id for p_id in player_ids if p_id not in draft_table], 3)
+    scaling = {"3": draft_queries(small_table), str(args.draft_size): draft_queries(draft_table)}
+    per_player = len(set(scaling.values())) > 1
+    print(f"\nDraft lekérdezésszám asztalméret szerint: " +
+          ", ".join(f"{size} fő: {n}" for size, n in scaling.items()) +
+          ("  <-- JÁTÉKOSONKÉNTI LEKÉRDEZÉS" if per_player else "  (állandó)"))
+
+    report = {
+        "meta": {
+            "players": args.players,
+            "games": existing_games or args.games,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "draft_size": args.draft_size,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "timestamp": datetime.now().isoformat(timespec='seconds'),
+        },
+        "results": results,
+        "draft_queries_by_table_size": scaling,
+    }
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nEredmény mentve: {args.output}")
+
+    regressed = per_player
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressed = compare(results, baseline, args.tolerance) or regressed
+    if regressed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
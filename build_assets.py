@@ -0,0 +1,108 @@
+"""
+Statikus képek előállítása telepítéskor: átméretezett JPEG + WebP változatok tartalom-hash-es
+fájlnévvel, és egy manifest.json, amiből a sablonok (asset_url) kikeresik őket.
+
+A hash-es fájlnév miatt a böngésző nyugodtan gyorsítótárazhatja őket "örökre" (immutable):
+ha a kép változik, a neve is változik. Ha nincs manifest (nem futott a build), az oldal a
+régi, eredeti képeket használja.
+
+Futtatás (Pillow kell hozzá: pip install pillow):
+    python build_assets.py
+"""
+import glob
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+BUILD_DIR = os.path.join(STATIC_DIR, 'build')
+MANIFEST_PATH = os.path.join(BUILD_DIR, 'manifest.json')
+
+# A draft kártya háttere 80px magas, max. ~400px széles -> 640px retina kijelzőre is bőven elég
+FACTION_IMAGE_WIDTH = 640
+BACKGROUND_WIDTH = 1920
+JPEG_QUALITY = 78
+WEBP_QUALITY = 72
+
+
+def asset_specs():
+    """(forrás útvonal a static/-on belül, célszélesség) párok."""
+    specs = [('images/background.jpg', BACKGROUND_WIDTH)]
+    for path in sorted(glob.glob(os.path.join(STATIC_DIR, 'images', 'the_*.jpg'))):
+        specs.append(('images/' + os.path.basename(path), FACTION_IMAGE_WIDTH))
+    return specs
+
+
+def encode(image, fmt):
+    buffer = io.BytesIO()
+    if fmt == 'jpg':
+        image.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    else:
+        image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=6)
+    return buffer.getvalue()
+
+
+def write_hashed(rel_path, fmt, data):
+    """Kiírja a fájlt 'nev.<hash>.<ext>' néven, és visszaadja a build/-en belüli útvonalát."""
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    stem = os.path.splitext(rel_path)[0]
+    hashed = f"{stem}.{digest}.{fmt}"
+    target = os.path.join(BUILD_DIR, hashed)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+        f.write(data)
+    return hashed
+
+
+def main():
+    try:
+        from PIL import Image
+    except ImportError:
+        sys.exit("Hiba: a képek feldolgozásához Pillow kell (pip install pillow).")
+
+    # Tiszta lap: a régi hash-es fájlok ne halmozódjanak
+    if os.path.isdir(BUILD_DIR):
+        shutil.rmtree(BUILD_DIR)
+    os.makedirs(BUILD_DIR)
+
+    manifest = {}
+    total_before = total_after = 0
+
+    for rel_path, width in asset_specs():
+        source = os.path.join(STATIC_DIR, rel_path)
+        if not os.path.exists(source):
+            print(f"  kihagyva (nincs meg): {rel_path}")
+            continue
+
+        with Image.open(source) as original:
+            image = original.convert('RGB')
+            if image.width > width:
+                height = round(image.height * width / image.width)
+                image = image.resize((width, height), Image.LANCZOS)
+
+        entry = {}
+        for fmt in ('jpg', 'webp'):
+            data = encode(image, fmt)
+            entry[fmt] = write_hashed(rel_path, fmt, data)
+            entry[f"{fmt}_bytes"] = len(data)
+        manifest[rel_path] = entry
+
+        before = os.path.getsize(source)
+        total_before += before
+        total_after += entry['webp_bytes']
+        print(f"  {rel_path:<45} {before / 1024:8.1f} KB -> jpg {entry['jpg_bytes'] / 1024:7.1f} KB"
+              f" | webp {entry['webp_bytes'] / 1024:7.1f} KB")
+
+    with open(MANIFEST_PATH, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"\n{len(manifest)} kép kész, összesen {total_before / 1024:.0f} KB -> {total_after / 1024:.0f} KB (WebP)")
+    print(f"Manifest: {MANIFEST_PATH}")
+
+
+if __name__ == '__main__':
+    main()
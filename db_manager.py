@@ -1,10 +1,26 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime, Boolean, text
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from sqlalchemy import create_engine, event, func, Column, Integer, Float, String, ForeignKey, DateTime, Boolean, Index, text, or_, and_, bindparam, insert, exists
+from sqlalchemy.orm import declarative_base, sessionmaker, scoped_session, relationship, selectinload, joinedload
+from sqlalchemy.pool import QueuePool
 from datetime import datetime
 import random
 import json
 import os
+import re
+import threading
+from collections import namedtuple
+from itertools import groupby
+from types import MappingProxyType
 import logging # LOGOLÁS IMPORTÁLÁSA
+from draft_rules import (ids_to_mask, mask_to_ids, mask_size, build_draft_pool, solve_draft_assignment,
+                         DRAFT_RELAX_MESSAGES, DRAFT_ENGINES, DRAFT_ENGINE_SOLVER, DRAFT_ENGINE_GREEDY,
+                         DEFAULT_DRAFT_ENGINE)
+from rating import INITIAL_RATING, replay as replay_ratings
+
+# Külön loggerek: a beszédes, hívásonkénti üzenetek szintje a TI_DB_LOG_LEVEL-lel állítható,
+# a draft események (ti.audit) JSON sorként külön fájlba mennek (lásd logging_setup.py)
+db_log = logging.getLogger('ti.db')
+draft_log = logging.getLogger('ti.draft')
+audit_log = logging.getLogger('ti.audit')
 
 Base = declarative_base()
 
@@ -24,47 +40,308 @@ class Game(Base):
     __tablename__ = 'games'
     id = Column(Integer, primary_key=True)
     date = Column(DateTime, default=datetime.now)
-    participants = relationship("GameParticipant", back_populates="game")
+    # A résztvevők törlését az adatbázis végzi (ON DELETE CASCADE), az ORM nem tölti be őket hozzá
+    participants = relationship("GameParticipant", back_populates="game",
+                                cascade="all, delete-orphan", passive_deletes=True)
     is_active = Column(Boolean, default=True)
     winner_id = Column(Integer, ForeignKey('players.id'), nullable=True)
     winner = relationship("Player", foreign_keys=[winner_id])
+    # Minden módosításkor (választás, lezárás, győztes) nő -> ETag / gyorsítótár kulcs
+    version = Column(Integer, nullable=False, default=0, server_default='0')
+    # Utolsó választás ideje (a triggerből); a karbantartás ebből dönti el, melyik draft elhagyott
+    last_activity = Column(DateTime, nullable=True, default=datetime.now)
+
+    __table_args__ = (
+        # History (lezártak, legújabb elöl) és "legutolsó játék" lekérdezésekhez
+        Index('ix_games_active_date', is_active, date.desc(), id.desc()),
+        Index('ix_games_date', date.desc(), id.desc()),
+        # History szűrés győztesre, ugyanabban a sorrendben (lapozás rendezés nélkül)
+        Index('ix_games_winner_date', winner_id, is_active, date.desc(), id.desc()),
+    )
 
 class GameParticipant(Base):
     __tablename__ = 'game_participants'
     id = Column(Integer, primary_key=True)
-    game_id = Column(Integer, ForeignKey('games.id'))
+    game_id = Column(Integer, ForeignKey('games.id', ondelete='CASCADE'))
     player_id = Column(Integer, ForeignKey('players.id'))
     selected_faction_id = Column(Integer, ForeignKey('factions.id'), nullable=True)
-    drafted_factions_json = Column(String)
+    # A játék dátumának másolata: így a draft motor játékosonként egy indexből olvassa az utolsó
+    # 2 meccset (a history méretétől függetlenül). Ha beszúráskor hiányzik, trigger tölti ki.
+    game_date = Column(DateTime, nullable=True)
+    # Választásonként nő (optimista zárolás: a kliens a látott verzióval küldi a kattintást).
+    # A játék verzióját egy trigger növeli (lásd _migrate_selection_version).
+    version = Column(Integer, nullable=False, default=0, server_default='0')
     game = relationship("Game", back_populates="participants")
     player = relationship("Player")
     selected_faction = relationship("Faction")
+    # A sorsoláson felkínált (3) faj, slot szerint sorban. Kézi játéknál üres.
+    offers = relationship("DraftOffer", order_by="DraftOffer.slot", cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        # Játékos előzményei (draft motor) és egy játék résztvevői
+        Index('ix_game_participants_player_game', 'player_id', 'game_id'),
+        Index('ix_game_participants_game', 'game_id'),
+        # History szűrés (játékos / faj): a meccsenkénti EXISTS csak ezt az indexet olvassa
+        Index('ix_game_participants_game_player_faction', 'game_id', 'player_id', 'selected_faction_id'),
+        # Draft motor: egy játékos legutóbbi meccsei (LIMIT 2), időrendben visszafelé
+        Index('ix_game_participants_player_date', 'player_id', game_date.desc(), game_id.desc()),
+    )
+
+class DraftOffer(Base):
+    """Egy felkínált faj egy résztvevőnek (a régi drafted_factions_json oszlop helyett)."""
+    __tablename__ = 'draft_offers'
+    participant_id = Column(Integer, ForeignKey('game_participants.id', ondelete='CASCADE'), primary_key=True)
+    slot = Column(Integer, primary_key=True)  # 0, 1, 2 - a kínálat sorrendje
+    faction_id = Column(Integer, ForeignKey('factions.id'), nullable=False)
+    faction = relationship("Faction")
+
+    __table_args__ = (
+        # "Milyen gyakran kínálták fel X fajt?" -> index a fajra
+        Index('ix_draft_offers_faction', 'faction_id', 'participant_id'),
+    )
+
+# --- STATISZTIKA TÁBLÁK ---
+# Előre összesített számlálók, csak a LEZÁRT játékokból. Minden írás (lezárás, kézi játék,
+# győztes állítása, törlés) ugyanabban a tranzakcióban frissíti őket, így a statisztika
+# oldalnak nem kell a teljes history-t végigolvasnia. Javításhoz: TIManager.rebuild_stats().
+
+class PlayerStat(Base):
+    __tablename__ = 'player_stats'
+    player_id = Column(Integer, ForeignKey('players.id'), primary_key=True)
+    games_played = Column(Integer, nullable=False, default=0)
+    wins = Column(Integer, nullable=False, default=0)
+    player = relationship("Player")
+
+class FactionStat(Base):
+    __tablename__ = 'faction_stats'
+    faction_id = Column(Integer, ForeignKey('factions.id'), primary_key=True)
+    offered = Column(Integer, nullable=False, default=0)  # hányszor kínálták fel (sorsolásból)
+    picked = Column(Integer, nullable=False, default=0)   # hányszor játszották
+    wins = Column(Integer, nullable=False, default=0)
+
+# --- ÉRTÉKSZÁM (ELO) TÁBLÁK ---
+# player_ratings: a jelenlegi értékszám. rating_snapshots: minden értékelt (lezárt, győztessel
+# rendelkező) meccsen résztvevőnként a meccs előtti és utáni érték - ebből lehet egy korábbi
+# meccstől újrajátszani anélkül, hogy a teljes history-t újra kellene számolni (lásd rating.py).
+
+class PlayerRating(Base):
+    __tablename__ = 'player_ratings'
+    player_id = Column(Integer, ForeignKey('players.id'), primary_key=True)
+    rating = Column(Float, nullable=False, default=INITIAL_RATING)
+    games_rated = Column(Integer, nullable=False, default=0)
+    player = relationship("Player")
+
+class RatingSnapshot(Base):
+    __tablename__ = 'rating_snapshots'
+    game_id = Column(Integer, ForeignKey('games.id', ondelete='CASCADE'), primary_key=True)
+    player_id = Column(Integer, ForeignKey('players.id'), primary_key=True)
+    rating_before = Column(Float, nullable=False)
+    rating_after = Column(Float, nullable=False)
+
+    __table_args__ = (
+        # Egy játékos értékelt meccseinek száma (player_ratings.games_rated frissítése)
+        Index('ix_rating_snapshots_player', 'player_id'),
+    )
 
 # --- MOTOR LÉTREHOZÁSA JAVÍTOTT ÚTVONALLAL ---
 # Megkeressük, hol van EZ a fájl (db_manager.py) a gépen:
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-# Hozzáfűzzük az adatbázis nevét:
-db_path = os.path.join(BASE_DIR, 'ti_manager.db')
 
-logging.info(f"DB: Adatbázis útvonala: {db_path}")
+def default_db_path():
+    # Az adatbázis a fájl mellett (a TI_DB_PATH környezeti változóval felülírható, pl. benchmarkhoz)
+    return os.environ.get('TI_DB_PATH') or os.path.join(BASE_DIR, 'ti_manager.db')
+
+# --- KAPCSOLAT POOL ÉS SQLITE BEÁLLÍTÁSOK ---
+# Minden kérés (szál) a poolból kap saját kapcsolatot, és a kérés végén visszaadja.
+DB_POOL_SIZE = 10
+DB_MAX_OVERFLOW = 20
+DB_POOL_TIMEOUT = 30     # másodperc: ennyit vár egy szabad kapcsolatra
+DB_BUSY_TIMEOUT_MS = 30000  # ennyit vár az SQLite, ha épp más ír (nem dob azonnal "database is locked"-ot)
+
+def _set_sqlite_pragmas(dbapi_conn, connection_record):
+    """Minden új kapcsolaton: WAL napló (olvasók nem blokkolják az írót), busy timeout, gyorsabb fsync,
+    és a külső kulcsok betartatása (az SQLite alapból NEM ellenőrzi őket, így az ON DELETE CASCADE se menne)."""
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    # WAL mellett a NORMAL biztonságos (áramszünetnél legfeljebb az utolsó commit veszhet el)
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+# --- MOTOR: LUSTA, FOLYAMATONKÉNTI LÉTREHOZÁS ---
+# Az importálás nem nyit kapcsolatot: a motor az első használatkor (vagy init_engine()-nel) jön létre.
+# Több folyamatos WSGI szervernél (pl. gunicorn) a fork után a gyermek eldobja a szülőtől örökölt
+# poolt, így két folyamat sosem használja ugyanazt az SQLite kapcsolatot.
+# Szálanként külön session (Flask alatt = kérésenként), a kérés végén Session.remove() zárja
+Session = scoped_session(sessionmaker())
+_engine = None
+_engine_lock = threading.Lock()
+
+def init_engine(path=None):
+    """A folyamat motorja (ha még nincs, most jön létre) - a táblákat NEM hozza létre, az a prepare_database() dolga."""
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            return _engine
+        db_path = path or default_db_path()
+        logging.info(f"DB: Adatbázis útvonala: {db_path}")
+        try:
+            # Fontos: 'sqlite:///' után jön a teljes útvonal
+            # check_same_thread=False: a pool kapcsolatai szálak között vándorolnak, de egyszerre mindig csak egy szálnál vannak
+            engine = create_engine(
+                f'sqlite:///{db_path}',
+                connect_args={'check_same_thread': False, 'timeout': DB_BUSY_TIMEOUT_MS / 1000},
+                poolclass=QueuePool,
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_timeout=DB_POOL_TIMEOUT,
+            )
+            event.listen(engine, "connect", _set_sqlite_pragmas)
+        except Exception as e:
+            logging.critical(f"DB: HIBA A MOTOR LÉTREHOZÁSAKOR: {e}")
+            raise
+        Session.configure(bind=engine)
+        _engine = engine
+        logging.info("DB: Motor rendben.")
+        return engine
+
+def get_engine():
+    return _engine or init_engine()
+
+def dispose_engine():
+    """A pool kapcsolatainak lezárása (pl. a master folyamatban, mielőtt a workereket elindítja)."""
+    Session.remove()
+    if _engine is not None:
+        _engine.dispose()
+
+def _reset_engine_after_fork():
+    # A gyermek folyamatban: a szülő kapcsolatait NEM zárjuk le (azok továbbra is a szülőé),
+    # csak elengedjük őket; a következő kérés már új, saját kapcsolatot nyit.
+    Session.registry.clear()
+    if _engine is not None:
+        _engine.dispose(close=False)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_engine_after_fork)
+
+# --- FAJ KATALÓGUS (folyamaton belüli, csak olvasható gyorsítótár) ---
+# A fajlista gyakorlatilag sosem változik, ezért egyszer töltjük be egyetlen lekérdezéssel,
+# és minden kérés ebből dolgozik. Ha a fajok táblája változik: invalidate_faction_catalog().
+
+def slugify_faction_name(name):
+    """
+    Átalakítja a faj nevét a fájlneved formátumára.
+    Pl.: "The Federation of Sol" -> "the_federation_of_sol"
+    """
+    if not name: return ""
+    s = name.lower()
+    # Kivesz minden speciális karaktert (kötőjel, aposztróf), csak betű és szám marad
+    s = re.sub(r'[^a-z0-9\s]', '', s)
+    # A szóközöket alulvonásra cseréli
+    s = s.replace(' ', '_')
+    return s
+
+# Sablonokban ugyanúgy használható, mint a Faction objektum (.id, .name), plusz .slug
+FactionInfo = namedtuple('FactionInfo', ['id', 'name', 'slug'])
+
+class FactionCatalog:
+    def __init__(self, rows):
+        factions = sorted((FactionInfo(f_id, name, slugify_faction_name(name)) for f_id, name in rows),
+                          key=lambda f: f.name)
+        self.all = tuple(factions)  # név szerint rendezve
+        self.by_id = MappingProxyType({f.id: f for f in factions})
+        self.by_name = MappingProxyType({f.name: f for f in factions})
+        self.id_by_name = MappingProxyType({f.name: f.id for f in factions})
+        self.id_by_slug = MappingProxyType({f.slug: f.id for f in factions})
+        self.all_mask = ids_to_mask(self.by_id)
+
+    def name(self, faction_id):
+        f = self.by_id.get(faction_id)
+        return f.name if f else None
+
+    def slug(self, name):
+        f = self.by_name.get(name)
+        return f.slug if f else slugify_faction_name(name)
+
+    def resolve(self, text):
+        """Szabadon beírt fajnév -> ID (pontos név, kis/nagybetű, "The" nélkül is). None, ha nincs ilyen."""
+        faction_id = self.id_by_name.get(text)
+        if faction_id is None:
+            slug = slugify_faction_name(text)
+            faction_id = self.id_by_slug.get(slug) or self.id_by_slug.get('the_' + slug)
+        return faction_id
+
+_faction_catalog = None
+_faction_catalog_lock = threading.Lock()
+
+def get_faction_catalog():
+    """A betöltött katalógus; az első hívás (vagy invalidálás után a következő) tölti be."""
+    global _faction_catalog
+    catalog = _faction_catalog
+    if catalog is None:
+        with _faction_catalog_lock:
+            if _faction_catalog is None:
+                # Saját, rövid életű session: ne keveredjen a hívó kérés tranzakciójába
+                session = Session.session_factory(bind=get_engine())
+                try:
+                    rows = session.query(Faction.id, Faction.name).all()
+                finally:
+                    session.close()
+                _faction_catalog = FactionCatalog(rows)
+                logging.info(f"DB: Faj katalógus betöltve ({len(rows)} faj).")
+            catalog = _faction_catalog
+    return catalog
 
-try:
-    # Fontos: 'sqlite:///' után jön a teljes útvonal
-    engine = create_engine(f'sqlite:///{db_path}', connect_args={'check_same_thread': False})
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    logging.info("DB: Motor és táblák rendben.")
-except Exception as e:
-    logging.critical(f"DB: HIBA A MOTOR LÉTREHOZÁSAKOR: {e}")
+def invalidate_faction_catalog():
+    global _faction_catalog
+    with _faction_catalog_lock:
+        _faction_catalog = None
+
+IMPORT_BATCH_SIZE = 500           # ennyi meccs kerül egy tranzakcióba
+IMPORT_MAX_REPORTED_ERRORS = 50   # ennél több hibás sort csak megszámolunk
+EXPORT_PAGE_SIZE = 500
+RATING_BATCH_SIZE = 5000          # ennyi pillanatkép sor megy egy executemany-be
+
+# History szűrők (mind opcionális, None = nincs szűrés). A játékos és a faj együtt ugyanarra a
+# résztvevőre vonatkozik ("X a Y fajjal"). date_to KIZÁRÓLAGOS felső határ (date < date_to).
+HistoryFilter = namedtuple('HistoryFilter', 'player_id faction_id winner_id date_from date_to',
+                           defaults=(None, None, None, None, None))
+
+class VersionConflict(Exception):
+    """Optimista zárolás: a rekord közben megváltozott (current_version: a jelenlegi verzió)."""
+    def __init__(self, current_version):
+        super().__init__(f"a rekord közben megváltozott (jelenlegi verzió: {current_version})")
+        self.current_version = current_version
 
 class TIManager:
-    def __init__(self):
-        logging.info("DB Manager: Új session nyitása...")
-        self.session = Session()
+    # A példányosítás olcsó (nem nyúl az adatbázishoz); az egyszeri indítási munka a prepare_database()
+
+    def prepare_database(self):
+        """
+        Egyszeri indítási munka: táblák létrehozása, fajok feltöltése, séma migrációk.
+        Egyszer fusson, a workerek indítása ELŐTT (flask init-db, gunicorn on_starting, vagy a
+        fejlesztői szerver indulásakor) - a párhuzamosan induló workerek ne migráljanak egyszerre.
+        """
+        logging.info("DB Manager: Indítás...")
+        Base.metadata.create_all(get_engine())
         self._init_factions()
-        self._check_schema_updates()
+        self._run_migrations()
+        # Az indításhoz használt session-t lezárjuk, a kérések már sajátot kapnak
+        self.close_session()
         logging.info("DB Manager: Kész.")
 
+    @property
+    def session(self):
+        """Az aktuális szálhoz (kéréshez) tartozó session. Első hozzáféréskor nyílik meg."""
+        if _engine is None:
+            init_engine()
+        return Session()
+
+    def close_session(self):
+        """A szál session-jének lezárása, a kapcsolat visszakerül a poolba (kérés végén hívandó)."""
+        Session.remove()
+
     def _init_factions(self):
         logging.info("DB: Fajok ellenőrzése és frissítése...")
 
@@ -80,20 +357,17 @@ class TIManager:
             "The Council Keleres"  # <--- ITT AZ ÚJ FAJ!
         ]
 
-        # Végigmegyünk a listán, és csak azt adjuk hozzá, ami még NINCS az adatbázisban
-        added_count = 0
-        for f_nev in fajok:
-            # Megnézzük, létezik-e már ez a név
-            exists = self.session.query(Faction).filter_by(name=f_nev).first()
+        # Egy lekérdezés a meglévő nevekre, és csak a hiányzókat szúrjuk be (egyetlen bulk INSERT)
+        existing = {name for (name,) in self.session.query(Faction.name).all()}
+        missing = [f_nev for f_nev in fajok if f_nev not in existing]
 
-            if not exists:
+        if missing:
+            for f_nev in missing:
                 logging.info(f"DB: Új faj hozzáadása: {f_nev}")
-                self.session.add(Faction(name=f_nev))
-                added_count += 1
-
-        if added_count > 0:
+            self.session.execute(Faction.__table__.insert(), [{"name": f_nev} for f_nev in missing])
             self.session.commit()
-            logging.info(f"DB: {added_count} új faj sikeresen mentve.")
+            invalidate_faction_catalog()
+            logging.info(f"DB: {len(missing)} új faj sikeresen mentve.")
         else:
             logging.info("DB: Minden faj naprakész.")
 
@@ -106,35 +380,214 @@ class TIManager:
         return False
 
     def get_all_players(self):
-        logging.info("DB: get_all_players hívás...")
+        db_log.debug("DB: get_all_players hívás...")
         res = self.session.query(Player).filter_by(active=True).all()
-        logging.info(f"DB: {len(res)} játékos találva.")
+        db_log.debug("DB: %d játékos találva.", len(res))
         return res
 
-    def get_all_games(self):
-        logging.info("DB: get_all_games hívás...")
-        return self.session.query(Game).order_by(Game.date.desc()).all()
+    def get_finished_games_page(self, cursor=None, limit=20, with_participants=True, filters=None):
+        """
+        Lezárt játékok egy oldala, a legújabbtól visszafelé.
+        cursor: (date, id) tuple -> az ennél RÉGEBBI játékokat adja vissza (keyset lapozás).
+        filters: HistoryFilter - a szűrés SQL-ben történik, a lapozás ugyanúgy működik.
+        with_participants=False: csak a játékok sorai (pl. ha a kártyák gyorsítótárban vannak,
+        a résztvevőket utólag a load_participants()-szal csak a hiányzókhoz töltjük be).
+        Visszatérés: (games, next_cursor) - next_cursor None, ha nincs több oldal.
+        """
+        q = self.session.query(Game).filter(Game.is_active == False)
+        if filters:
+            q = self._apply_history_filter(q, filters)
 
-    def save_player_choice(self, participant_id, faction_id):
-        part = self.session.query(GameParticipant).get(participant_id)
-        if part:
-            part.selected_faction_id = faction_id
-            self.session.commit()
+        if cursor:
+            c_date, c_id = cursor
+            q = q.filter(or_(Game.date < c_date, and_(Game.date == c_date, Game.id < c_id)))
+
+        # Egy lekérdezés a játékokra + egy a résztvevőkre (játékossal együtt JOIN-olva)
+        # (a faj nevét a sablon a faj katalógusból veszi, azt nem kell JOIN-olni)
+        if with_participants:
+            q = q.options(
+                selectinload(Game.participants).joinedload(GameParticipant.player)
+            )
+
+        # Eggyel többet kérünk le, így tudjuk, van-e következő oldal
+        games = q.order_by(Game.date.desc(), Game.id.desc()).limit(limit + 1).all()
+
+        next_cursor = None
+        if len(games) > limit:
+            games = games[:limit]
+            next_cursor = (games[-1].date, games[-1].id)
+
+        return games, next_cursor
+
+    def _apply_history_filter(self, q, filters):
+        """
+        A history szűrők feltételei. A résztvevőkre EXISTS al-lekérdezés (nem JOIN): a meccs egyszer
+        szerepel, a rendezés és a lapozás marad a games indexén, a résztvevőket pedig a
+        ix_game_participants_game_player_faction indexből nézi meg meccsenként.
+        """
+        if filters.player_id is not None or filters.faction_id is not None:
+            conditions = [GameParticipant.game_id == Game.id]
+            if filters.player_id is not None:
+                conditions.append(GameParticipant.player_id == filters.player_id)
+            if filters.faction_id is not None:
+                conditions.append(GameParticipant.selected_faction_id == filters.faction_id)
+            q = q.filter(exists().where(*conditions))
+        if filters.winner_id is not None:
+            q = q.filter(Game.winner_id == filters.winner_id)
+        if filters.date_from is not None:
+            q = q.filter(Game.date >= filters.date_from)
+        if filters.date_to is not None:
+            q = q.filter(Game.date < filters.date_to)
+        return q
+
+    def load_participants(self, games):
+        """A megadott (már betöltött) játékok résztvevőinek betöltése egyetlen lekérdezéssel."""
+        if not games:
+            return
+        self.session.query(Game)\
+            .options(selectinload(Game.participants).joinedload(GameParticipant.player))\
+            .filter(Game.id.in_([g.id for g in games]))\
+            .populate_existing()\
+            .all()
+
+    def save_player_choice(self, participant_id, faction_id, game_id=None, expected_version=None):
+        """
+        Egy játékos választásának mentése egy AKTÍV drafton, EGYETLEN feltételes UPDATE-tel:
+        a faj a résztvevőnek felkínáltak közül való, a draft még aktív, és (ha meg van adva)
+        a résztvevő verziója még az, amit a kliens látott. A játék verzióját a trigger növeli.
+        game_id: ha meg van adva, a résztvevőnek ehhez a drafthoz kell tartoznia.
+        Visszatérés: (game_id, player_id, version) sor, vagy None, ha nincs ilyen résztvevő / nem
+        felkínált faj / a draft már lezárult. VersionConflict: közben más választott ennél a résztvevőnél.
+        """
+        params = {"participant_id": participant_id, "faction_id": faction_id,
+                  "game_id": game_id, "expected_version": expected_version}
+        saved = self.session.execute(text("""
+            UPDATE game_participants
+            SET selected_faction_id = :faction_id, version = version + 1
+            WHERE id = :participant_id
+              AND (:game_id IS NULL OR game_id = :game_id)
+              AND (:expected_version IS NULL OR version = :expected_version)
+              AND EXISTS (SELECT 1 FROM draft_offers
+                          WHERE participant_id = :participant_id AND faction_id = :faction_id)
+              AND EXISTS (SELECT 1 FROM games WHERE id = game_participants.game_id AND is_active = 1)
+            RETURNING game_id, player_id, version
+        """), params).first()
+
+        if saved is None:
+            self.session.rollback()
+            # Csak a sikertelen úton: ütközés volt, vagy érvénytelen a kérés?
+            if expected_version is not None:
+                query = self.session.query(GameParticipant.version)\
+                    .join(Game, Game.id == GameParticipant.game_id)\
+                    .filter(GameParticipant.id == participant_id, Game.is_active == True)
+                if game_id is not None:
+                    query = query.filter(GameParticipant.game_id == game_id)
+                current = query.scalar()
+                if current is not None and current != expected_version:
+                    raise VersionConflict(current)
+            return None
+
+        self.session.commit()
+        audit_log.info("draft_selection", extra={"audit": {
+            "game_id": saved.game_id, "participant_id": participant_id,
+            "player_id": saved.player_id, "faction_id": faction_id, "version": saved.version,
+        }})
+        return saved
+
+    def get_participant_game_id(self, participant_id):
+        return self.session.query(GameParticipant.game_id).filter(GameParticipant.id == participant_id).scalar()
+
+    # --- FUTÓ DRAFTOK (egyszerre több asztal) ---
+
+    def get_draft_head(self, game_id):
+        """Egy draft azonosítója, verziója és állapota - elsődleges kulcsos lekérdezés, objektumok nélkül."""
+        return self.session.query(Game.id, Game.version, Game.is_active, Game.date)\
+            .filter(Game.id == game_id)\
+            .first()
+
+    def get_active_drafts(self):
+        """
+        A most futó draftok (legújabb elöl), játékosneveikkel és a már választók számával.
+        Az ix_games_active_date indexből olvas, a lezárt history méretétől független.
+        """
+        return self.session.query(
+                Game.id, Game.version, Game.date,
+                func.count(GameParticipant.id).label('player_count'),
+                func.count(GameParticipant.selected_faction_id).label('picked_count'),
+                func.group_concat(Player.name, ', ').label('player_names'),
+            )\
+            .outerjoin(GameParticipant, GameParticipant.game_id == Game.id)\
+            .outerjoin(Player, Player.id == GameParticipant.player_id)\
+            .filter(Game.is_active == True)\
+            .group_by(Game.id)\
+            .order_by(Game.date.desc(), Game.id.desc())\
+            .all()
+
+    def _active_drafts_of_players(self, player_ids):
+        """
+        A futó draftok, ahol a megadott játékosok közül ül valaki: {game_id: (ülő játékosok, van-e választás)}.
+        Az aktív játékokból indul (ix_games_active_date), így csak a futó draftok résztvevőit olvassa,
+        a játékosok teljes előzményét nem.
+        """
+        rows = self.session.query(Game.id, GameParticipant.player_id, GameParticipant.selected_faction_id)\
+            .join(GameParticipant, GameParticipant.game_id == Game.id)\
+            .filter(Game.is_active == True)\
+            .all()
+        drafts = {}
+        for game_id, player_id, faction_id in rows:
+            seated, has_pick = drafts.get(game_id, (frozenset(), False))
+            drafts[game_id] = (seated | {player_id}, has_pick or faction_id is not None)
+        wanted = set(player_ids)
+        return {game_id: draft for game_id, draft in drafts.items() if draft[0] & wanted}
+
+    @staticmethod
+    def _replaceable_draft(seated, has_pick, player_ids):
+        """Egy futó draft újrasorsolásnak vehető (törölhető), ha még érintetlen, és minden ülője az új asztalnál van."""
+        return not has_pick and seated <= set(player_ids)
+
+    def get_seated_players(self, player_ids):
+        """
+        Azok a játékosok (nevek), akik egy másik asztal futó draftjában ülnek, amit az új sorsolás nem
+        írhat felül: ott már választott valaki, vagy az asztalnál olyan is ül, aki most nincs köztük.
+        """
+        busy = set()
+        for seated, has_pick in self._active_drafts_of_players(player_ids).values():
+            if not self._replaceable_draft(seated, has_pick, player_ids):
+                busy |= seated & set(player_ids)
+        if not busy:
+            return []
+        rows = self.session.query(Player.name).filter(Player.id.in_(busy)).all()
+        return sorted(name for (name,) in rows)
+
+    def get_draft_game(self, game_id):
+        """Egy játék a draft oldalhoz: résztvevők, játékosok és kínálatok előre betöltve."""
+        db_log.debug("DB: Draft játék betöltése (ID: %d)", game_id)
+        return self.session.query(Game)\
+            .options(selectinload(Game.participants).options(
+                joinedload(GameParticipant.player),
+                selectinload(GameParticipant.offers)
+            ))\
+            .filter(Game.id == game_id)\
+            .first()
 
     # --- ÚJ CRUD FUNKCIÓK ---
 
     def delete_game(self, game_id):
-        """Teljes játék törlése résztvevőkkel együtt"""
-        game = self.session.query(Game).get(game_id)
-        if game:
-            logging.info(f"DB: Játék törlése (ID: {game_id})")
-            # Először a résztvevőket töröljük (Cascading delete kézileg, a biztonság kedvéért)
-            for p in game.participants:
-                self.session.delete(p)
-            self.session.delete(game)
-            self.session.commit()
-            return True
-        return False
+        """Teljes játék törlése résztvevőkkel együtt (a résztvevőket és kínálatokat az ON DELETE CASCADE viszi)."""
+        row = self.session.query(Game.is_active, Game.winner_id).filter(Game.id == game_id).first()
+        if row is None:
+            return False
+        is_active, winner_id = row
+
+        logging.info(f"DB: Játék törlése (ID: {game_id})")
+        if not is_active:
+            self._stats_apply_game(game_id, -1)
+            if winner_id is not None:
+                # Még a törlés előtt: a pillanatképeiből tudjuk, honnan kell újrajátszani
+                self._ratings_replay_from(game_id, exclude_game_ids=[game_id])
+        self.session.query(Game).filter(Game.id == game_id).delete(synchronize_session=False)
+        self.session.commit()
+        return True
 
     def create_manual_game(self, date_obj, player_faction_pairs):
         """
@@ -152,90 +605,891 @@ class TIManager:
         for p_id, f_id in player_faction_pairs:
             part = GameParticipant(
                 game_id=new_game.id,
+                game_date=new_game.date,
                 player_id=p_id,
-                selected_faction_id=f_id,
-                drafted_factions_json=None # Kézi hozzáadásnál nincs draft history
+                selected_faction_id=f_id
+                # Kézi hozzáadásnál nincs draft history (nincs DraftOffer)
             )
             self.session.add(part)
 
+        self.session.flush()
+        self._stats_apply_game(new_game.id, +1)
         self.session.commit()
         return True
-    def _check_schema_updates(self):
-        """Megnézi, hogy létezik-e a winner_id oszlop, és ha nem, hozzáadja."""
-        try:
-            # Megpróbáljuk lekérni a games táblát, hátha hibát dob
-            self.session.execute(text("SELECT winner_id FROM games LIMIT 1"))
-        except Exception:
-            logging.info("DB: 'winner_id' oszlop hiányzik -> Migráció indítása...")
+
+    def finalize_game(self, game_id):
+        """
+        Aktív draft lezárása: aki nem választott, kikerül; ha senki nem választott, a játék törlődik.
+        Csak halmaz-alapú utasítások, ORM objektumok betöltése nélkül.
+        Visszatérés: a bent maradt játékosok száma (0 = törölve), None ha nincs ilyen aktív játék.
+        """
+        row = self.session.query(Game.is_active, Game.winner_id).filter(Game.id == game_id).first()
+        if row is None or not row.is_active:
+            return None
+
+        # 1. LÉPÉS: Töröljük azokat, akik NEM választottak (egyetlen DELETE, a kínálatuk kaszkádol)
+        not_picked = GameParticipant.selected_faction_id.is_(None)
+        removed = self.session.query(GameParticipant.player_id, Player.name)\
+            .join(Player, Player.id == GameParticipant.player_id)\
+            .filter(GameParticipant.game_id == game_id, not_picked)\
+            .all()
+        for _, name in removed:
+            logging.info(f"    Törlésre jelölve (nem választott): {name}")
+        if removed:
+            self.session.query(GameParticipant)\
+                .filter(GameParticipant.game_id == game_id, not_picked)\
+                .delete(synchronize_session=False)
+
+        active_count = self.session.query(func.count(GameParticipant.id))\
+            .filter(GameParticipant.game_id == game_id)\
+            .scalar()
+
+        # 2. LÉPÉS: Ha senki nem maradt, töröljük az egész játékot
+        if active_count == 0:
+            logging.info("    Senki nem választott -> A teljes játék törlése.")
+            self.session.query(Game).filter(Game.id == game_id).delete(synchronize_session=False)
+            self.session.commit()
+            audit_log.info("draft_discarded", extra={"audit": {"game_id": game_id, "reason": "no_selection"}})
+            return 0
+
+        # 3. LÉPÉS: Lezárás (ez tünteti el a Draft oldalról) + statisztika, egy tranzakcióban
+        closed = self.session.query(Game)\
+            .filter(Game.id == game_id, Game.is_active == True)\
+            .update({Game.is_active: False, Game.version: Game.version + 1}, synchronize_session=False)
+        if not closed:
+            # Közben valaki más lezárta
+            self.session.rollback()
+            return None
+        self._stats_apply_game(game_id, +1)
+        if row.winner_id is not None:
+            self._ratings_replay_from(game_id)
+        self.session.commit()
+        audit_log.info("draft_finalized", extra={"audit": {
+            "game_id": game_id, "players": active_count, "removed_player_ids": [p_id for p_id, _ in removed],
+        }})
+        return active_count
+
+    # --- TÖMEGES IMPORT / EXPORT ---
+
+    def import_games(self, records, create_players=False, batch_size=IMPORT_BATCH_SIZE):
+        """
+        Régi meccsek tömeges betöltése (history_io.ImportRecord-ok, akár generátorból).
+        A nevek memóriabeli szótárakból oldódnak fel; a hibás meccsek kimaradnak (a többi bekerül).
+        Kötegenként EGY tranzakció: játékok + résztvevők + statisztika együtt.
+        create_players=True: az ismeretlen játékosnevek új játékosként jönnek létre.
+        Visszatérés: {"imported", "skipped", "players_created", "errors": [(sor, üzenet), ...]}
+        """
+        catalog = get_faction_catalog()
+        player_ids = {name: p_id for p_id, name in self.session.query(Player.id, Player.name)}
+        result = {"imported": 0, "skipped": 0, "players_created": 0, "errors": []}
+        batch = []
+        earliest_rated = None  # a legkorábbi győztessel importált meccs dátuma: innen kell újraértékelni
+
+        def reject(record, message):
+            result["skipped"] += 1
+            if len(result["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+                result["errors"].append((record.line, message))
+
+        for record in records:
+            if record.error:
+                reject(record, record.error)
+                continue
+            if len(record.participants) < 3:
+                reject(record, "legalább 3 játékos kell")
+                continue
+
+            pairs = []
+            problem = None
+            for player_name, faction_name in record.participants:
+                if not player_name:
+                    problem = "üres játékosnév"
+                    break
+                faction_id = catalog.resolve(faction_name)
+                if faction_id is None:
+                    problem = f"ismeretlen faj: {faction_name!r}"
+                    break
+                if player_name not in player_ids and not create_players:
+                    problem = f"ismeretlen játékos: {player_name!r}"
+                    break
+                pairs.append((player_name, faction_id))
+            if problem is None:
+                names = [name for name, _ in pairs]
+                if len(set(names)) != len(names):
+                    problem = "egy játékos kétszer szerepel"
+                elif record.winner and record.winner not in names:
+                    problem = f"a győztes ({record.winner}) nem játszott a meccsen"
+            if problem:
+                reject(record, problem)
+                continue
+
+            # Új játékosok (csak create_players mellett jutunk ide ismeretlen névvel)
+            for name, _ in pairs:
+                if name not in player_ids:
+                    player = Player(name=name)
+                    self.session.add(player)
+                    self.session.flush()
+                    player_ids[name] = player.id
+                    result["players_created"] += 1
+
+            if record.winner and (earliest_rated is None or record.date < earliest_rated):
+                earliest_rated = record.date
+            batch.append((
+                {"date": record.date, "is_active": False, "version": 0,
+                 "winner_id": player_ids[record.winner] if record.winner else None},
+                [(player_ids[name], f_id) for name, f_id in pairs],
+            ))
+            if len(batch) >= batch_size:
+                result["imported"] += self._import_batch(batch)
+                batch = []
+
+        if batch:
+            result["imported"] += self._import_batch(batch)
+        if earliest_rated is not None:
+            cut_game_id = self.session.query(Game.id).filter(Game.date >= earliest_rated)\
+                .order_by(Game.date, Game.id).limit(1).scalar()
+            self._ratings_replay_from(cut_game_id)
+        self.session.commit()  # az esetleg csak új játékosokat tartalmazó maradék + értékszámok
+
+        logging.info(f"DB: Import kész: {result['imported']} meccs betöltve, {result['skipped']} kihagyva, "
+                     f"{result['players_created']} új játékos.")
+        return result
+
+    def _import_batch(self, batch):
+        """Egy köteg mentése ORM objektumok nélkül: a játékok egy multi-row INSERT ... RETURNING-gel,
+        a résztvevők egyetlen executemany-vel, utána a statisztika halmaz-alapon."""
+        game_ids = self.session.execute(
+            insert(Game).returning(Game.id, sort_by_parameter_order=True),
+            [game_row for game_row, _ in batch]
+        ).scalars().all()
+
+        participant_rows = [
+            {"game_id": game_id, "game_date": game_row["date"], "player_id": player_id,
+             "selected_faction_id": faction_id}
+            for game_id, (game_row, pairs) in zip(game_ids, batch)
+            for player_id, faction_id in pairs
+        ]
+        self.session.execute(
+            # A dátum ugyanabban a formában kerüljön be, mint a games.date (az ORM DateTime típusával)
+            text("INSERT INTO game_participants (game_id, game_date, player_id, selected_faction_id) "
+                 "VALUES (:game_id, :game_date, :player_id, :selected_faction_id)")
+                .bindparams(bindparam('game_date', type_=DateTime)),
+            participant_rows
+        )
+
+        self._stats_apply_games(game_ids, +1)
+        self.session.commit()
+        db_log.debug("DB: Import köteg mentve (%d meccs).", len(batch))
+        return len(batch)
+
+    def iter_finished_games(self, page_size=EXPORT_PAGE_SIZE):
+        """
+        Az összes lezárt játék oldalanként (keyset lapozás, résztvevőkkel együtt), exporthoz.
+        Egyszerre csak egy oldal van a memóriában; oldalak között a kapcsolat visszamegy a poolba.
+        """
+        cursor = None
+        while True:
+            games, cursor = self.get_finished_games_page(cursor=cursor, limit=page_size)
+            if games:
+                yield games
+            self.close_session()
+            if cursor is None:
+                return
+
+    # --- SÉMA MIGRÁCIÓK ---
+    # Az adatbázis a PRAGMA user_version-ben tárolja, hányadik migrációnál tart.
+    # Új migráció: a lista VÉGÉRE, a következő sorszámmal. Mindegyik csak egyszer fut le.
+
+    def _run_migrations(self):
+        migrations = [
+            (1, "winner_id oszlop", self._migrate_winner_id),
+            (2, "draft_offers tábla", self._migrate_draft_offers),
+            (3, "indexek a draft és history lekérdezésekhez", self._migrate_indexes),
+            (4, "statisztika táblák feltöltése", self.rebuild_stats),
+            (5, "games.version oszlop", self._migrate_game_version),
+            (6, "ON DELETE CASCADE a résztvevőkön és kínálatokon", self._migrate_cascade_deletes),
+            (7, "értékszámok (Elo) feltöltése", self.rebuild_ratings),
+            (8, "résztvevő verzió + játék verzió trigger", self._migrate_selection_version),
+            (9, "indexek a history szűréshez", self._migrate_history_filter_indexes),
+            (10, "games.last_activity oszlop + trigger", self._migrate_last_activity),
+            (11, "incremental auto_vacuum", self._migrate_incremental_vacuum),
+            (12, "game_participants.game_date + index a draft előzményekhez", self._migrate_participant_game_date),
+        ]
+
+        current_version = self.session.execute(text("PRAGMA user_version")).scalar()
+        pending = [m for m in migrations if m[0] > current_version]
+        if not pending:
+            logging.info(f"DB: Séma naprakész (verzió: {current_version}).")
+            return
+
+        for version, name, migrate in pending:
+            logging.info(f"DB: Migráció #{version} ({name}) indítása...")
+            migrate()
+            # A PRAGMA nem paraméterezhető, de a verzió itt mindig egész szám
+            self.session.execute(text(f"PRAGMA user_version = {int(version)}"))
+            self.session.commit()
+            logging.info(f"DB: Migráció #{version} kész.")
+
+    def _table_columns(self, table_name):
+        return [row[1] for row in self.session.execute(text(f"PRAGMA table_info({table_name})"))]
+
+    def _migrate_winner_id(self):
+        """Régi adatbázisokból hiányzik a games.winner_id oszlop."""
+        if 'winner_id' in self._table_columns('games'):
+            return
+        logging.info("DB: 'winner_id' oszlop hiányzik -> hozzáadás...")
+        self.session.execute(text("ALTER TABLE games ADD COLUMN winner_id INTEGER REFERENCES players(id)"))
+        self.session.commit()
+
+    def _migrate_game_version(self):
+        if 'version' in self._table_columns('games'):
+            return
+        self.session.execute(text("ALTER TABLE games ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+        self.session.commit()
+
+    def _migrate_selection_version(self):
+        """
+        game_participants.version (optimista zárolás a választásnál), és egy trigger, ami minden
+        választáskor a játék verzióját is növeli - így egy kattintás egyetlen UPDATE utasítás.
+        """
+        if 'version' not in self._table_columns('game_participants'):
+            self.session.execute(text("ALTER TABLE game_participants ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+        self.session.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS trg_game_participants_selection_version
+            AFTER UPDATE OF selected_faction_id ON game_participants
+            BEGIN
+                UPDATE games SET version = version + 1 WHERE id = NEW.game_id;
+            END
+        """))
+        self.session.commit()
+
+    def _has_cascade(self, table_name, ref_table):
+        return any(row[2] == ref_table and row[6] == 'CASCADE'
+                   for row in self.session.execute(text(f"PRAGMA foreign_key_list({table_name})")))
+
+    def _migrate_cascade_deletes(self):
+        """
+        A game_participants.game_id és draft_offers.participant_id külső kulcsok ON DELETE CASCADE-re
+        cserélése. SQLite-ban ez csak a tábla újraépítésével megy (új tábla, átmásolás, csere);
+        közben a külső kulcsok ellenőrzése ki van kapcsolva. Az árva sorok (nem létező játék /
+        résztvevő) nem kerülnek át.
+        """
+        if self._has_cascade('game_participants', 'games') and self._has_cascade('draft_offers', 'game_participants'):
+            return
+
+        self.session.commit()
+        statements = [
+            """CREATE TABLE game_participants_new (
+                id INTEGER NOT NULL,
+                game_id INTEGER,
+                player_id INTEGER,
+                selected_faction_id INTEGER,
+                PRIMARY KEY (id),
+                FOREIGN KEY(game_id) REFERENCES games (id) ON DELETE CASCADE,
+                FOREIGN KEY(player_id) REFERENCES players (id),
+                FOREIGN KEY(selected_faction_id) REFERENCES factions (id)
+            )""",
+            """INSERT INTO game_participants_new (id, game_id, player_id, selected_faction_id)
+               SELECT id, game_id, player_id, selected_faction_id FROM game_participants
+               WHERE game_id IN (SELECT id FROM games)""",
+            """CREATE TABLE draft_offers_new (
+                participant_id INTEGER NOT NULL,
+                slot INTEGER NOT NULL,
+                faction_id INTEGER NOT NULL,
+                PRIMARY KEY (participant_id, slot),
+                FOREIGN KEY(participant_id) REFERENCES game_participants (id) ON DELETE CASCADE,
+                FOREIGN KEY(faction_id) REFERENCES factions (id)
+            )""",
+            """INSERT INTO draft_offers_new (participant_id, slot, faction_id)
+               SELECT participant_id, slot, faction_id FROM draft_offers
+               WHERE participant_id IN (SELECT id FROM game_participants_new)""",
+            "DROP TABLE draft_offers",
+            "DROP TABLE game_participants",
+            "ALTER TABLE game_participants_new RENAME TO game_participants",
+            "ALTER TABLE draft_offers_new RENAME TO draft_offers",
+            "CREATE INDEX ix_game_participants_player_game ON game_participants (player_id, game_id)",
+            "CREATE INDEX ix_game_participants_game ON game_participants (game_id)",
+            "CREATE INDEX ix_draft_offers_faction ON draft_offers (faction_id, participant_id)",
+        ]
+
+        # A pragma kapcsolatonkénti: a kikapcsolás, az újraépítés és a visszakapcsolás ugyanazon az
+        # (itt kézben tartott) kapcsolaton fusson, különben egy poolbeli kapcsolaton kikapcsolva maradhat
+        with get_engine().connect() as conn:
+            # Tranzakción KÍVÜL kell állítani, különben hatástalan
+            conn.execute(text("PRAGMA foreign_keys=OFF"))
+            conn.commit()
             try:
-                # SQLite parancs az új oszlop hozzáadására
-                self.session.get_bind().execute(text("ALTER TABLE games ADD COLUMN winner_id INTEGER REFERENCES players(id)"))
-                self.session.commit()
-                logging.info("DB: Migráció sikeres! (winner_id hozzáadva)")
-            except Exception as e:
-                logging.error(f"DB: Migráció sikertelen: {e}")
-
-    def set_game_winner(self, game_id, player_id):
-        game = self.session.query(Game).get(game_id)
-        if game:
-            # Ha ugyanazt küldjük, aki már nyert, akkor "kikapcsoljuk" (toggle)
-            if game.winner_id == player_id:
-                game.winner_id = None
-                logging.info(f"DB: Győztes törölve a meccsről (ID: {game_id})")
-            else:
-                game.winner_id = player_id
-                logging.info(f"DB: Új győztes beállítva (Game: {game_id} -> Player: {player_id})")
+                for statement in statements:
+                    conn.execute(text(statement))
+
+                violations = conn.execute(text("PRAGMA foreign_key_check")).all()
+                if violations:
+                    logging.warning(f"DB: {len(violations)} sor hivatkozik nem létező játékosra / fajra (megmaradnak).")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.execute(text("PRAGMA foreign_keys=ON"))
+                conn.commit()
+
+        # Az árva sorok kimaradtak: a statisztika biztosan konzisztens legyen
+        self.rebuild_stats()
+
+    def _migrate_indexes(self):
+        """A modellekben deklarált indexek létrehozása a már meglévő táblákon is."""
+        statements = [
+            "CREATE INDEX IF NOT EXISTS ix_game_participants_player_game ON game_participants (player_id, game_id)",
+            "CREATE INDEX IF NOT EXISTS ix_game_participants_game ON game_participants (game_id)",
+            "CREATE INDEX IF NOT EXISTS ix_games_active_date ON games (is_active, date DESC, id DESC)",
+            "CREATE INDEX IF NOT EXISTS ix_games_date ON games (date DESC, id DESC)",
+            "CREATE INDEX IF NOT EXISTS ix_draft_offers_faction ON draft_offers (faction_id, participant_id)",
+        ]
+        for statement in statements:
+            self.session.execute(text(statement))
+        # Friss statisztika, hogy a lekérdezés-tervező tényleg használja őket
+        self.session.execute(text("ANALYZE"))
+        self.session.commit()
+
+    def _migrate_history_filter_indexes(self):
+        statements = [
+            "CREATE INDEX IF NOT EXISTS ix_game_participants_game_player_faction "
+            "ON game_participants (game_id, player_id, selected_faction_id)",
+            "CREATE INDEX IF NOT EXISTS ix_games_winner_date ON games (winner_id, is_active, date DESC, id DESC)",
+        ]
+        for statement in statements:
+            self.session.execute(text(statement))
+        self.session.execute(text("ANALYZE"))
+        self.session.commit()
+
+    def _migrate_last_activity(self):
+        """games.last_activity: a választás triggere ezt is frissíti (helyi idő, mint a games.date)."""
+        if 'last_activity' not in self._table_columns('games'):
+            self.session.execute(text("ALTER TABLE games ADD COLUMN last_activity DATETIME"))
+        self.session.execute(text("UPDATE games SET last_activity = date WHERE last_activity IS NULL AND is_active = 1"))
+        self.session.execute(text("DROP TRIGGER IF EXISTS trg_game_participants_selection_version"))
+        self.session.execute(text("""
+            CREATE TRIGGER trg_game_participants_selection_version
+            AFTER UPDATE OF selected_faction_id ON game_participants
+            BEGIN
+                UPDATE games SET version = version + 1, last_activity = datetime('now', 'localtime')
+                WHERE id = NEW.game_id;
+            END
+        """))
+        self.session.commit()
+
+    def _migrate_incremental_vacuum(self):
+        """
+        auto_vacuum=INCREMENTAL, hogy a karbantartás kis lépésekben adhassa vissza a szabad lapokat.
+        Meglévő adatbázison csak egy teljes VACUUM után lép életbe (egyszer, indításkor).
+        """
+        if self.session.execute(text("PRAGMA auto_vacuum")).scalar() == 2:
+            return
+        self.session.commit()
+        # Tranzakción KÍVÜL kell futnia
+        self.session.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+        self.session.execute(text("VACUUM"))
+        self.session.commit()
+
+    def _migrate_participant_game_date(self):
+        """
+        game_participants.game_date: a games.date másolata. A kódból minden beszúrás kitölti; a
+        triggerek a többi utat fedik le (hiányzó érték beszúráskor, a játék dátumának módosítása).
+        """
+        if 'game_date' not in self._table_columns('game_participants'):
+            self.session.execute(text("ALTER TABLE game_participants ADD COLUMN game_date DATETIME"))
+        statements = [
+            """UPDATE game_participants
+               SET game_date = (SELECT date FROM games WHERE games.id = game_participants.game_id)
+               WHERE game_date IS NULL""",
+            """CREATE TRIGGER IF NOT EXISTS trg_game_participants_game_date
+               AFTER INSERT ON game_participants WHEN NEW.game_date IS NULL
+               BEGIN
+                   UPDATE game_participants SET game_date = (SELECT date FROM games WHERE id = NEW.game_id)
+                   WHERE id = NEW.id;
+               END""",
+            """CREATE TRIGGER IF NOT EXISTS trg_games_date_participants
+               AFTER UPDATE OF date ON games
+               BEGIN
+                   UPDATE game_participants SET game_date = NEW.date WHERE game_id = NEW.id;
+               END""",
+            "CREATE INDEX IF NOT EXISTS ix_game_participants_player_date "
+            "ON game_participants (player_id, game_date DESC, game_id DESC)",
+            "ANALYZE",
+        ]
+        for statement in statements:
+            self.session.execute(text(statement))
+        self.session.commit()
+
+    def _migrate_draft_offers(self):
+        """
+        Egyszeri migráció: a régi game_participants.drafted_factions_json (JSON szöveg)
+        átmásolása a draft_offers táblába, majd az oszlop eldobása.
+        """
+        if 'drafted_factions_json' not in self._table_columns('game_participants'):
+            return
+
+        logging.info("DB: 'drafted_factions_json' oszlop még létezik -> Migráció a draft_offers táblába...")
+        rows = self.session.execute(text(
+            "SELECT id, drafted_factions_json FROM game_participants WHERE drafted_factions_json IS NOT NULL"
+        )).all()
 
+        offers = []
+        for participant_id, raw in rows:
+            try:
+                faction_ids = json.loads(raw)
+            except (ValueError, TypeError):
+                logging.warning(f"DB: Hibás JSON a résztvevőnél (ID: {participant_id}), kihagyva: {raw!r}")
+                continue
+            for slot, faction_id in enumerate(faction_ids):
+                offers.append({"participant_id": participant_id, "slot": slot, "faction_id": faction_id})
+
+        if offers:
+            self.session.execute(
+                text("INSERT OR IGNORE INTO draft_offers (participant_id, slot, faction_id) VALUES (:participant_id, :slot, :faction_id)"),
+                offers
+            )
+        self.session.commit()
+        logging.info(f"DB: {len(offers)} felkínált faj átmásolva ({len(rows)} résztvevő).")
+
+        try:
+            # SQLite 3.35+ kell hozzá; régebbin az oszlop marad, de már senki nem használja
+            self.session.execute(text("ALTER TABLE game_participants DROP COLUMN drafted_factions_json"))
             self.session.commit()
-            return True
-        return False
-    def start_new_game_draft(self, player_ids):
+            logging.info("DB: Migráció sikeres! (drafted_factions_json eldobva)")
+        except Exception as e:
+            self.session.rollback()
+            logging.warning(f"DB: A régi oszlop nem dobható el (maradhat, nem használt): {e}")
+
+    def set_game_winner(self, game_id, player_id, expected_version=None):
+        """
+        Győztes állítása / törlése (ha ugyanazt küldjük, aki már nyert: "kikapcsoljuk").
+        Egyetlen feltételes UPDATE végzi az ellenőrzést és a váltást (előzetes olvasás nélkül); ha a
+        kliens küldött verziót, csak azzal egyezve ír, így egy közbeeső módosítás nem íródik felül.
+        Visszatérés: True / False (nincs ilyen játék, vagy a játékos nem résztvevő).
+        VersionConflict: közben más módosította a játékot.
+        """
+        params = {"game_id": game_id, "player_id": player_id, "version": expected_version}
+
+        # A régi győzelem levonása a váltás ELŐTT, ugyanabban az írási tranzakcióban: az első írás
+        # megszerzi az SQLite írási zárát, így a két utasítás között más nem módosíthatja a játékot.
+        # (A RETURNING csak az új értékeket adja vissza, a régi győztest így SQL-ben olvassuk.)
+        self._stats_apply_winner(game_id, -1)
+        row = self.session.execute(text("""
+            UPDATE games
+            SET winner_id = CASE WHEN winner_id = :player_id THEN NULL ELSE :player_id END,
+                version = version + 1
+            WHERE id = :game_id AND (:version IS NULL OR version = :version)
+              AND (winner_id = :player_id OR EXISTS (SELECT 1 FROM game_participants
+                                                     WHERE game_id = :game_id AND player_id = :player_id))
+            RETURNING winner_id, is_active
+        """), params).first()
+        if row is None:
+            self.session.rollback()
+            current = self.session.query(Game.version).filter(Game.id == game_id).scalar()
+            if current is not None and expected_version is not None and current != expected_version:
+                raise VersionConflict(current)
+            return False
+
+        new_winner_id, is_active = row
+        if new_winner_id is None:
+            logging.info(f"DB: Győztes törölve a meccsről (ID: {game_id})")
+        else:
+            logging.info(f"DB: Új győztes beállítva (Game: {game_id} -> Player: {player_id})")
+
+        if not is_active:
+            self._stats_apply_winner(game_id, +1)
+            # Értékszám: ettől a meccstől újra (a legutóbbi meccsnél csak ez az egy)
+            self._ratings_replay_from(game_id)
+
+        self.session.commit()
+        return True
+
+    # --- STATISZTIKA ---
+    # A számlálókat SQL UPSERT-tel (INSERT ... ON CONFLICT DO UPDATE) toljuk el +1 / -1 játékkal,
+    # így egy lezárás vagy törlés táblánként egyetlen utasítás, objektumok betöltése nélkül.
+
+    def _stats_apply_game(self, game_id, sign):
+        """Egy lezárt játék teljes hozzájárulása a statisztikához (+1: hozzáad, -1: kivon)."""
+        self._stats_apply_games([game_id], sign)
+
+    def _stats_apply_games(self, game_ids, sign):
+        """Több lezárt játék hozzájárulása egyszerre (halmaz-alapú upsertek, pl. tömeges importnál)."""
+        params = {"game_ids": list(game_ids), "sign": sign}
+        ids = bindparam("game_ids", expanding=True)
+
+        self.session.execute(text("""
+            INSERT INTO player_stats (player_id, games_played, wins)
+            SELECT player_id, :sign * COUNT(*), 0 FROM game_participants WHERE game_id IN :game_ids
+            GROUP BY player_id
+            ON CONFLICT(player_id) DO UPDATE SET games_played = games_played + excluded.games_played
+        """).bindparams(ids), params)
+
+        self.session.execute(text("""
+            INSERT INTO faction_stats (faction_id, offered, picked, wins)
+            SELECT selected_faction_id, 0, :sign * COUNT(*), 0 FROM game_participants
+            WHERE game_id IN :game_ids AND selected_faction_id IS NOT NULL
+            GROUP BY selected_faction_id
+            ON CONFLICT(faction_id) DO UPDATE SET picked = picked + excluded.picked
+        """).bindparams(ids), params)
+
+        self.session.execute(text("""
+            INSERT INTO faction_stats (faction_id, offered, picked, wins)
+            SELECT o.faction_id, :sign * COUNT(*), 0, 0
+            FROM draft_offers o JOIN game_participants gp ON gp.id = o.participant_id
+            WHERE gp.game_id IN :game_ids
+            GROUP BY o.faction_id
+            ON CONFLICT(faction_id) DO UPDATE SET offered = offered + excluded.offered
+        """).bindparams(ids), params)
+
+        # Győzelmek: a játékos és az akkor választott faja
+        self.session.execute(text("""
+            INSERT INTO player_stats (player_id, games_played, wins)
+            SELECT g.winner_id, 0, :sign * COUNT(*)
+            FROM games g JOIN game_participants gp ON gp.game_id = g.id AND gp.player_id = g.winner_id
+            WHERE g.id IN :game_ids
+            GROUP BY g.winner_id
+            ON CONFLICT(player_id) DO UPDATE SET wins = wins + excluded.wins
+        """).bindparams(ids), params)
+
+        self.session.execute(text("""
+            INSERT INTO faction_stats (faction_id, offered, picked, wins)
+            SELECT gp.selected_faction_id, 0, 0, :sign * COUNT(*)
+            FROM games g JOIN game_participants gp ON gp.game_id = g.id AND gp.player_id = g.winner_id
+            WHERE g.id IN :game_ids AND gp.selected_faction_id IS NOT NULL
+            GROUP BY gp.selected_faction_id
+            ON CONFLICT(faction_id) DO UPDATE SET wins = wins + excluded.wins
+        """).bindparams(ids), params)
+
+    def _stats_apply_winner(self, game_id, sign):
+        """
+        A játék JELENLEGI győzelmének jóváírása / levonása a játékosnál és a faján, SQL-ben olvasva
+        (csak lezárt játéknál, és csak ha a győztes résztvevő, mint a rebuild_stats-nál).
+        """
+        params = {"game_id": game_id, "sign": sign}
+
+        self.session.execute(text("""
+            INSERT INTO player_stats (player_id, games_played, wins)
+            SELECT gp.player_id, 0, :sign
+            FROM games g JOIN game_participants gp ON gp.game_id = g.id AND gp.player_id = g.winner_id
+            WHERE g.id = :game_id AND g.is_active = 0
+            ON CONFLICT(player_id) DO UPDATE SET wins = wins + excluded.wins
+        """), params)
+
+        self.session.execute(text("""
+            INSERT INTO faction_stats (faction_id, offered, picked, wins)
+            SELECT gp.selected_faction_id, 0, 0, :sign
+            FROM games g JOIN game_participants gp ON gp.game_id = g.id AND gp.player_id = g.winner_id
+            WHERE g.id = :game_id AND g.is_active = 0 AND gp.selected_faction_id IS NOT NULL
+            ON CONFLICT(faction_id) DO UPDATE SET wins = wins + excluded.wins
+        """), params)
+
+    # A teljes újraszámolás lekérdezései (a rebuild_stats írja be, a check_stats csak összeveti)
+    _PLAYER_STATS_FULL = """
+        SELECT gp.player_id, COUNT(*), SUM(CASE WHEN g.winner_id = gp.player_id THEN 1 ELSE 0 END)
+        FROM game_participants gp JOIN games g ON g.id = gp.game_id
+        WHERE g.is_active = 0
+        GROUP BY gp.player_id
+    """
+
+    _FACTION_STATS_FULL = """
+        SELECT f.id,
+            (SELECT COUNT(*) FROM draft_offers o
+                JOIN game_participants gp ON gp.id = o.participant_id
+                JOIN games g ON g.id = gp.game_id
+                WHERE g.is_active = 0 AND o.faction_id = f.id),
+            (SELECT COUNT(*) FROM game_participants gp
+                JOIN games g ON g.id = gp.game_id
+                WHERE g.is_active = 0 AND gp.selected_faction_id = f.id),
+            (SELECT COUNT(*) FROM game_participants gp
+                JOIN games g ON g.id = gp.game_id
+                WHERE g.is_active = 0 AND gp.selected_faction_id = f.id AND g.winner_id = gp.player_id)
+        FROM factions f
+    """
+
+    def rebuild_stats(self):
+        """A statisztika táblák teljes újraszámolása a history-ból (javításhoz / migrációhoz)."""
+        logging.info("DB: Statisztika újraépítése...")
+        self.session.execute(text("DELETE FROM player_stats"))
+        self.session.execute(text("DELETE FROM faction_stats"))
+
+        self.session.execute(text(
+            "INSERT INTO player_stats (player_id, games_played, wins)" + self._PLAYER_STATS_FULL))
+        self.session.execute(text(
+            "INSERT INTO faction_stats (faction_id, offered, picked, wins)" + self._FACTION_STATS_FULL))
+
+        self.session.commit()
+        logging.info("DB: Statisztika újraépítve.")
+
+    def check_stats(self):
+        """
+        Az előre összesített táblák összevetése a teljes újraszámolással, írás nélkül.
+        Visszaad: az eltérések listája [(tábla, kulcs, tárolt, várt), ...]; üres, ha minden egyezik.
+        A csupa nulla sor ugyanaz, mint a hiányzó (a -1-es upsertek nullára futhatnak).
+        """
+        def load(sql):
+            return {row[0]: tuple(row[1:]) for row in self.session.execute(text(sql)).all()
+                    if any(row[1:])}
+
+        differences = []
+        for table, stored_sql, expected_sql in (
+                ("player_stats", "SELECT player_id, games_played, wins FROM player_stats",
+                 self._PLAYER_STATS_FULL),
+                ("faction_stats", "SELECT faction_id, offered, picked, wins FROM faction_stats",
+                 self._FACTION_STATS_FULL)):
+            stored, expected = load(stored_sql), load(expected_sql)
+            for key in sorted(stored.keys() | expected.keys()):
+                if stored.get(key) != expected.get(key):
+                    differences.append((table, key, stored.get(key), expected.get(key)))
+
+        if differences:
+            logging.warning(f"DB: A statisztika {len(differences)} sorban eltér az újraszámolástól.")
+        return differences
+
+    def get_player_stats(self):
+        """Játékos statisztika (győzelmek szerint csökkenő), csak az összesítő táblából."""
+        return self.session.query(PlayerStat)\
+            .options(joinedload(PlayerStat.player))\
+            .filter(PlayerStat.games_played > 0)\
+            .order_by(PlayerStat.wins.desc(), PlayerStat.games_played.asc())\
+            .all()
+
+    def get_faction_stats(self):
+        return self.session.query(FactionStat)\
+            .order_by(FactionStat.picked.desc(), FactionStat.offered.desc())\
+            .all()
+
+    # --- ÉRTÉKSZÁM (ELO) ---
+    # Egy győztes állítása / törlése, egy meccs lezárása vagy törlése csak az adott meccstől
+    # (dátum, id sorrendben) játssza újra az értékelt meccseket. A legutóbbi meccsnél ez egyetlen
+    # meccs; a kiinduló értékszámot az első érintett pillanatkép "előtte" értéke adja.
+
+    # Az érintett meccsek: a (date, id) sorrendben a megadott meccs és az utána következők
+    _RATING_CUT = "(g.date, g.id) >= (SELECT date, id FROM games WHERE id = :cut_id)"
+
+    def _ratings_replay_from(self, cut_game_id=None, exclude_game_ids=()):
+        """
+        Értékszámok újraszámolása a cut_game_id meccstől kezdve (None: a teljes history).
+        exclude_game_ids: ezek a meccsek már ne számítsanak (pl. törlés előtt hívva).
+        """
+        params = {"cut_id": cut_game_id}
+        cut = self._RATING_CUT if cut_game_id is not None else "1 = 1"
+
+        # 1. Kiinduló értékszámok: a jelenlegiek, felülírva az első érintett meccs előtti értékkel
+        start_ratings = dict(self.session.execute(text("SELECT player_id, rating FROM player_ratings")).all())
+        rows = self.session.execute(text(f"""
+            SELECT s.player_id, s.rating_before FROM rating_snapshots s JOIN games g ON g.id = s.game_id
+            WHERE {cut} ORDER BY g.date DESC, g.id DESC
+        """), params).all()
+        for player_id, rating_before in rows:  # a legkorábbi marad
+            start_ratings[player_id] = rating_before
+        affected = {player_id for player_id, _ in rows}
+
+        self.session.execute(text(f"""
+            DELETE FROM rating_snapshots WHERE game_id IN (SELECT g.id FROM games g WHERE {cut})
+        """), params)
+
+        # 2. Az érintett, értékelt meccsek időrendben (egy lekérdezés, résztvevőnként egy sor)
+        game_rows = self.session.execute(text(f"""
+            SELECT g.id, g.winner_id, gp.player_id
+            FROM games g JOIN game_participants gp ON gp.game_id = g.id
+            WHERE g.is_active = 0 AND g.winner_id IS NOT NULL AND {cut}
+            ORDER BY g.date, g.id, gp.id
+        """), params)
+        excluded = set(exclude_game_ids)
+        games = [
+            (game_id, [player_id for _, _, player_id in rows_of_game], winner_id)
+            for (game_id, winner_id), rows_of_game in groupby(game_rows, key=lambda row: (row[0], row[1]))
+            if game_id not in excluded
+        ]
+
+        # 3. Újrajátszás memóriában, a pillanatképek kötegelt (executemany) beírása
+        ratings, snapshots = replay_ratings(games, start_ratings)
+        snapshot_insert = text("INSERT INTO rating_snapshots (game_id, player_id, rating_before, rating_after) "
+                               "VALUES (:game_id, :player_id, :rating_before, :rating_after)")
+        for start in range(0, len(snapshots), RATING_BATCH_SIZE):
+            self.session.execute(snapshot_insert, [
+                {"game_id": g_id, "player_id": p_id, "rating_before": before, "rating_after": after}
+                for g_id, p_id, before, after in snapshots[start:start + RATING_BATCH_SIZE]
+            ])
+        affected.update(p_id for _, p_id, _, _ in snapshots)
+
+        # 4. Az érintett játékosok jelenlegi értékszáma
+        if affected:
+            self.session.execute(text("""
+                INSERT INTO player_ratings (player_id, rating, games_rated)
+                VALUES (:player_id, :rating, (SELECT COUNT(*) FROM rating_snapshots WHERE player_id = :player_id))
+                ON CONFLICT(player_id) DO UPDATE SET rating = excluded.rating, games_rated = excluded.games_rated
+            """), [{"player_id": p_id, "rating": ratings.get(p_id, INITIAL_RATING)} for p_id in affected])
+        db_log.debug("DB: Értékszám újrajátszás (%s-tól): %d meccs, %d játékos.",
+                     cut_game_id or "kezdet", len(games), len(affected))
+
+    def rebuild_ratings(self):
+        """Az értékszámok teljes újraszámolása a history-ból (javításhoz / migrációhoz)."""
+        logging.info("DB: Értékszámok újraépítése...")
+        self.session.execute(text("DELETE FROM rating_snapshots"))
+        self.session.execute(text("DELETE FROM player_ratings"))
+        self._ratings_replay_from(None)
+        self.session.commit()
+        logging.info("DB: Értékszámok újraépítve.")
+
+    def get_leaderboard(self):
+        """Ranglista a tárolt értékszámokból (legalább egy értékelt meccs kell)."""
+        return self.session.query(PlayerRating)\
+            .options(joinedload(PlayerRating.player))\
+            .filter(PlayerRating.games_rated > 0)\
+            .order_by(PlayerRating.rating.desc())\
+            .all()
+
+    # --- KARBANTARTÁS ---
+    # A háttér ütemező (maintenance.py) hívja őket, de parancssorból is futtathatók (flask maintenance).
+
+    def reap_stale_drafts(self, cutoff):
+        """
+        A cutoff óta inaktív futó draftok kezelése. Csak a választás NÉLKÜLI draft törlődik (elhagyott
+        sorsolás); ahol már valaki választott, az lehet egy lassú, de valódi meccs: azt nem zárjuk le
+        (akkor győztes nélkül kerülne a statisztikába), csak visszaadjuk, hogy a napló jelezze.
+        Visszatérés: (törölt játék ID-k, régóta álló, választással rendelkező játék ID-k)
+        """
+        stale = self.session.query(Game.id)\
+            .filter(Game.is_active == True, func.coalesce(Game.last_activity, Game.date) < cutoff)
+        has_pick = exists().where(GameParticipant.game_id == Game.id,
+                                  GameParticipant.selected_faction_id.isnot(None))
+
+        # Egyetlen feltételes DELETE: ha közben valaki választott, az a draft már nem törlődik
+        deleted_ids = self.session.execute(text("""
+            DELETE FROM games
+            WHERE is_active = 1 AND COALESCE(last_activity, date) < :cutoff
+              AND NOT EXISTS (SELECT 1 FROM game_participants
+                              WHERE game_id = games.id AND selected_faction_id IS NOT NULL)
+            RETURNING id
+        """).bindparams(bindparam('cutoff', type_=DateTime)), {"cutoff": cutoff}).scalars().all()
+        self.session.commit()
+        for game_id in sorted(deleted_ids):
+            audit_log.info("draft_discarded", extra={"audit": {"game_id": game_id, "reason": "expired"}})
+
+        flagged_ids = [g_id for (g_id,) in stale.filter(has_pick).order_by(Game.id)]
+        return sorted(deleted_ids), flagged_ids
+
+    def analyze_database(self):
+        """Friss statisztika a lekérdezés-tervezőnek (melyik index mennyire szelektív)."""
+        self.session.execute(text("ANALYZE"))
+        self.session.commit()
+
+    def incremental_vacuum(self, max_pages=0):
+        """
+        Legfeljebb max_pages szabad lap visszaadása a fájlrendszernek (0 = mind). Rövid írási zár,
+        a teljes VACUUM-mal szemben nem másolja újra az egész adatbázist.
+        Visszatérés: a felszabadított lapok száma, vagy None, ha az auto_vacuum nem INCREMENTAL.
+        """
+        if self.session.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+            return None
+        free_before = self.session.execute(text("PRAGMA freelist_count")).scalar()
+        self.session.commit()
+        # A Python sqlite3 execute()-ja csak egy lépést futtat (az egyetlen lapot ad vissza),
+        # az executescript végigviszi a teljes utasítást
+        self.session.connection().connection.driver_connection.executescript(
+            f"PRAGMA incremental_vacuum({int(max_pages)})")
+        self.session.commit()
+        return free_before - self.session.execute(text("PRAGMA freelist_count")).scalar()
+
+    def _load_draft_history(self, player_ids):
+        """
+        Az összes játékos draft-előzménye EGY lekérdezéssel.
+        Visszatérés: {player_id: (played_mask, offered_mask)}
+          - played_mask: az utolsó 2 LEZÁRT meccsén választott fajok
+          - offered_mask: az utolsó 2 sorsolásán (aktív is) felkínált fajok
+        Játékosonként egy-egy korrelált LIMIT 2 al-lekérdezés az ix_game_participants_player_date
+        indexen: a legújabb sorokkal kezd és 2 találat után megáll, így a költség nem nő a history-val.
+        """
+        rows = self.session.execute(text("""
+            SELECT p.id AS player_id, 1 AS played, gp.selected_faction_id AS faction_id
+            FROM players p
+            JOIN game_participants gp ON gp.id IN (
+                SELECT last.id FROM game_participants last
+                JOIN games g ON g.id = last.game_id
+                WHERE last.player_id = p.id AND g.is_active = 0
+                ORDER BY last.game_date DESC, last.game_id DESC
+                LIMIT 2)
+            WHERE p.id IN :player_ids AND gp.selected_faction_id IS NOT NULL
+            UNION ALL
+            SELECT p.id, 0, o.faction_id
+            FROM players p
+            JOIN draft_offers o ON o.participant_id IN (
+                SELECT last.id FROM game_participants last
+                WHERE last.player_id = p.id
+                ORDER BY last.game_date DESC, last.game_id DESC
+                LIMIT 2)
+            WHERE p.id IN :player_ids
+        """).bindparams(bindparam('player_ids', expanding=True)), {"player_ids": list(player_ids)}).all()
+
+        history = {p_id: (0, 0) for p_id in player_ids}
+        for player_id, played, faction_id in rows:
+            played_mask, offered_mask = history[player_id]
+            if played:
+                played_mask |= 1 << faction_id
+            else:
+                offered_mask |= 1 << faction_id
+            history[player_id] = (played_mask, offered_mask)
+
+        return history
+
+    def start_new_game_draft(self, player_ids, engine=None):
+        """
+        Új draft (asztal) sorsolása. Visszatérés: (az új játék ID-ja, a kínálatok játékosnév szerint).
+        engine: 'solver' (alap) vagy 'greedy'; ha az optimalizáló nem talál megoldást, a mohó a tartalék.
+        """
+        engine = engine if engine in DRAFT_ENGINES else DEFAULT_DRAFT_ENGINE
         # ---------------------------------------------------------
         # 0. LÉPÉS: ELŐKÉSZÜLETEK
         # ---------------------------------------------------------
-        all_factions = self.session.query(Faction).all()
-        faction_map = {f.id: f.name for f in all_factions}
+        catalog = get_faction_catalog()
+        faction_by_id = catalog.by_id
+        faction_map = {f.id: f.name for f in catalog.all}
+        all_mask = catalog.all_mask
+
+        # Minden játékos neve egyetlen lekérdezéssel. Csak (id, név) sorok: ORM objektumokat a
+        # takarítás commitja lejártatna, és utána játékosonként újra lekérdeznénk (autoflush-sal)
+        player_names = dict(self.session.query(Player.id, Player.name).filter(Player.id.in_(player_ids)).all())
 
         # ---------------------------------------------------------
         # 1. LÉPÉS: TAKARÍTÁS (Anti-Spam)
         # ---------------------------------------------------------
-        absolute_last_game = self.session.query(Game).order_by(Game.date.desc()).first()
-
-        if absolute_last_game and absolute_last_game.is_active:
-            has_selection = False
-            for p in absolute_last_game.participants:
-                if p.selected_faction_id:
-                    has_selection = True
-                    break
+        # Ugyanennek az asztalnak egy még érintetlen draftját (minden ülője most is itt van)
+        # újrasorsolásnak vesszük, és töröljük. Más asztal draftjához nem nyúlunk: ha valaki ott
+        # is ül, azt a hívó a get_seated_players()-szel előre elutasítja.
+        abandoned_ids = [g_id for g_id, (seated, has_pick) in self._active_drafts_of_players(player_ids).items()
+                         if self._replaceable_draft(seated, has_pick, player_ids)]
 
-            if not has_selection:
-                logging.info(f"Takarítás: Előző, félbehagyott draft (Game ID: {absolute_last_game.id}) törlése...")
-                for p in absolute_last_game.participants:
-                    self.session.delete(p)
-                self.session.delete(absolute_last_game)
-                self.session.commit()
+        if abandoned_ids:
+            logging.info(f"Takarítás: Előző, félbehagyott draft(ok) (Game ID: {abandoned_ids}) törlése...")
+            # Egyetlen DELETE, a résztvevők és kínálataik az ON DELETE CASCADE-del mennek
+            self.session.query(Game).filter(Game.id.in_(abandoned_ids)).delete(synchronize_session=False)
+            self.session.commit()
+            for abandoned_id in abandoned_ids:
+                audit_log.info("draft_discarded", extra={"audit": {"game_id": abandoned_id, "reason": "abandoned"}})
 
         # ---------------------------------------------------------
         # 2. LÉPÉS: GLOBÁLIS TILTÁS (History legutolsó meccs)
         # ---------------------------------------------------------
         last_finished_game = self.session.query(Game).filter_by(is_active=False).order_by(Game.date.desc()).first()
 
-        global_ban_ids = set()
+        global_ban_mask = 0
 
         if last_finished_game:
-            for p in last_finished_game.participants:
-                if p.selected_faction_id:
-                    global_ban_ids.add(p.selected_faction_id)
+            global_ban_mask = ids_to_mask(p.selected_faction_id for p in last_finished_game.participants if p.selected_faction_id)
 
-            if global_ban_ids:
-                ban_names = [faction_map.get(fid, str(fid)) for fid in global_ban_ids]
+            if global_ban_mask:
+                ban_names = [faction_map.get(fid, str(fid)) for fid in mask_to_ids(global_ban_mask)]
                 logging.info(f"GLOBÁLIS TILTÁS (Előző meccs faja): {', '.join(ban_names)}")
 
+        # Az összes játékos előzménye egyben (a takarítás UTÁN, hogy a törölt draft ne számítson)
+        history = self._load_draft_history(list(player_names))
+
         # ---------------------------------------------------------
         # 3. LÉPÉS: SORSOLÁS INDÍTÁSA
         # ---------------------------------------------------------
         logging.info("========================================")
-        logging.info(f"ÚJ SORSOLÁS INDUL {len(player_ids)} JÁTÉKOSSAL")
+        logging.info(f"ÚJ SORSOLÁS INDUL {len(player_ids)} JÁTÉKOSSAL ({engine})")
         logging.info("========================================")
 
         new_game = Game()
@@ -243,133 +1497,93 @@ class TIManager:
         self.session.flush()
 
         draft_results = []
-        session_drafted_ids = set()
+        audit_players = []
+        session_drafted_mask = 0
+        debug = draft_log.isEnabledFor(logging.DEBUG)
 
         random_player_ids = list(player_ids)
         random.shuffle(random_player_ids)
 
-        for p_id in random_player_ids:
-            player = self.session.query(Player).get(p_id)
-            logging.info(f"--- Feldolgozás: [{player.name}] ---")
+        # Optimalizáló: az egész asztal kínálata egyszerre, a legkevesebb szabály-lazítással
+        assignment = None
+        if engine == DRAFT_ENGINE_SOLVER:
+            assignment = solve_draft_assignment(all_mask, [history[p_id] for p_id in random_player_ids],
+                                                global_ban_mask, random)
+            if assignment is None:
+                logging.warning("Optimalizáló: nincs elég faj az ismétlés nélküli kiosztáshoz -> mohó sorsolás.")
+                engine = DRAFT_ENGINE_GREEDY
 
+        for index, p_id in enumerate(random_player_ids):
+            player_name = player_names[p_id]
             # SZŰRÉS 1: Amit TÉNYLEGESEN VÁLASZTOTT (Utolsó 2 meccs)
-            last_2_matches = self.session.query(GameParticipant)\
-                .filter_by(player_id=p_id)\
-                .join(Game)\
-                .filter(Game.is_active == False)\
-                .order_by(Game.date.desc())\
-                .limit(2)\
-                .all()
-
-            played_ids = {h.selected_faction_id for h in last_2_matches if h.selected_faction_id}
-
-            # SZŰRÉS 2: Amit FELKÍNÁLTAK NEKI (Sorsolás history)
-            # --- ITT A VÁLTOZÁS: Limit 3 helyett Limit 2 ---
-            last_2_drafts = self.session.query(GameParticipant)\
-                .filter_by(player_id=p_id)\
-                .join(Game)\
-                .order_by(Game.date.desc())\
-                .limit(2)\
-                .all()
-
-            recent_drafted_ids = set()
-            for match in last_2_drafts:
-                if match.drafted_factions_json:
-                    try:
-                        ids = json.loads(match.drafted_factions_json)
-                        recent_drafted_ids.update(ids)
-                    except:
-                        pass
-
-            # Logolás
-            if played_ids:
-                names = [faction_map.get(i, str(i)) for i in played_ids]
-                logging.info(f"   Tiltva (Utolsó 2 választása): {', '.join(names)}")
-
-            if recent_drafted_ids:
-                names = [faction_map.get(i, str(i)) for i in recent_drafted_ids]
-                logging.info(f"   Tiltva (Utolsó 2 sorsoláson látta): {', '.join(names)}")
-
-
-            # KALAP ÖSSZEÁLLÍTÁSA
-            available_pool = [
-                f for f in all_factions
-                if f.id not in played_ids            # Utolsó 2 választás tiltva
-                and f.id not in recent_drafted_ids   # Utolsó 2 kínálat (6 faj) tiltva
-                and f.id not in session_drafted_ids  # Mostani körben másnak adott tiltva
-                and f.id not in global_ban_ids       # Előző meccs összes faja tiltva
-            ]
-
-            logging.info(f"   Ideális választék mérete: {len(available_pool)}")
-
-            # --- VÉSZTERVEK (Lazított sorrend) ---
-
-            # 1. VÉSZTERV: Elengedjük a "Kínálatban volt" (Draft History) tiltást.
-            # Ez a legkevésbé fontos, ettől még nem lesz ismétlődő a játék.
-            if len(available_pool) < 3:
-                logging.warning("   ! Kevés a faj -> 'Utolsó 2 sorsolásban felkínált' szabály feloldása.")
-                available_pool = [
-                    f for f in all_factions
-                    if f.id not in played_ids             # Még mindig védjük amit játszott
-                    and f.id not in session_drafted_ids
-                    and f.id not in global_ban_ids        # Még mindig védjük az előző meccset
-                    # recent_drafted_ids TÖRÖLVE
-                ]
-
-            # 2. VÉSZTERV: Elengedjük az ELŐZŐ MECCS (Global Ban) tiltását.
-            if len(available_pool) < 3:
-                logging.warning("   !! Még mindig kevés -> 'Előző history játék fajai' tiltás feloldása.")
-                available_pool = [
-                    f for f in all_factions
-                    if f.id not in played_ids             # Még mindig védjük amit játszott
-                    and f.id not in session_drafted_ids
-                    # global_ban_ids TÖRÖLVE
-                ]
-
-            # 3. VÉSZTERV: Elengedjük a "SAJÁT UTOLSÓ 2 VÁLASZTÁS" tiltását.
-            if len(available_pool) < 3:
-                logging.warning("   !!! Még mindig kevés -> 'Utolsó 2 meccsen választott' szabály feloldása.")
-                available_pool = [
-                    f for f in all_factions
-                    if f.id not in session_drafted_ids    # Csak az egyediség számít
-                ]
-
-            # 4. VÉGSŐ KÉTSÉGBEESÉS
-            if len(available_pool) < 3:
-                 logging.error("   !!!! KRITIKUS: Csak a 'mostani egyediség' számít.")
-                 available_pool = [f for f in all_factions if f.id not in session_drafted_ids]
-
-                 if len(available_pool) < 3:
-                     logging.critical("   !!!!! VÉGZETES HIBA: Nincs elég faj a pakliban!")
-                     available_pool = all_factions
-
-            # HÚZÁS
-            drawn_factions = random.sample(available_pool, 3)
-            drawn_ids = [f.id for f in drawn_factions]
-            drawn_names = [f.name for f in drawn_factions]
-
-            logging.info(f"   >>> KISORSOLVA: {', '.join(drawn_names)}")
-
-            session_drafted_ids.update(drawn_ids)
-
-            participant = GameParticipant(
-                game_id=new_game.id,
-                player_id=p_id,
-                drafted_factions_json=json.dumps(drawn_ids),
-                selected_faction_id=None
-            )
-            self.session.add(participant)
-            self.session.flush()
+            # SZŰRÉS 2: Amit FELKÍNÁLTAK NEKI (Utolsó 2 sorsolás)
+            played_mask, recent_drafted_mask = history[p_id]
+
+            # Részletes logolás (csak DEBUG szinten, hogy a nevek összerakása se fusson feleslegesen)
+            if debug:
+                draft_log.debug(f"--- Feldolgozás: [{player_name}] ---")
+                if played_mask:
+                    names = [faction_map.get(i, str(i)) for i in mask_to_ids(played_mask)]
+                    draft_log.debug(f"   Tiltva (Utolsó 2 választása): {', '.join(names)}")
+                if recent_drafted_mask:
+                    names = [faction_map.get(i, str(i)) for i in mask_to_ids(recent_drafted_mask)]
+                    draft_log.debug(f"   Tiltva (Utolsó 2 sorsoláson látta): {', '.join(names)}")
+                draft_log.debug(f"   Ideális választék mérete: {mask_size(all_mask & ~(played_mask | recent_drafted_mask | session_drafted_mask | global_ban_mask))}")
+
+            if assignment:
+                drawn_ids, tier = assignment[index]
+            else:
+                # KALAP ÖSSZEÁLLÍTÁSA (+ VÉSZTERVEK, ha kevés a faj)
+                pool_mask, tier = build_draft_pool(all_mask, played_mask, recent_drafted_mask,
+                                                   session_drafted_mask, global_ban_mask)
+                # HÚZÁS
+                drawn_ids = random.sample(mask_to_ids(pool_mask), 3)
+
+            for relaxed in DRAFT_RELAX_MESSAGES[1:tier + 1]:
+                draft_log.warning(f"[{player_name}] {relaxed.strip()}")
+            if tier >= len(DRAFT_RELAX_MESSAGES):
+                draft_log.critical(f"   !!!!! VÉGZETES HIBA: Nincs elég faj a pakliban! ({player_name})")
+
+            drawn_factions = [faction_by_id[fid] for fid in drawn_ids]
+            if debug:
+                draft_log.debug(f"   >>> KISORSOLVA: {', '.join(f.name for f in drawn_factions)}")
+            audit_players.append({"player_id": p_id, "offered": drawn_ids, "tier": tier})
+
+            session_drafted_mask |= ids_to_mask(drawn_ids)
 
             draft_results.append({
-                "player_name": player.name,
-                "participant_id": participant.id,
+                "player_name": player_name,
+                "player_id": p_id,
+                "drawn_ids": drawn_ids,
                 "options": drawn_factions
             })
 
+        # Mentés játékosszámtól függetlenül két utasítással: a résztvevők egy multi-row
+        # INSERT ... RETURNING-gel, a kínálatok egy executemany-vel. A RETURNING sorrendjére nem
+        # építünk (SQLite-on a sorrend-tartó változat soronként szúrna be): a játékos ID-ja egy
+        # meccsen belül egyedi, azzal párosítunk.
+        game_id = new_game.id
+        participant_ids = dict(self.session.execute(
+            insert(GameParticipant).returning(GameParticipant.player_id, GameParticipant.id),
+            [{"game_id": game_id, "game_date": new_game.date, "player_id": res["player_id"]}
+             for res in draft_results]
+        ).all())
+        self.session.execute(insert(DraftOffer), [
+            {"participant_id": participant_ids[res["player_id"]], "slot": slot, "faction_id": fid}
+            for res in draft_results
+            for slot, fid in enumerate(res["drawn_ids"])
+        ])
+        for res in draft_results:
+            res["participant_id"] = participant_ids[res.pop("player_id")]
+            del res["drawn_ids"]
+
         self.session.commit()
         logging.info("Sorsolás befejezve.")
         logging.info("========================================")
+        audit_log.info("draft_started", extra={"audit": {
+            "game_id": game_id, "engine": engine, "global_ban": mask_to_ids(global_ban_mask),
+            "players": audit_players,
+        }})
 
         draft_results.sort(key=lambda x: x["player_name"])
-        return draft_results
\ No newline at end of file
+        return game_id, draft_results
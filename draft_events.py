@@ -0,0 +1,94 @@
+"""
+Élő draft frissítések: folyamaton belüli üzenetszórás (pub/sub) az SSE kapcsolatoknak.
+
+Minden feliratkozó (egy nyitott /api/draft/events kapcsolat) saját sort kap; a publish()
+mindegyikbe betesz egy másolatot. A lassú / beragadt kliensek sora korlátos, ha megtelik,
+az üzenet nekik elvész (a kliens ilyenkor úgyis újratölti az állapotot a JSON API-ból).
+
+Több worker folyamat esetén a worker csak a SAJÁT kéréseiből értesül azonnal; a long-poll
+végpont és az SSE stream (ha kap egy watch objektumot) ezért időnként az adatbázis
+verziószámát is újraellenőrzi, így a más workeren mentett változás is eljut a klienshez.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class DraftEventBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._changed = threading.Condition()
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event_type, data):
+        message = (event_type, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                logging.warning("SSE: Egy kliens sora megtelt, az esemény neki kimarad.")
+        # A long-poll kérések felébresztése
+        with self._changed:
+            self._changed.notify_all()
+
+    def wait_for_change(self, timeout):
+        """Vár, amíg valaki publish()-ol, vagy lejár az idő."""
+        with self._changed:
+            self._changed.wait(timeout)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+def format_sse(event_type, data):
+    return f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def sse_stream(broker, heartbeat_seconds=15, watch=None, watch_seconds=2.0):
+    """
+    Generátor egy SSE kapcsolathoz: eseményeket és időnként keep-alive kommentet küld.
+    watch: opcionális objektum seen(event_type, data) és check() -> [(event_type, data), ...]
+    metódusokkal; a check() watch_seconds-onként fut (más folyamat változásainak felderítése).
+    """
+    q = broker.subscribe()
+    try:
+        # A böngésző ennyi idő után próbál újracsatlakozni, ha megszakad a kapcsolat
+        yield "retry: 3000\n\n"
+        last_sent = time.monotonic()
+        while True:
+            wait = heartbeat_seconds if watch is None else min(heartbeat_seconds, watch_seconds)
+            try:
+                event_type, data = q.get(timeout=wait)
+                events = [(event_type, data)]
+            except queue.Empty:
+                events = watch.check() if watch is not None else []
+            for event_type, data in events:
+                if watch is not None:
+                    watch.seen(event_type, data)
+                last_sent = time.monotonic()
+                yield format_sse(event_type, data)
+            if time.monotonic() - last_sent >= heartbeat_seconds:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+    finally:
+        broker.unsubscribe(q)
+
+
+draft_events = DraftEventBroker()
@@ -0,0 +1,166 @@
+"""
+A draft szabályai adatbázis nélkül: faj bitmaszkok és a tiltások / vésztervek létrája.
+A db_manager (éles sorsolás) és a simulate_draft.py (offline szimuláció) is ezt használja,
+így a kettő garantáltan ugyanazokkal a szabályokkal dolgozik.
+"""
+import os
+
+# --- FAJ BITMASZKOK (a draft motorhoz) ---
+# Egy fajhalmaz egyetlen egész szám: a faj ID-jához tartozó bit be van állítva.
+# Így a tiltólisták összevonása / kivonása egy-egy bitművelet.
+
+def ids_to_mask(faction_ids):
+    mask = 0
+    for fid in faction_ids:
+        mask |= 1 << fid
+    return mask
+
+def mask_to_ids(mask):
+    ids = []
+    while mask:
+        low_bit = mask & -mask
+        ids.append(low_bit.bit_length() - 1)
+        mask ^= low_bit
+    return ids
+
+def mask_size(mask):
+    return bin(mask).count("1")
+
+# VÉSZTERVEK (Lazított sorrend) - a lépcsőfok sorszáma szerint
+DRAFT_RELAX_MESSAGES = [
+    None,
+    "   ! Kevés a faj -> 'Utolsó 2 sorsolásban felkínált' szabály feloldása.",
+    "   !! Még mindig kevés -> 'Előző history játék fajai' tiltás feloldása.",
+    "   !!! Még mindig kevés -> 'Utolsó 2 meccsen választott' szabály feloldása.",
+]
+
+def build_draft_pool(all_mask, played_mask, offered_mask, session_mask, global_ban_mask, needed=3):
+    """
+    Egy játékos "kalapja" bitmaszkként, a vésztervekkel együtt.
+    Visszatérés: (pool_mask, tier) - tier: 0 = ideális, 1-3 = ennyiedik vészterv, 4 = minden faj.
+    """
+    tiers = [
+        played_mask | offered_mask | session_mask | global_ban_mask,  # Ideális: minden tiltás él
+        played_mask | session_mask | global_ban_mask,                 # 1. VÉSZTERV: a "kínálatban volt" elengedve
+        played_mask | session_mask,                                   # 2. VÉSZTERV: az előző meccs (Global Ban) elengedve
+        session_mask,                                                 # 3. VÉSZTERV: csak a mostani egyediség számít
+    ]
+    for tier, excluded in enumerate(tiers):
+        pool_mask = all_mask & ~excluded
+        if mask_size(pool_mask) >= needed:
+            return pool_mask, tier
+
+    # VÉGSŐ KÉTSÉGBEESÉS: nincs elég faj a pakliban -> ismétlődés is belefér
+    return all_mask, len(tiers)
+
+
+# --- OPTIMALIZÁLÓ DRAFT MOTOR (az egész asztal egyszerre) ---
+# A mohó motor (build_draft_pool játékosonként, véletlen sorrendben) a sor végén ülőknél
+# hamarabb nyúl a vésztervekhez, akkor is, ha egy másik elosztással mindenki ideális
+# kínálatot kaphatott volna. Itt a teljes asztal egy hozzárendelési feladat:
+#   forrás -> játékos (kapacitás: 3) -> faj (kapacitás: 1, költség: a szükséges vészterv) -> nyelő
+# és a minimális költségű folyam adja a kínálatokat.
+
+DRAFT_ENGINE_SOLVER = 'solver'
+DRAFT_ENGINE_GREEDY = 'greedy'
+DRAFT_ENGINES = (DRAFT_ENGINE_SOLVER, DRAFT_ENGINE_GREEDY)
+
+# Alapértelmezett motor (az app és a szimulátor is ezt használja): TI_DRAFT_ENGINE, alapból 'solver'.
+# Elgépelt értékkel már induláskor leállunk, különben csendben mindig a 'greedy' ágra futna.
+DEFAULT_DRAFT_ENGINE = os.environ.get('TI_DRAFT_ENGINE', DRAFT_ENGINE_SOLVER)
+if DEFAULT_DRAFT_ENGINE not in DRAFT_ENGINES:
+    raise ValueError(f"Ismeretlen TI_DRAFT_ENGINE: {DEFAULT_DRAFT_ENGINE!r} "
+                     f"(lehetséges: {', '.join(DRAFT_ENGINES)})")
+
+_NOISE = 1000  # véletlen "zaj" az azonos szintű fajok között, hogy a kínálat ne legyen determinisztikus
+
+def faction_tier(faction_bit, played_mask, offered_mask, global_ban_mask):
+    """Hányadik vészterv kell ahhoz, hogy ez a faj felkerülhessen a játékos kínálatába (0-3)."""
+    if faction_bit & played_mask:
+        return 3
+    if faction_bit & global_ban_mask:
+        return 2
+    if faction_bit & offered_mask:
+        return 1
+    return 0
+
+def solve_draft_assignment(all_mask, histories, global_ban_mask, rng, needed=3):
+    """
+    Az asztal összes kínálata egyszerre, a lehető legkevesebb szabály-lazítással.
+    histories: [(played_mask, offered_mask), ...] játékosonként.
+    A költség lexikografikus: egy 3. szintű lazítás rosszabb bármennyi 2. szintűnél, és így tovább.
+    Azonos számú lazításnál az a jobb, ahol kevesebb játékost érintenek: a lazított éleket a lista
+    elején álló játékosokra tereljük (a hívó véletlen sorrendben adja őket), a maradék döntetlent
+    a véletlen zaj dönti el.
+    Visszatérés: [(faction_ids, tier), ...] a játékosok sorrendjében (tier: a játékosnál szükséges
+    legmagasabb vészterv), vagy None, ha nincs elég faj (ilyenkor a mohó motor a tartalék).
+    """
+    factions = mask_to_ids(all_mask)
+    n_players = len(histories)
+    slots = n_players * needed
+    if len(factions) < slots:
+        return None
+
+    # Súlyok: zaj < játékos-sorrend büntetés < egy szinttel magasabb lazítás (mindegyik nagyobb,
+    # mint az alatta lévő összes tétel összege a teljes kiosztásban)
+    rank_unit = _NOISE * (slots + 1)
+    scale = rank_unit * n_players * (slots + 1)
+    weights = [0, scale, scale * (slots + 1), scale * (slots + 1) ** 2]
+
+    # Csúcsok: 0 = forrás, 1..P = játékosok, P+1..P+F = fajok, utolsó = nyelő
+    source, sink = 0, n_players + len(factions) + 1
+    graph = [[] for _ in range(sink + 1)]   # él: [cél, kapacitás, költség, visszaél indexe]
+
+    def add_edge(u, v, cap, cost):
+        graph[u].append([v, cap, cost, len(graph[v])])
+        graph[v].append([u, 0, -cost, len(graph[u]) - 1])
+
+    for p, (played_mask, offered_mask) in enumerate(histories, start=1):
+        add_edge(source, p, needed, 0)
+        for j, fid in enumerate(factions):
+            tier = faction_tier(1 << fid, played_mask, offered_mask, global_ban_mask)
+            rank_cost = (p - 1) * rank_unit if tier else 0
+            add_edge(p, n_players + 1 + j, 1, weights[tier] + rank_cost + rng.randrange(_NOISE))
+    for j in range(len(factions)):
+        add_edge(n_players + 1 + j, sink, 1, 0)
+
+    # Egymást követő legrövidebb utak (SPFA), egységnyi növelésekkel
+    for _ in range(slots):
+        dist = [None] * (sink + 1)
+        parent = [None] * (sink + 1)
+        dist[source] = 0
+        queue = [source]
+        in_queue = [False] * (sink + 1)
+        in_queue[source] = True
+        head = 0
+        while head < len(queue):
+            u = queue[head]
+            head += 1
+            in_queue[u] = False
+            du = dist[u]
+            for idx, (v, cap, cost, _) in enumerate(graph[u]):
+                if cap and (dist[v] is None or du + cost < dist[v]):
+                    dist[v] = du + cost
+                    parent[v] = (u, idx)
+                    if not in_queue[v]:
+                        in_queue[v] = True
+                        queue.append(v)
+        if dist[sink] is None:
+            return None
+        v = sink
+        while v != source:
+            u, idx = parent[v]
+            edge = graph[u][idx]
+            edge[1] -= 1
+            graph[v][edge[3]][1] += 1
+            v = u
+
+    result = []
+    for p, (played_mask, offered_mask) in enumerate(histories, start=1):
+        # A telített játékos -> faj élek adják a kínálatot
+        chosen = [factions[v - n_players - 1] for v, cap, cost, _ in graph[p]
+                  if v != source and cap == 0 and cost >= 0]
+        rng.shuffle(chosen)
+        tier = max(faction_tier(1 << fid, played_mask, offered_mask, global_ban_mask) for fid in chosen)
+        result.append((chosen, tier))
+    return result
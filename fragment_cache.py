@@ -0,0 +1,80 @@
+"""
+Renderelt HTML darabok (pl. a history meccs kártyái) gyorsítótára a memóriában.
+
+Kulcs: (game_id, version). Mivel a játék verziója minden módosításkor nő, egy megváltozott
+játékhoz automatikusan új kulcs tartozik; a régi bejegyzést az írási útvonalak (győztes
+állítása, törlés) azonnal ki is dobják, hogy ne foglalja a helyet. A version tetszőleges
+hashelhető érték: az app a játék létrehozási idejét is beleteszi, mert egy törölt játék ID-ját
+az SQLite újra kioszthatja, a törlés pedig csak a saját folyamat gyorsítótárát üríti. Méretkorlát: darabszám
+és összes karakter, a legrégebben használt (LRU) elem megy ki először.
+"""
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 2000
+DEFAULT_MAX_CHARS = 8 * 1024 * 1024
+
+
+class FragmentCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_chars=DEFAULT_MAX_CHARS):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # (game_id, version) -> html
+        self._keys_by_game = {}         # game_id -> set of keys (célzott invalidáláshoz)
+        self._chars = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, game_id, version):
+        key = (game_id, version)
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def set(self, game_id, version, html):
+        key = (game_id, version)
+        if len(html) > self.max_chars:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = html
+            self._keys_by_game.setdefault(game_id, set()).add(key)
+            self._chars += len(html)
+            while len(self._entries) > self.max_entries or self._chars > self.max_chars:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def invalidate_game(self, game_id):
+        """Egy játék összes verziójának eldobása (írás után hívandó)."""
+        with self._lock:
+            for key in list(self._keys_by_game.get(game_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_game.clear()
+            self._chars = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "chars": self._chars, "hits": self.hits, "misses": self.misses}
+
+    def _remove(self, key):
+        html = self._entries.pop(key)
+        self._chars -= len(html)
+        game_keys = self._keys_by_game.get(key[0])
+        if game_keys is not None:
+            game_keys.discard(key)
+            if not game_keys:
+                del self._keys_by_game[key[0]]
+
+
+history_card_cache = FragmentCache()
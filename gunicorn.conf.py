@@ -0,0 +1,33 @@
+"""
+Gunicorn beállítások több worker folyamathoz:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Az egyszeri indítási munka (táblák, fajok, migrációk) a master folyamatban fut, MIELŐTT a
+workerek elindulnak; a workerek ezt kihagyják (TI_INIT_DB=0), és a fork után saját
+adatbázis kapcsolatokat nyitnak (lásd db_manager.py).
+
+A workerek ugyanazokba a naplófájlokba írnak: a saját kezelőjük nem forgat (TI_LOG_SHARED=1),
+a forgatást a karbantartás végzi, egyetlen folyamatból (lásd logging_setup.py, maintenance.py).
+"""
+import os
+
+# A workerek öröklik (a master a konfiguráció betöltésekor állítja be)
+os.environ.setdefault('TI_LOG_SHARED', '1')
+
+bind = os.environ.get('TI_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('TI_WORKERS', 4))
+# Az SSE és a long-poll kérések sokáig nyitva tartanak egy szálat, ezért workerenként több szál kell
+threads = int(os.environ.get('TI_THREADS', 8))
+worker_class = 'gthread'
+timeout = 60
+# Az app a workerekben jön létre (nem a masterben), így minden worker saját motort és log szálat kap
+preload_app = False
+
+
+def on_starting(server):
+    from db_manager import TIManager, dispose_engine
+    TIManager().prepare_database()
+    # A master kapcsolatai ne öröklődjenek a workerekre
+    dispose_engine()
+    os.environ['TI_INIT_DB'] = '0'
@@ -0,0 +1,148 @@
+"""
+Meccs history tömeges importja / exportja CSV és JSONL formátumban, soronként feldolgozva
+(a fájl sosem kerül egészében a memóriába).
+
+CSV: egy sor = egy résztvevő; az egymást követő, azonos 'game' kulcsú sorok alkotnak egy meccset.
+    game,date,player,faction,winner
+    1,2023-05-12,Dani,The Arborec,1
+    1,2023-05-12,Peti,The Winnu,
+    ...
+    (winner: 1 / x / igen / true annál a játékosnál, aki nyert; üres, ha nincs győztes)
+
+JSONL: egy sor = egy meccs:
+    {"date": "2023-05-12", "winner": "Dani", "participants": [{"player": "Dani", "faction": "The Arborec"}, ...]}
+
+A nevek feloldása és az ellenőrzés a TIManager.import_games()-ben történik.
+"""
+import csv
+import io
+import json
+from collections import namedtuple
+from datetime import datetime
+
+CSV_FIELDS = ['game', 'date', 'player', 'faction', 'winner']
+FORMATS = ('csv', 'jsonl')
+TRUE_VALUES = {'1', 'x', 'igen', 'true', 'yes', 'i', 'y'}
+
+# Egy beolvasott meccs (még nevekkel). error != None: a sor hibás, a többi mező nem megbízható.
+ImportRecord = namedtuple('ImportRecord', 'line date participants winner error')
+
+
+def detect_format(filename, explicit=None):
+    if explicit:
+        return explicit.lower()
+    return 'jsonl' if filename and filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def parse_date(raw):
+    raw = (raw or '').strip()
+    if not raw:
+        raise ValueError("hiányzó dátum")
+    try:
+        return datetime.strptime(raw, '%Y-%m-%d')
+    except ValueError:
+        date = datetime.fromisoformat(raw)
+    # A DB-ben helyi idő van, időzóna nélkül; az időzónás érték nem hasonlítható hozzá
+    if date.tzinfo is not None:
+        raise ValueError(f"időzónás dátum nem támogatott: {raw}")
+    return date
+
+
+def iter_records(stream, fmt):
+    """Szöveges stream -> ImportRecord generátor."""
+    if fmt == 'csv':
+        return _iter_csv(stream)
+    if fmt == 'jsonl':
+        return _iter_jsonl(stream)
+    raise ValueError(f"Ismeretlen formátum: {fmt}")
+
+
+def _iter_csv(stream):
+    reader = csv.DictReader(stream)
+    missing = {'date', 'player', 'faction'} - set(reader.fieldnames or ())
+    if missing:
+        yield ImportRecord(1, None, [], None, f"hiányzó oszlop(ok): {', '.join(sorted(missing))}")
+        return
+
+    group_key = object()
+    group = None
+    for row in reader:
+        line = reader.line_num
+        key = (row.get('game') or '').strip() or (row.get('date') or '').strip()
+        if group is not None and key != group_key:
+            yield _finish_csv_group(group)
+            group = None
+        if group is None:
+            group_key = key
+            group = {"line": line, "date": row.get('date'), "participants": [], "winners": []}
+        player = (row.get('player') or '').strip()
+        group["participants"].append((player, (row.get('faction') or '').strip()))
+        if (row.get('winner') or '').strip().lower() in TRUE_VALUES:
+            group["winners"].append(player)
+    if group is not None:
+        yield _finish_csv_group(group)
+
+
+def _finish_csv_group(group):
+    try:
+        date = parse_date(group["date"])
+    except ValueError as e:
+        return ImportRecord(group["line"], None, group["participants"], None, f"hibás dátum: {e}")
+    if len(group["winners"]) > 1:
+        return ImportRecord(group["line"], date, group["participants"], None, "egynél több győztes")
+    winner = group["winners"][0] if group["winners"] else None
+    return ImportRecord(group["line"], date, group["participants"], winner, None)
+
+
+def _iter_jsonl(stream):
+    for line_no, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            obj = json.loads(line)
+            date = parse_date(obj.get('date'))
+            participants = [((p.get('player') or '').strip(), (p.get('faction') or '').strip())
+                            for p in obj.get('participants') or ()]
+            winner = (obj.get('winner') or '').strip() or None
+        except (ValueError, TypeError, AttributeError) as e:
+            yield ImportRecord(line_no, None, [], None, f"hibás sor: {e}")
+            continue
+        yield ImportRecord(line_no, date, participants, winner, None)
+
+
+# --- EXPORT ---
+
+def export_lines(game_pages, fmt, faction_name):
+    """
+    Lezárt játékok oldalanként (TIManager.iter_finished_games) -> szöveg darabok generátora.
+    faction_name: faj ID -> név (a katalógusból).
+    """
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CSV_FIELDS)
+        for games in game_pages:
+            for game in games:
+                date = game.date.strftime('%Y-%m-%d %H:%M:%S')
+                for p in game.participants:
+                    writer.writerow([game.id, date, p.player.name, faction_name(p.selected_faction_id) or '',
+                                     1 if game.winner_id == p.player_id else ''])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    elif fmt == 'jsonl':
+        for games in game_pages:
+            chunk = []
+            for game in games:
+                winner = next((p.player.name for p in game.participants if p.player_id == game.winner_id), None)
+                chunk.append(json.dumps({
+                    "date": game.date.isoformat(sep=' '),
+                    "winner": winner,
+                    "participants": [{"player": p.player.name, "faction": faction_name(p.selected_faction_id)}
+                                     for p in game.participants],
+                }, ensure_ascii=False))
+            if chunk:
+                yield '\n'.join(chunk) + '\n'
+    else:
+        raise ValueError(f"Ismeretlen formátum: {fmt}")
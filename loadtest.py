@@ -0,0 +1,371 @@
+"""
+Terheléses és konzisztencia teszt: sok párhuzamos kliens a draft választásra, győztes állításra
+és a draft oldalra, utána az adatbázis végállapotának ellenőrzése.
+
+Az app a folyamaton belül, egy többszálú (werkzeug) szerveren indul egy eldobható SQLite fájllal;
+a kliensek valódi HTTP kéréseket küldenek, mindegyik szál a saját kapcsolatán. Mért értékek:
+áteresztőképesség, p50 / p95 / p99 késleltetés műveletenként, HTTP hibák és SQLite zárolási
+hibák ("database is locked" / busy).
+
+Ellenőrzések a futás végén:
+  - választás: minden résztvevőnek az utolsó NYUGTÁZOTT választása van elmentve (egy résztvevőt
+    mindig ugyanaz a kliens szál kattint, így a sorrend egyértelmű) -> elveszett / összekevert írás
+  - verziószám: játékonként pontosan annyival nőtt, ahány nyugtázott írás érte -> elveszett növelés
+    (a jelzett ütközés - a szerver nem írt, mert közben más módosított - nem hiba, külön számoljuk)
+  - győztes: résztvevő vagy üres; a statisztika és az értékszámok egyeznek a teljes újraszámolással
+
+Használat:
+    python loadtest.py --threads 16 --duration 10
+    python loadtest.py --threads 32 --drafts 8 --mix select=8,winner=1,view=1 --output load.json
+Ha valamelyik ellenőrzés elbukik, az exit code 1.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from benchmark import percentile
+
+OPERATIONS = ('select', 'winner', 'view')
+
+
+def parse_mix(raw):
+    weights = {}
+    for part in raw.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"ismeretlen művelet: {name!r} (lehet: {', '.join(OPERATIONS)})")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="TI4 Draft Manager terheléses / konzisztencia teszt")
+    parser.add_argument('--threads', type=int, default=16, help="párhuzamos kliens szálak száma")
+    parser.add_argument('--duration', type=float, default=10.0, help="a terhelés hossza másodpercben")
+    parser.add_argument('--drafts', type=int, default=4, help="egyszerre futó draftok száma")
+    parser.add_argument('--draft-size', type=int, default=6, help="hány fős egy draft")
+    parser.add_argument('--winner-games', type=int, default=4,
+                        help="lezárt meccsek, amelyeken a kliensek a győztest állítgatják (közösen)")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('select=6,winner=2,view=2'),
+                        help="műveletek súlya, pl. select=6,winner=2,view=2")
+    parser.add_argument('--seed', type=int, default=42, help="véletlen mag")
+    parser.add_argument('--output', help="eredmény JSON fájl")
+    return parser.parse_args()
+
+
+# --- SZERVER (a folyamaton belül) ---
+
+def start_server(flask_app):
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, name="loadtest-server", daemon=True)
+    thread.start()
+    return server
+
+
+class LockErrorCounter:
+    """Az SQLite "database is locked" / "busy" hibák számlálása a motor hibaeseményéből."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self._lock = threading.Lock()
+        self.count = 0
+        event.listen(engine, "handle_error", self._on_error)
+
+    def _on_error(self, context):
+        message = str(context.original_exception).lower()
+        if 'locked' in message or 'busy' in message:
+            with self._lock:
+                self.count += 1
+
+
+# --- KLIENSEK ---
+
+class ClientResult:
+    """Egy kliens szál mérései és a nyugtázott írásai."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)   # művelet -> [ms, ...]
+        self.failures = Counter()            # művelet -> nem várt válaszok száma
+        self.conflicts = Counter()           # művelet -> jelzett ütközések (optimista zárolás, nem hiba)
+        self.last_selection = {}             # participant_id -> faction_id (utolsó nyugtázott)
+        self.writes = Counter()              # game_id -> nyugtázott írások száma
+
+
+def run_client(port, plan, stop_at, seed, result):
+    """
+    Egy kliens szál: a keverési súlyok szerint választ műveletet, amíg le nem jár az idő.
+    plan: {"participants": [(participant_id, game_id, [faction_id, ...]), ...] (csak EZÉ a szálé),
+           "winner_games": [(game_id, [player_id, ...]), ...], "drafts": [game_id, ...], "mix": {...}}
+    """
+    rng = random.Random(seed)
+    operations = [op for op in OPERATIONS if plan["mix"].get(op) and (op != 'select' or plan["participants"])]
+    weights = [plan["mix"][op] for op in operations]
+
+    while time.monotonic() < stop_at:
+        op = rng.choices(operations, weights)[0]
+        if op == 'select':
+            participant_id, game_id, offered = rng.choice(plan["participants"])
+            faction_id = rng.choice(offered)
+            path = f"/select_faction/{participant_id}/{faction_id}"
+        elif op == 'winner':
+            game_id, player_ids = rng.choice(plan["winner_games"])
+            path = f"/set_winner/{game_id}/{rng.choice(player_ids)}"
+        else:
+            game_id = rng.choice(plan["drafts"])
+            path = f"/draft/{game_id}"
+
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        started = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            status, location = response.status, response.getheader('Location') or ''
+        except OSError:
+            status, location = None, ''
+        finally:
+            conn.close()
+        result.latencies[op].append((time.perf_counter() - started) * 1000)
+
+        # Csak a sikeresen nyugtázott írásokat tartjuk számon
+        if op == 'select':
+            if status == 302 and location.endswith(f"/draft/{game_id}"):
+                result.last_selection[participant_id] = faction_id
+                result.writes[game_id] += 1
+            else:
+                result.failures[op] += 1
+        elif op == 'winner':
+            # Ütközésnél (közben más módosította a meccset) az érintett kártyára irányít: #game-<id>
+            if status == 302 and '#' in location:
+                result.conflicts[op] += 1
+            elif status == 302:
+                result.writes[game_id] += 1
+            else:
+                result.failures[op] += 1
+        elif status != 200:
+            result.failures[op] += 1
+
+
+# --- ELLENŐRZÉS ---
+
+def check_consistency(db, plan_participants, last_selection, writes, initial_versions, winner_games):
+    """A végállapot ellenőrzése. Visszatérés: hibaüzenetek listája (üres = minden rendben)."""
+    from sqlalchemy import text
+    from db_manager import GameParticipant, Game
+
+    problems = []
+
+    # 1. Választások: az utolsó nyugtázott érték van-e elmentve, és csak felkínált faj lehet
+    selected = dict(db.session.query(GameParticipant.id, GameParticipant.selected_faction_id)
+                    .filter(GameParticipant.id.in_([p_id for p_id, _, _ in plan_participants])))
+    for participant_id, _, offered in plan_participants:
+        actual = selected.get(participant_id)
+        if actual is not None and actual not in offered:
+            problems.append(f"résztvevő {participant_id}: nem felkínált faj mentve ({actual})")
+        expected = last_selection.get(participant_id)
+        if expected is not None and actual != expected:
+            problems.append(f"résztvevő {participant_id}: elveszett választás (várt {expected}, mentve {actual})")
+
+    # 2. Verziószámok: minden nyugtázott írás pontosan egyet növel
+    versions = dict(db.session.query(Game.id, Game.version).filter(Game.id.in_(list(initial_versions))))
+    for game_id, initial in initial_versions.items():
+        delta = versions.get(game_id, initial) - initial
+        if delta != writes.get(game_id, 0):
+            problems.append(f"játék {game_id}: a verzió {delta}-vel nőtt, de {writes.get(game_id, 0)} írás volt "
+                            f"(elveszett növelés)")
+
+    # 3. Győztesek: csak résztvevő lehet
+    winners = dict(db.session.query(Game.id, Game.winner_id).filter(Game.id.in_([g for g, _ in winner_games])))
+    for game_id, player_ids in winner_games:
+        if winners.get(game_id) not in (None, *player_ids):
+            problems.append(f"játék {game_id}: a győztes ({winners.get(game_id)}) nem résztvevő")
+
+    # 4. Előre összesített táblák: egyeznek-e a teljes újraszámolással
+    for table, key, stored, expected in db.check_stats():
+        problems.append(f"{table} {key}: tárolt {stored}, újraszámolva {expected}")
+    db.close_session()
+
+    def ratings():
+        rows = [(p_id, round(rating, 6), n) for p_id, rating, n in db.session.execute(
+            text("SELECT player_id, rating, games_rated FROM player_ratings WHERE games_rated > 0 ORDER BY 1")).all()]
+        db.close_session()
+        return rows
+
+    incremental = ratings()
+    db.rebuild_ratings()
+    if incremental != ratings():
+        problems.append("player_ratings: eltér a teljes újraszámolástól")
+    return problems
+
+
+# --- FŐPROGRAM ---
+
+def main():
+    args = parse_args()
+
+    # A DB és a log útvonalát az importok ELŐTT kell beállítani
+    work_dir = tempfile.mkdtemp(prefix="ti_load_")
+    os.environ['TI_DB_PATH'] = os.path.join(work_dir, "load.db")
+    os.environ['TI_LOG_PATH'] = os.path.join(work_dir, "load.log")
+    os.environ['TI_AUDIT_LOG_PATH'] = os.path.join(work_dir, "load_audit.log")
+
+    import app as ti_app
+    from db_manager import get_engine, get_faction_catalog, GameParticipant, DraftOffer, Game
+
+    flask_app = ti_app.create_app()
+    db = ti_app.db
+    # A terhelés alatt a részletes (INFO) logolás csak zaj lenne (a werkzeug kérésenként írna)
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    lock_errors = LockErrorCounter(get_engine())
+    rng = random.Random(args.seed)
+
+    # 1. Előkészítés: játékosok, futó draftok, lezárt meccsek a győztes-állításhoz
+    n_players = max(args.drafts * args.draft_size, 8)
+    for i in range(1, n_players + 1):
+        db.add_player(f"Load Player {i}")
+    player_ids = [p.id for p in db.get_all_players()]
+    faction_ids = [f.id for f in get_faction_catalog().all]
+    db.close_session()
+
+    drafts = []
+    for d in range(args.drafts):
+        game_id, _ = db.start_new_game_draft(player_ids[d * args.draft_size:(d + 1) * args.draft_size])
+        db.close_session()
+        drafts.append(game_id)
+
+    for _ in range(args.winner_games):
+        seated = rng.sample(player_ids, rng.randint(3, 6))
+        db.create_manual_game(datetime.now() - timedelta(days=rng.randint(1, 365)),
+                              list(zip(seated, rng.sample(faction_ids, len(seated)))))
+        db.close_session()
+    winner_games = [
+        (game_id, [p_id for (p_id,) in db.session.query(GameParticipant.player_id).filter_by(game_id=game_id)])
+        for (game_id,) in db.session.query(Game.id).filter(Game.is_active == False).order_by(Game.id)
+    ]
+
+    offers = defaultdict(list)
+    for participant_id, faction_id in db.session.query(DraftOffer.participant_id, DraftOffer.faction_id)\
+            .join(GameParticipant, GameParticipant.id == DraftOffer.participant_id)\
+            .filter(GameParticipant.game_id.in_(drafts)):
+        offers[participant_id].append(faction_id)
+    participants = [
+        (participant_id, game_id, offers[participant_id])
+        for participant_id, game_id in db.session.query(GameParticipant.id, GameParticipant.game_id)
+            .filter(GameParticipant.game_id.in_(drafts)).order_by(GameParticipant.id)
+    ]
+    initial_versions = dict(db.session.query(Game.id, Game.version))
+    db.close_session()
+
+    # 2. Terhelés: minden résztvevőt pontosan egy szál kattint (így ellenőrizhető az utolsó írás)
+    server = start_server(flask_app)
+    port = server.server_port
+    print(f"Terhelés: {args.threads} szál, {args.duration:.0f} s, {len(drafts)} draft "
+          f"({len(participants)} résztvevő), {len(winner_games)} lezárt meccs -> 127.0.0.1:{port}")
+
+    results = [ClientResult() for _ in range(args.threads)]
+    stop_at = time.monotonic() + args.duration
+    threads = []
+    for i, result in enumerate(results):
+        plan = {
+            "participants": participants[i::args.threads],
+            "winner_games": winner_games,
+            "drafts": drafts,
+            "mix": args.mix,
+        }
+        thread = threading.Thread(target=run_client, args=(port, plan, stop_at, args.seed + i, result),
+                                  name=f"loadtest-client-{i}")
+        threads.append(thread)
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    # 3. Összesítés
+    latencies = defaultdict(list)
+    failures, conflicts, writes, last_selection = Counter(), Counter(), Counter(), {}
+    for result in results:
+        for op, values in result.latencies.items():
+            latencies[op].extend(values)
+        failures.update(result.failures)
+        conflicts.update(result.conflicts)
+        writes.update(result.writes)
+        last_selection.update(result.last_selection)
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"\nÖsszesen {total} kérés {elapsed:.1f} s alatt ({total / elapsed:.0f} kérés/s), "
+          f"SQLite zárolási hiba: {lock_errors.count}")
+    report_ops = {}
+    for op in OPERATIONS:
+        values = sorted(latencies.get(op, ()))
+        if not values:
+            continue
+        report_ops[op] = {
+            "requests": len(values),
+            "failures": failures[op],
+            "conflicts": conflicts[op],
+            "per_second": round(len(values) / elapsed, 1),
+            "p50_ms": round(percentile(values, 50), 3),
+            "p95_ms": round(percentile(values, 95), 3),
+            "p99_ms": round(percentile(values, 99), 3),
+            "max_ms": round(values[-1], 3),
+        }
+        r = report_ops[op]
+        print(f"  {op:<8} {r['requests']:>7} kérés  {r['per_second']:>7.1f}/s   p50 {r['p50_ms']:>8.2f} ms   "
+              f"p95 {r['p95_ms']:>8.2f} ms   p99 {r['p99_ms']:>8.2f} ms   hibás: {r['failures']}   "
+              f"ütközés: {r['conflicts']}")
+
+    # 4. Konzisztencia
+    problems = check_consistency(db, participants, last_selection, writes, initial_versions, winner_games)
+    print("\nKonzisztencia:", "rendben" if not problems else f"{len(problems)} HIBA")
+    for problem in problems[:50]:
+        print(f"  - {problem}")
+    if len(problems) > 50:
+        print(f"  ... és még {len(problems) - 50}")
+
+    if args.output:
+        report = {
+            "meta": {
+                "threads": args.threads,
+                "duration_s": args.duration,
+                "drafts": args.drafts,
+                "draft_size": args.draft_size,
+                "winner_games": args.winner_games,
+                "mix": args.mix,
+                "seed": args.seed,
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "timestamp": datetime.now().isoformat(timespec='seconds'),
+            },
+            "requests": total,
+            "requests_per_second": round(total / elapsed, 1),
+            "sqlite_lock_errors": lock_errors.count,
+            "operations": report_ops,
+            "problems": problems,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nEredmény mentve: {args.output}")
+
+    if problems or sum(failures.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
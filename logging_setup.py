@@ -0,0 +1,239 @@
+"""
+Logolás beállítása: a kérések szálai csak egy memóriabeli sorba tesznek, a lemezre írást
+egy háttérszál (QueueListener) végzi, így egy lassú lemez nem lassítja a kéréseket.
+
+- ti_manager.log: a szokásos szöveges napló, méret szerint ÉS naponta forgatva
+- ti_audit.log: draft események (sorsolás, választás, lezárás) soronként egy JSON objektum
+- a "ti.db" logger (lekérdezésenkénti, beszédes DB üzenetek) szintje külön állítható
+
+Környezeti változók:
+    TI_LOG_LEVEL       általános szint (alap: INFO)
+    TI_DB_LOG_LEVEL    a "ti.db" és "ti.draft" logger szintje (alap: INFO; DEBUG = minden részlet)
+    TI_LOG_MAX_BYTES   forgatás mérete (alap: 5 MB)
+    TI_LOG_BACKUPS     megtartott régi fájlok száma (alap: 10)
+    TI_LOG_SHARED      1 = több folyamat írja ugyanazokat a fájlokat (gunicorn workerek, lásd
+                       gunicorn.conf.py): ilyenkor a kezelők nem forgatnak, csak hozzáfűznek, és
+                       újranyitják a fájlt, ha eltűnt alóluk; a forgatást egyetlen folyamat, a
+                       karbantartás végzi (rotate_shared_logs)
+
+A forgatott (.1, .2, ...) fájlokat a karbantartás kor szerint is törli (prune_rotated_logs).
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+AUDIT_LOGGER_NAME = 'ti.audit'
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_BACKUPS = 10
+
+audit_log = logging.getLogger(AUDIT_LOGGER_NAME)
+
+_listener = None
+_last_rotation_day = None
+
+
+class SizeAndTimeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Forgat, ha a fájl elérte a max_bytes méretet, VAGY elmúlt éjfél. Mentések: .1, .2, ..."""
+
+    def __init__(self, filename, max_bytes, backup_count, encoding='utf-8'):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding, delay=True)
+        self.next_rollover_at = self._next_midnight()
+
+    @staticmethod
+    def _next_midnight():
+        tomorrow = datetime.now().date() + timedelta(days=1)
+        return datetime.combine(tomorrow, datetime.min.time()).timestamp()
+
+    def shouldRollover(self, record):
+        if time.time() >= self.next_rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.next_rollover_at = self._next_midnight()
+
+
+class JsonLineFormatter(logging.Formatter):
+    """Egy rekord = egy JSON sor. Az audit adatok az extra={"audit": {...}} mezőből jönnek."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, 'audit', None) or {})
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _LoggerNameFilter(logging.Filter):
+    def __init__(self, name, include):
+        super().__init__()
+        self.logger_name = name
+        self.include = include
+
+    def filter(self, record):
+        return (record.name == self.logger_name) == self.include
+
+
+def _rotation_settings():
+    return (int(os.environ.get('TI_LOG_MAX_BYTES', DEFAULT_MAX_BYTES)),
+            int(os.environ.get('TI_LOG_BACKUPS', DEFAULT_BACKUPS)))
+
+
+def _shared_logs():
+    return os.environ.get('TI_LOG_SHARED') == '1'
+
+
+def _file_handler(path, max_bytes, backups):
+    if _shared_logs():
+        # Több író folyamat: O_APPEND-del soronként írunk, a forgatás nem a mi dolgunk
+        return logging.handlers.WatchedFileHandler(path, encoding='utf-8', delay=True)
+    return SizeAndTimeRotatingFileHandler(path, max_bytes, backups)
+
+
+def _level(env_name, default):
+    return getattr(logging, os.environ.get(env_name, default).upper(), logging.INFO)
+
+
+def setup_logging(log_path, audit_path):
+    """A root logger átállítása a háttérszálas (queue) kezelőkre. Többszöri hívás esetén nem duplikál."""
+    global _listener
+    if _listener is not None:
+        return
+
+    max_bytes, backups = _rotation_settings()
+
+    # A tényleges (lassú) kezelők: ezeket csak a háttérszál hívja
+    text_format = logging.Formatter('%(asctime)s | %(message)s')
+
+    file_handler = _file_handler(log_path, max_bytes, backups)
+    file_handler.setFormatter(text_format)
+    file_handler.addFilter(_LoggerNameFilter(AUDIT_LOGGER_NAME, include=False))
+
+    # A konzolra írást (sys.stderr) meghagyjuk a hibakereséshez:
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(text_format)
+    stream_handler.addFilter(_LoggerNameFilter(AUDIT_LOGGER_NAME, include=False))
+
+    audit_handler = _file_handler(audit_path, max_bytes, backups)
+    audit_handler.setFormatter(JsonLineFormatter())
+    audit_handler.addFilter(_LoggerNameFilter(AUDIT_LOGGER_NAME, include=True))
+
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(
+        log_queue, file_handler, stream_handler, audit_handler, respect_handler_level=True
+    )
+
+    # Először törlünk minden korábbi log beállítást (hogy ne akadjon össze a rendszerrel)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(_level('TI_LOG_LEVEL', 'INFO'))
+
+    db_level = _level('TI_DB_LOG_LEVEL', 'INFO')
+    logging.getLogger('ti.db').setLevel(db_level)
+    logging.getLogger('ti.draft').setLevel(db_level)
+    audit_log.setLevel(logging.INFO)
+
+    _listener.start()
+    # Leállításkor a sorban maradt üzenetek is kiíródnak
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def rotate_shared_logs():
+    """
+    TI_LOG_SHARED mellett a forgatás: ha egy napló elérte a max méretet, vagy az előző forgatás óta
+    elmúlt éjfél, .1, .2, ... mentésekre tolja (mint a RotatingFileHandler). A többi folyamat
+    WatchedFileHandler-e a következő sornál észreveszi, és új fájlt nyit. Egyszerre csak egy
+    folyamat hívhatja (a karbantartás fájlzára alatt fut).
+    Visszatérés: a forgatott fájlok száma, vagy None, ha a naplók nem megosztottak.
+    """
+    global _last_rotation_day
+    if _listener is None or not _shared_logs():
+        return None
+    max_bytes, backups = _rotation_settings()
+    today = date.today()
+    new_day = _last_rotation_day is not None and today != _last_rotation_day
+    _last_rotation_day = today
+
+    rotated = 0
+    for handler in _listener.handlers:
+        if not isinstance(handler, logging.handlers.WatchedFileHandler):
+            continue
+        path = handler.baseFilename
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            continue
+        if size == 0 or backups < 1 or (size < max_bytes and not new_day):
+            continue
+        for i in range(backups - 1, 0, -1):
+            if os.path.exists(f"{path}.{i}"):
+                os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+        os.replace(path, f"{path}.1")
+        rotated += 1
+    return rotated
+
+
+def prune_rotated_logs(max_age_days):
+    """
+    A beállított naplók forgatott mentései közül a max_age_days-nél régebbiek törlése.
+    Az éppen írt fájlhoz nem nyúl. Visszatérés: (törölt fájlok száma, felszabadított bájtok).
+    """
+    if _listener is None:
+        return 0, 0
+    cutoff = time.time() - max_age_days * 86400
+    removed = freed = 0
+    for handler in _listener.handlers:
+        base = getattr(handler, 'baseFilename', None)
+        if not base:
+            continue
+        directory, prefix = os.path.split(base)
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        for name in names:
+            suffix = name[len(prefix) + 1:]
+            if not name.startswith(prefix + '.') or not suffix.isdigit():
+                continue
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+                if stat.st_mtime < cutoff:
+                    os.remove(path)
+                    removed += 1
+                    freed += stat.st_size
+            except OSError:
+                continue  # közben a forgatás átnevezte / törölte
+    return removed, freed
+
+
+def _restart_listener_after_fork():
+    # A háttérszál nem öröklődik a fork során: a gyermek (pl. egy gunicorn worker, ha a master
+    # már beállította a logolást) saját szálat indít ugyanarra a sorra és kezelőkre.
+    global _listener
+    if _listener is not None:
+        _listener = logging.handlers.QueueListener(
+            _listener.queue, *_listener.handlers, respect_handler_level=True
+        )
+        _listener.start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_listener_after_fork)
@@ -0,0 +1,236 @@
+"""
+Háttér karbantartás: egy folyamaton belüli ütemező szál, ami a kérésektől függetlenül
+- törli a TTL-nél régebben inaktív, választás nélküli draftokat (ahol már van választás, azt
+  csak a naplóban jelzi: egy lassú meccset nem zár le győztes nélkül),
+- ANALYZE-t futtat (friss statisztika a lekérdezés-tervezőnek),
+- incremental VACUUM-mal visszaadja a szabad lapokat a fájlrendszernek,
+- törli a megőrzési időnél régebbi, forgatott logfájlokat,
+- több worker mellett (TI_LOG_SHARED=1) forgatja a közös naplófájlokat.
+Minden futás eredménye és ideje a szokásos naplóba kerül.
+
+Több worker folyamatnál mindegyikben elindul, de egy fájlzár (az adatbázis mellett) miatt
+mindig csak egy futtatja a feladatokat; ha az a worker leáll, a következő átveszi.
+
+Indítás: wsgi.py és a fejlesztői szerver (a parancssori "flask ..." parancsok NEM indítják).
+Kézi futtatás: flask --app app maintenance [feladat ...]
+
+Környezeti változók (az intervallumok másodpercben, 0 = a feladat kikapcsolva):
+    TI_MAINTENANCE                0 = az ütemező nem indul el (alap: 1)
+    TI_DRAFT_TTL                  ennyi inaktivitás után elhagyott egy draft (alap: 12 óra)
+    TI_MAINT_REAP_INTERVAL        draftok takarítása (alap: 15 perc)
+    TI_MAINT_ANALYZE_INTERVAL     ANALYZE (alap: 1 nap)
+    TI_MAINT_VACUUM_INTERVAL      incremental VACUUM (alap: 6 óra)
+    TI_MAINT_VACUUM_PAGES         egy futás legfeljebb ennyi lapot ad vissza (alap: 2000, 0 = mind)
+    TI_MAINT_LOG_PRUNE_INTERVAL   régi logok törlése (alap: 1 nap)
+    TI_MAINT_LOG_ROTATE_INTERVAL  közös naplók forgatásának ellenőrzése (alap: 5 perc)
+    TI_LOG_RETENTION_DAYS         ennyi napnál régebbi forgatott log törlődik (alap: 30)
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from draft_events import draft_events
+from db_manager import get_engine
+from logging_setup import prune_rotated_logs, rotate_shared_logs
+
+try:
+    import fcntl
+except ImportError:  # Windows: nincs fcntl, ott egy folyamat fut (fejlesztői szerver), zár sem kell
+    fcntl = None
+
+STARTUP_DELAY = 60       # az első futás legkésőbb ennyivel az indulás után (ne lassítsa az indulást)
+MIN_WAIT = 1.0
+
+MaintenanceJob = namedtuple('MaintenanceJob', 'name interval run')
+
+_scheduler = None
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+# --- FELADATOK ---
+# Mindegyik egy rövid összefoglalót ad vissza a naplóhoz.
+
+def reap_drafts(manager, ttl_seconds):
+    deleted, flagged = manager.reap_stale_drafts(datetime.now() - timedelta(seconds=ttl_seconds))
+    # A nyitott draft oldalak is tudják meg (ugyanaz az esemény, mint a véglegesítés gombnál)
+    for game_id in deleted:
+        draft_events.publish("finalized", {"game_id": game_id, "deleted": True})
+    summary = f"{len(deleted)} választás nélküli draft törölve"
+    if flagged:
+        summary += f"; régóta áll, de van választás (nem zárjuk le): {', '.join(map(str, flagged))}"
+    return summary
+
+
+def analyze(manager):
+    manager.analyze_database()
+    return "statisztika frissítve"
+
+
+def vacuum(manager, max_pages):
+    freed = manager.incremental_vacuum(max_pages)
+    if freed is None:
+        return "kihagyva (az auto_vacuum nem INCREMENTAL)"
+    return f"{freed} lap felszabadítva"
+
+
+def prune_logs(manager, retention_days):
+    removed, freed = prune_rotated_logs(retention_days)
+    return f"{removed} régi logfájl törölve ({freed / 1024 / 1024:.1f} MB)"
+
+
+def rotate_logs(manager):
+    rotated = rotate_shared_logs()
+    if rotated is None:
+        return "kihagyva (a naplókat a saját kezelőjük forgatja)"
+    return f"{rotated} naplófájl forgatva"
+
+
+JOB_NAMES = ('reap-drafts', 'analyze', 'vacuum', 'prune-logs', 'rotate-logs')
+
+
+def build_jobs(manager):
+    """A feladatok a környezeti változók szerinti intervallumokkal (a 0 intervallumúak is benne vannak)."""
+    ttl = _env_int('TI_DRAFT_TTL', 12 * 3600)
+    vacuum_pages = _env_int('TI_MAINT_VACUUM_PAGES', 2000)
+    retention_days = _env_int('TI_LOG_RETENTION_DAYS', 30)
+    return [
+        MaintenanceJob('reap-drafts', _env_int('TI_MAINT_REAP_INTERVAL', 15 * 60),
+                       lambda: reap_drafts(manager, ttl)),
+        MaintenanceJob('analyze', _env_int('TI_MAINT_ANALYZE_INTERVAL', 24 * 3600),
+                       lambda: analyze(manager)),
+        MaintenanceJob('vacuum', _env_int('TI_MAINT_VACUUM_INTERVAL', 6 * 3600),
+                       lambda: vacuum(manager, vacuum_pages)),
+        MaintenanceJob('prune-logs', _env_int('TI_MAINT_LOG_PRUNE_INTERVAL', 24 * 3600),
+                       lambda: prune_logs(manager, retention_days)),
+        MaintenanceJob('rotate-logs', _env_int('TI_MAINT_LOG_ROTATE_INTERVAL', 5 * 60),
+                       lambda: rotate_logs(manager)),
+    ]
+
+
+def run_job(manager, job):
+    """Egy feladat futtatása: idő mérése, naplózás; a hiba nem állítja le az ütemezőt."""
+    started = time.perf_counter()
+    try:
+        summary = job.run()
+    except Exception:
+        logging.exception(f"Karbantartás: '{job.name}' HIBA ({time.perf_counter() - started:.2f} s)")
+        return False
+    finally:
+        # A szál session-je ne tartson kapcsolatot a következő futásig
+        manager.close_session()
+    logging.info(f"Karbantartás: '{job.name}' kész ({time.perf_counter() - started:.2f} s): {summary}")
+    return True
+
+
+# --- ÜTEMEZŐ ---
+
+class MaintenanceScheduler:
+    def __init__(self, manager, jobs, lock_path=None):
+        self.manager = manager
+        self.jobs = [job for job in jobs if job.interval > 0]
+        self.lock_path = lock_path
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_file = None
+        now = time.monotonic()
+        self._next_run = {job.name: now + min(STARTUP_DELAY, job.interval) for job in self.jobs}
+
+    def start(self):
+        if not self.jobs:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='ti-maintenance', daemon=True)
+        self._thread.start()
+        logging.info("Karbantartás: ütemező elindult (" +
+                     ", ".join(f"{job.name}: {job.interval} s" for job in self.jobs) + ")")
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._release_lock()
+
+    def _acquire_lock(self):
+        """Csak egy folyamat futtat: aki megszerzi a fájlzárat, az tartja, amíg él."""
+        if fcntl is None or self.lock_path is None or self._lock_file is not None:
+            return True
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _release_lock(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _loop(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            due = [job for job in self.jobs if self._next_run[job.name] <= now]
+            # Ha más folyamat fogja a zárat, most ő dolgozik: csak átütemezünk
+            if due and self._acquire_lock():
+                for job in due:
+                    if self._stop.is_set():
+                        return
+                    run_job(self.manager, job)
+            for job in due:
+                self._next_run[job.name] = time.monotonic() + job.interval
+            self._stop.wait(max(MIN_WAIT, min(self._next_run.values()) - time.monotonic()))
+
+    def restart_after_fork(self):
+        # A szál nem öröklődik; a zár a szülőé marad (a gyermek a saját másolatát csak elengedi)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        if self._thread is not None:
+            self._thread = None
+            self.start()
+
+
+def start_maintenance(manager):
+    """Az ütemező elindítása ebben a folyamatban (egyszer). TI_MAINTENANCE=0: nem indul."""
+    global _scheduler
+    if _scheduler is not None:
+        return _scheduler
+    if os.environ.get('TI_MAINTENANCE', '1') == '0':
+        logging.info("Karbantartás: kikapcsolva (TI_MAINTENANCE=0).")
+        return None
+    _scheduler = MaintenanceScheduler(manager, build_jobs(manager), get_engine().url.database + '.maintenance.lock')
+    _scheduler.start()
+    atexit.register(stop_maintenance)
+    return _scheduler
+
+
+def stop_maintenance():
+    global _scheduler
+    if _scheduler is not None:
+        _scheduler.stop()
+        _scheduler = None
+
+
+def run_maintenance(manager, names=None):
+    """A megadott (alapból az összes) feladat egyszeri futtatása, az intervallumoktól függetlenül."""
+    jobs = [job for job in build_jobs(manager) if not names or job.name in names]
+    return all([run_job(manager, job) for job in jobs])
+
+
+def _restart_scheduler_after_fork():
+    if _scheduler is not None:
+        _scheduler.restart_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_scheduler_after_fork)
@@ -0,0 +1,205 @@
+"""
+Kérésenkénti mérés: végpontonkénti válaszidő, SQL lekérdezések száma és ideje.
+
+A Flask kérés eleje/vége és a SQLAlchemy before/after_cursor_execute eseményei között
+egy szálankénti "tracker" gyűjti a kérés lekérdezéseit. Az összesített értékek Prometheus
+szöveges formátumban a /metrics végponton olvashatók (folyamatonként: több worker esetén
+mindegyik a saját számait mutatja).
+
+Hibakereséshez: ha TI_DEBUG_QUERIES=1 (vagy debug módban fut az app), egy kérés
+"X-Debug-Queries: 1" fejléccel elküldve visszakapja a lekérdezések számát / idejét
+(X-Query-Count, Server-Timing), a lekérdezések listája pedig a logba kerül.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from flask import current_app, g, request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+DEBUG_HEADER = 'X-Debug-Queries'
+DEBUG_HEADER_MAX_CHARS = 8000
+
+metrics_log = logging.getLogger('ti.metrics')
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, n in zip(self.buckets, self.counts):
+            cumulative += n
+            yield f'{name}_bucket{{{labels},le="{bound:g}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f'{name}_sum{{{labels}}} {self.total:.6f}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class _EndpointStats:
+    __slots__ = ('latency', 'queries', 'sql_seconds', 'statuses')
+
+    def __init__(self):
+        self.latency = _Histogram(LATENCY_BUCKETS)
+        self.queries = _Histogram(QUERY_COUNT_BUCKETS)
+        self.sql_seconds = 0.0
+        self.statuses = {}
+
+
+class _QueryTracker:
+    """Egy kérés lekérdezései (szálanként egy aktív)."""
+    __slots__ = ('started', 'count', 'sql_seconds', 'statements', 'pending')
+
+    def __init__(self, keep_statements):
+        self.started = time.perf_counter()
+        self.count = 0
+        self.sql_seconds = 0.0
+        self.statements = [] if keep_statements else None
+        self.pending = []
+
+
+class RequestMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}      # endpoint -> _EndpointStats
+        self._gauges = []         # (név, leírás, függvény) - pl. gyorsítótár méret
+        self._local = threading.local()
+        self.debug_enabled = False
+
+    # --- BEKÖTÉS ---
+
+    def init_app(self, app, engine):
+        self.debug_enabled = os.environ.get('TI_DEBUG_QUERIES') == '1'
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        # Több create_app() hívás (ugyanazon a motoron) se számoljon duplán
+        if not event.contains(engine, "before_cursor_execute", self._before_cursor_execute):
+            event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def register_gauge(self, name, description, func):
+        """Egy pillanatnyi érték (függvény) felvétele a /metrics kimenetbe (azonos névvel: csere)."""
+        self._gauges = [gauge for gauge in self._gauges if gauge[0] != name]
+        self._gauges.append((name, description, func))
+
+    # --- SQLALCHEMY ESEMÉNYEK ---
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        tracker = getattr(self._local, 'tracker', None)
+        if tracker is not None:
+            tracker.pending.append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        tracker = getattr(self._local, 'tracker', None)
+        if tracker is None or not tracker.pending:
+            return
+        elapsed = time.perf_counter() - tracker.pending.pop()
+        tracker.count += 1
+        tracker.sql_seconds += elapsed
+        if tracker.statements is not None:
+            tracker.statements.append((round(elapsed * 1000, 3), re.sub(r'\s+', ' ', statement).strip()))
+
+    # --- FLASK KÉRÉS ÉLETCIKLUS ---
+
+    def _before_request(self):
+        keep = (self.debug_enabled or current_app.debug) and request.headers.get(DEBUG_HEADER) == '1'
+        self._local.tracker = _QueryTracker(keep)
+
+    def _after_request(self, response):
+        tracker = getattr(self._local, 'tracker', None)
+        if tracker is None:
+            return response
+        g.metrics_status = response.status_code
+        if tracker.statements is not None:
+            response.headers['X-Query-Count'] = str(tracker.count)
+            response.headers['Server-Timing'] = (
+                f'db;dur={tracker.sql_seconds * 1000:.2f};desc="{tracker.count} queries"'
+            )
+            dump = json.dumps(tracker.statements)  # fejlécben csak ASCII lehet
+            response.headers[DEBUG_HEADER] = dump[:DEBUG_HEADER_MAX_CHARS]
+            metrics_log.info(f"SQL ({request.method} {request.path}): {tracker.count} lekérdezés, "
+                             f"{tracker.sql_seconds * 1000:.1f} ms")
+            for ms, statement in tracker.statements:
+                metrics_log.info(f"    {ms:8.3f} ms | {statement}")
+        return response
+
+    def _teardown_request(self, exception=None):
+        tracker = getattr(self._local, 'tracker', None)
+        if tracker is None:
+            return
+        self._local.tracker = None
+        elapsed = time.perf_counter() - tracker.started
+        endpoint = request.endpoint or 'unknown'
+        status = 500 if exception is not None else g.get('metrics_status', 500)
+
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = _EndpointStats()
+            stats.latency.observe(elapsed)
+            stats.queries.observe(tracker.count)
+            stats.sql_seconds += tracker.sql_seconds
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+
+    # --- KIMENET ---
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+
+            lines.append('# HELP ti_request_duration_seconds Kérés feldolgozási ideje végpontonként.')
+            lines.append('# TYPE ti_request_duration_seconds histogram')
+            for endpoint, stats in endpoints:
+                lines.extend(stats.latency.lines('ti_request_duration_seconds', f'endpoint="{endpoint}"'))
+
+            lines.append('# HELP ti_request_queries SQL lekérdezések száma kérésenként.')
+            lines.append('# TYPE ti_request_queries histogram')
+            for endpoint, stats in endpoints:
+                lines.extend(stats.queries.lines('ti_request_queries', f'endpoint="{endpoint}"'))
+
+            lines.append('# HELP ti_request_sql_seconds_total Lekérdezésekkel töltött összes idő végpontonként.')
+            lines.append('# TYPE ti_request_sql_seconds_total counter')
+            for endpoint, stats in endpoints:
+                lines.append(f'ti_request_sql_seconds_total{{endpoint="{endpoint}"}} {stats.sql_seconds:.6f}')
+
+            lines.append('# HELP ti_requests_total Kérések száma végpontonként és státuszkódonként.')
+            lines.append('# TYPE ti_requests_total counter')
+            for endpoint, stats in endpoints:
+                for status, n in sorted(stats.statuses.items()):
+                    lines.append(f'ti_requests_total{{endpoint="{endpoint}",status="{status}"}} {n}')
+
+        for name, description, func in self._gauges:
+            try:
+                value = func()
+            except Exception as e:
+                metrics_log.warning(f"Metrika ({name}) nem olvasható: {e}")
+                continue
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,61 @@
+"""
+Játékos értékszám (Elo) adatbázis nélkül: egy lezárt, győztessel rendelkező meccs hatása.
+
+Egy TI meccsből csak a győztes ismert (helyezések nincsenek), ezért a győztes párban "legyőzte"
+az összes többi résztvevőt; a vesztesek egymás közti sorrendjéről nincs információ. A K-faktort
+elosztjuk az ellenfelek számával, így egy meccsen a győztes legfeljebb K pontot nyerhet, és a
+változások összege mindig nulla.
+
+A db_manager ebből számolja a tárolt értékszámokat és a meccsenkénti pillanatképeket.
+"""
+
+INITIAL_RATING = 1500.0
+K_FACTOR = 32.0
+
+
+def expected_score(rating, opponent_rating):
+    """Annak esélye, hogy a 'rating' erejű játékos megveri az 'opponent_rating' erejűt."""
+    return 1.0 / (1.0 + 10.0 ** ((opponent_rating - rating) / 400.0))
+
+
+def game_deltas(ratings, winner_index, k_factor=K_FACTOR):
+    """
+    Egy meccs értékszám-változásai.
+    ratings: a résztvevők értékszáma a meccs ELŐTT; winner_index: a győztes indexe ebben a listában.
+    Visszatérés: a változások ugyanabban a sorrendben.
+    """
+    deltas = [0.0] * len(ratings)
+    if len(ratings) < 2:
+        return deltas
+    k = k_factor / (len(ratings) - 1)
+    winner_rating = ratings[winner_index]
+    for i, rating in enumerate(ratings):
+        if i == winner_index:
+            continue
+        # A győztes "meglepetés-faktora" ez ellen a vesztes ellen
+        gain = k * (1.0 - expected_score(winner_rating, rating))
+        deltas[winner_index] += gain
+        deltas[i] -= gain
+    return deltas
+
+
+def replay(games, start_ratings, k_factor=K_FACTOR):
+    """
+    Meccsek sorozatának újrajátszása időrendben.
+    games: [(game_id, [player_id, ...], winner_id), ...] - időrendben; a győztes nélküli (vagy a
+    győztest a résztvevők közt nem tartalmazó) meccsek kimaradnak.
+    start_ratings: player_id -> értékszám a sorozat előtt (aki nincs benne: INITIAL_RATING). NEM módosul.
+    Visszatérés: (ratings, snapshots) - ratings: a végső értékszámok (minden érintett játékos),
+    snapshots: [(game_id, player_id, előtte, utána), ...] meccsenként, résztvevőnként.
+    """
+    ratings = dict(start_ratings)
+    snapshots = []
+    for game_id, player_ids, winner_id in games:
+        if winner_id not in player_ids:
+            continue
+        before = [ratings.get(p_id, INITIAL_RATING) for p_id in player_ids]
+        deltas = game_deltas(before, player_ids.index(winner_id), k_factor)
+        for p_id, old, delta in zip(player_ids, before, deltas):
+            ratings[p_id] = old + delta
+            snapshots.append((game_id, p_id, old, old + delta))
+    return ratings, snapshots
@@ -0,0 +1,198 @@
+"""
+Offline Monte Carlo draft szimulátor.
+
+Sok egymást követő sorsolást futtat le ugyanazokkal a szabályokkal, mint az éles draft motor
+(draft_rules.build_draft_pool), de adatbázis és session nélkül: a játékosok előzményei
+bitmaszkokként élnek a memóriában. Megmutatja:
+  - milyen gyakran lép életbe az egyes VÉSZTERV lépcső (játékosonként és sorsolásonként),
+  - fajonként mennyiszer kínálta fel a gép,
+  - ugyanaz a faj hány sorsolás után kerül újra ugyanannak a játékosnak a kínálatába.
+A --engine kapcsolóval a mohó (greedy) és az optimalizáló (solver) motor összevethető.
+
+Használat:
+    python simulate_draft.py --table 6 --drafts 100000
+    python simulate_draft.py --group 10 --table 6,7,8 --drafts 1000000 --workers 8 --json sim.json
+    python simulate_draft.py --table 8 --drafts 20000 --engine greedy
+"""
+import argparse
+import json
+import random
+import time
+from collections import Counter
+from multiprocessing import Pool
+
+from draft_rules import (build_draft_pool, solve_draft_assignment, ids_to_mask, mask_to_ids,
+                         DRAFT_RELAX_MESSAGES, DRAFT_ENGINES, DRAFT_ENGINE_SOLVER, DEFAULT_DRAFT_ENGINE)
+
+TIER_NAMES = [
+    "Ideális",
+    "1. VÉSZTERV (kínálat history elengedve)",
+    "2. VÉSZTERV (előző meccs tiltás elengedve)",
+    "3. VÉSZTERV (saját utolsó 2 választás elengedve)",
+    "VÉGSŐ (nincs elég faj, bármi jöhet)",
+]
+assert len(TIER_NAMES) == len(DRAFT_RELAX_MESSAGES) + 1
+
+MAX_DISTANCE = 10  # az ennél távolabbi ismétlődések egy "10+" kosárba kerülnek
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="TI4 draft Monte Carlo szimuláció")
+    parser.add_argument('--factions', type=int, default=25, help="fajok száma a katalógusban")
+    parser.add_argument('--table', default="6",
+                        help="asztalméret sorsolásonként, vesszővel több is (pl. 6,7,8 -> véletlenszerűen)")
+    parser.add_argument('--group', type=int, default=0,
+                        help="a társaság létszáma (alapból = a legnagyobb asztal); mindig közülük ül le valaki")
+    parser.add_argument('--drafts', type=int, default=100000, help="szimulált sorsolások száma összesen")
+    parser.add_argument('--pick-rate', type=float, default=1.0,
+                        help="mekkora eséllyel választ egy játékos (aki nem választ, azt a lezárás törli)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="párhuzamos folyamatok száma (mindegyik saját, független sorozatot futtat)")
+    parser.add_argument('--engine', choices=DRAFT_ENGINES, default=DEFAULT_DRAFT_ENGINE,
+                        help="draft motor: greedy (játékosonként) vagy solver (az egész asztal egyszerre); "
+                             "alapból mint élesben (TI_DRAFT_ENGINE, ha nincs: solver)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="eredmény mentése JSON-be")
+    return parser.parse_args()
+
+
+def simulate_chain(n_factions, table_sizes, group_size, n_drafts, pick_rate, engine, seed):
+    """Egy sorozat egymás utáni sorsolás (egy "társaság" élete). A számlálókat adja vissza."""
+    rng = random.Random(seed)
+    all_mask = ids_to_mask(range(1, n_factions + 1))
+    players = list(range(group_size))
+
+    # Játékosonkénti állapot: utolsó 2 választás és utolsó 2 kínálat bitmaszkként
+    last_picks = [[0, 0] for _ in players]
+    last_offers = [[0, 0] for _ in players]
+    drafts_seen = [0] * group_size                 # hány sorsoláson volt már (ismétlési távolsághoz)
+    last_offered_at = [dict() for _ in players]     # faj -> melyik (saját) sorsolásán látta utoljára
+
+    tier_counts = Counter()        # játékos-sorsolásonként
+    draft_max_tier = Counter()     # sorsolásonként a legrosszabb lépcső
+    offer_counts = Counter()
+    repeat_distance = Counter()
+    global_ban_mask = 0
+
+    for _ in range(n_drafts):
+        seated = rng.sample(players, rng.choice(table_sizes))  # sample = már meg is keverte
+        session_mask = 0
+        worst_tier = 0
+        picks_this_game = 0
+
+        histories = [(last_picks[p][0] | last_picks[p][1], last_offers[p][0] | last_offers[p][1]) for p in seated]
+        assignment = None
+        if engine == DRAFT_ENGINE_SOLVER:
+            assignment = solve_draft_assignment(all_mask, histories, global_ban_mask, rng)
+
+        for index, p in enumerate(seated):
+            played_mask, offered_mask = histories[index]
+
+            if assignment:
+                drawn, tier = assignment[index]
+            else:
+                pool_mask, tier = build_draft_pool(all_mask, played_mask, offered_mask, session_mask, global_ban_mask)
+                drawn = rng.sample(mask_to_ids(pool_mask), 3)
+            drawn_mask = ids_to_mask(drawn)
+            session_mask |= drawn_mask
+
+            tier_counts[tier] += 1
+            worst_tier = max(worst_tier, tier)
+            offer_counts.update(drawn)
+
+            if rng.random() >= pick_rate:
+                # Nem választott -> a lezáráskor törlődik, mintha nem is lett volna ott
+                continue
+
+            pick = rng.choice(drawn)
+            picks_this_game |= 1 << pick
+            last_picks[p] = [last_picks[p][1], 1 << pick]
+            last_offers[p] = [last_offers[p][1], drawn_mask]
+
+            drafts_seen[p] += 1
+            seen_at = last_offered_at[p]
+            for f in drawn:
+                if f in seen_at:
+                    repeat_distance[min(drafts_seen[p] - seen_at[f], MAX_DISTANCE)] += 1
+                seen_at[f] = drafts_seen[p]
+
+        draft_max_tier[worst_tier] += 1
+        if picks_this_game:
+            # Ha senki nem választott, a játék törlődik, a globális tiltás a régi marad
+            global_ban_mask = picks_this_game
+
+    return tier_counts, draft_max_tier, offer_counts, repeat_distance
+
+
+def _run_chain(job):
+    return simulate_chain(*job)
+
+
+def merge(results):
+    merged = [Counter() for _ in range(4)]
+    for result in results:
+        for total, part in zip(merged, result):
+            total.update(part)
+    return merged
+
+
+def print_report(tier_counts, draft_max_tier, offer_counts, repeat_distance, n_drafts, elapsed):
+    total_slots = sum(tier_counts.values())
+    print(f"\n{n_drafts} sorsolás, {total_slots} játékos-kínálat, {elapsed:.1f} s "
+          f"({n_drafts / elapsed:,.0f} sorsolás/s)")
+
+    print("\nVésztervek (játékosonként | sorsolásonként a legrosszabb):")
+    for tier, name in enumerate(TIER_NAMES):
+        per_slot = 100 * tier_counts[tier] / total_slots if total_slots else 0
+        per_draft = 100 * draft_max_tier[tier] / n_drafts if n_drafts else 0
+        print(f"  {name:<50} {per_slot:7.3f}%  | {per_draft:7.3f}%")
+
+    print("\nFelkínálás fajonként (egyenletes eloszlástól való eltérés):")
+    expected = sum(offer_counts.values()) / len(offer_counts) if offer_counts else 0
+    for faction_id in sorted(offer_counts):
+        count = offer_counts[faction_id]
+        print(f"  #{faction_id:<3} {count:>10}  ({100 * (count / expected - 1):+6.2f}%)")
+
+    print("\nIsmételt felkínálás távolsága (hány saját sorsolás múlva látja újra ugyanazt):")
+    total_repeats = sum(repeat_distance.values())
+    for distance in sorted(repeat_distance):
+        label = f"{distance}+" if distance == MAX_DISTANCE else str(distance)
+        print(f"  {label:>3}  {100 * repeat_distance[distance] / total_repeats:6.2f}%")
+
+
+def main():
+    args = parse_args()
+    table_sizes = [int(x) for x in args.table.split(',')]
+    group_size = max(args.group, max(table_sizes))
+
+    workers = max(1, args.workers)
+    per_worker = [args.drafts // workers + (1 if i < args.drafts % workers else 0) for i in range(workers)]
+    jobs = [(args.factions, table_sizes, group_size, n, args.pick_rate, args.engine, args.seed + i)
+            for i, n in enumerate(per_worker) if n]
+
+    t0 = time.perf_counter()
+    if len(jobs) == 1:
+        results = [_run_chain(jobs[0])]
+    else:
+        with Pool(len(jobs)) as pool:
+            results = pool.map(_run_chain, jobs)
+    tier_counts, draft_max_tier, offer_counts, repeat_distance = merge(results)
+    elapsed = time.perf_counter() - t0
+
+    print_report(tier_counts, draft_max_tier, offer_counts, repeat_distance, args.drafts, elapsed)
+
+    if args.json:
+        report = {
+            "params": vars(args),
+            "tiers_per_player": {TIER_NAMES[t]: tier_counts[t] for t in range(len(TIER_NAMES))},
+            "tiers_per_draft": {TIER_NAMES[t]: draft_max_tier[t] for t in range(len(TIER_NAMES))},
+            "offers_per_faction": dict(sorted(offer_counts.items())),
+            "repeat_offer_distance": {str(k): v for k, v in sorted(repeat_distance.items())},
+        }
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nEredmény mentve: {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+"""
+WSGI belépési pont (gunicorn, PythonAnywhere, stb.):
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+PythonAnywhere WSGI fájlban: from wsgi import application
+
+A háttér karbantartás (maintenance.py) is itt indul, workerenként; a feladatokat egyszerre
+csak egy worker futtatja.
+"""
+from app import create_app, db
+from maintenance import start_maintenance
+
+app = application = create_app()
+start_maintenance(db)